@@ -0,0 +1,21 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking pymongo calls from the bot's async handlers run on this pool, so a slow
+# query only holds up the update that made it. pymongo's connection pool is
+# thread-safe; DB_WORKERS caps how many queries the bot has in flight at once.
+DB_WORKERS = int(os.getenv('BOT_DB_WORKERS', '16'))
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='bot-db')
+
+
+async def run(fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) on the database pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=True)
@@ -0,0 +1,62 @@
+import asyncio
+import random
+import time
+
+from common import get_bench_db, seed_users
+
+import async_db
+
+UPDATES = 2000
+CONCURRENCY = [1, 8, 32, 64]
+TELEGRAM_LATENCY = 0.05  # Simulated round trip to the Bot API per reply
+SLOW_QUERY_EVERY = 100  # One update in this many runs a deliberately slow query
+
+
+def get_score(collection, identifier: str, slow: bool) -> int:
+    query = {'identifier': identifier}
+    if slow:
+        query['$where'] = 'sleep(200) || true'
+    user = collection.find_one(query, {'score': 1})
+    return user.get('score', 0) if user else 0
+
+
+async def blocking_handler(collection, identifier: str, slow: bool) -> None:
+    """The old handlers: pymongo called straight on the event loop."""
+    get_score(collection, identifier, slow)
+    await asyncio.sleep(TELEGRAM_LATENCY)
+
+
+async def pooled_handler(collection, identifier: str, slow: bool) -> None:
+    await async_db.run(get_score, collection, identifier, slow)
+    await asyncio.sleep(TELEGRAM_LATENCY)
+
+
+async def dispatch(handler, collection, identifiers: list, concurrency: int) -> float:
+    """Process UPDATES updates with at most `concurrency` in flight, like concurrent_updates(n)."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await handler(collection, random.choice(identifiers), i % SLOW_QUERY_EVERY == 0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(UPDATES)))
+    return UPDATES / (time.perf_counter() - started)
+
+
+def main():
+    db = get_bench_db()
+    collection = db['user_scores']
+    seed_users(collection, 10_000)
+    collection.create_index('identifier')
+    identifiers = [user['identifier'] for user in collection.find({}, {'identifier': 1}).limit(1000)]
+
+    for concurrency in CONCURRENCY:
+        for label, handler in (('blocking pymongo on the loop', blocking_handler), ('async_db executor', pooled_handler)):
+            rate = asyncio.run(dispatch(handler, collection, identifiers, concurrency))
+            print(f"{label:<32} concurrency={concurrency:<3} {rate:9.1f} updates/s")
+    async_db.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import random
+
+from common import get_bench_db, seed_users, time_calls, report
+
+from leaderboard import Leaderboard
+
+USERS = 150_000
+ITERATIONS = 1000
+
+
+def aggregate_top(collection, board: str, limit: int):
+    """The old per-button-press sort aggregation."""
+    return list(collection.aggregate([{'$sort': {board: -1}}, {'$limit': limit}]))
+
+
+def main():
+    db = get_bench_db()
+    collection = db['user_scores']
+    seed_users(collection, USERS)
+
+    board = Leaderboard(collection)
+    board.load()
+    members = list(board.boards['weekly_score']._scores)
+
+    report('aggregate $sort weekly_score (top 20)', time_calls(lambda: aggregate_top(collection, 'weekly_score', 20), 20))
+    report('aggregate $sort weekly_referrals (top 10)', time_calls(lambda: aggregate_top(collection, 'weekly_referrals', 10), 20))
+    report('in-memory top 20', time_calls(lambda: board.top('weekly_score', 20), ITERATIONS))
+    report('in-memory rank + neighbours', time_calls(lambda: board.rank('weekly_score', random.choice(members)), ITERATIONS))
+    report('in-memory write-through incr', time_calls(lambda: board.incr('weekly_score', random.choice(members), 10), ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
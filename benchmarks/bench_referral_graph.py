@@ -0,0 +1,53 @@
+import random
+import time
+
+from common import get_bench_db, make_user, time_calls, report
+
+from referral_graph import ReferralGraph
+
+USER_COUNTS = [100_000, 1_000_000]
+REFERRED_SHARE = 0.7
+BATCH_SIZE = 10_000
+ITERATIONS = 200
+
+
+def seed_referral_tree(collection, target: int) -> None:
+    """Top the collection up to `target` users, most of them referred by an earlier user."""
+    identifiers = [user['identifier'] for user in collection.find({}, {'identifier': 1})]
+    while len(identifiers) < target:
+        batch = []
+        for _ in range(min(BATCH_SIZE, target - len(identifiers))):
+            referrer = random.choice(identifiers) if identifiers and random.random() < REFERRED_SHARE else None
+            user = make_user(referrer=referrer)
+            identifiers.append(user['identifier'])
+            batch.append(user)
+        collection.insert_many(batch, ordered=False)
+        print(f"Seeded {len(identifiers)}/{target} users")
+
+
+def main():
+    db = get_bench_db()
+    collection = db['referral_tree']
+    collection.drop()
+
+    for target in USER_COUNTS:
+        seed_referral_tree(collection, target)
+        graph = ReferralGraph(collection)
+        started = time.perf_counter()
+        graph.load()
+        print(f"\n=== {target} users: full load {time.perf_counter() - started:.2f}s ===")
+        identifiers = [top['identifier'] for top in graph.top_referrers(1000)]
+        sample = random.sample(graph.ids, 1000)
+
+        report('top referrers (cached)', time_calls(lambda: graph.top_referrers(20), ITERATIONS))
+        report('subtree size', time_calls(lambda: graph.subtree_size(random.choice(sample)), ITERATIONS))
+        report('descendants depth 3 (large referrers)', time_calls(lambda: graph.descendants(random.choice(identifiers), 3), ITERATIONS))
+        report('descendants depth 3 (random users)', time_calls(lambda: graph.descendants(random.choice(sample), 3), ITERATIONS))
+        report('anomalies', time_calls(graph.anomalies, 10))
+
+        collection.insert_many([make_user(referrer=random.choice(sample)) for _ in range(1000)])
+        report('incremental refresh (+1000 users)', time_calls(graph.refresh, 1))
+
+
+if __name__ == '__main__':
+    main()
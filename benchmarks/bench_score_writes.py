@@ -0,0 +1,62 @@
+import random
+import threading
+import time
+
+from common import get_bench_db, seed_users
+
+import score_events
+import write_buffer
+
+HOT_PLAYERS = 20
+RESULTS = 20_000
+THREADS = 8
+
+
+def write_ops(db) -> int:
+    counters = db.command('serverStatus')['opcounters']
+    return counters['insert'] + counters['update']
+
+
+def run(db, submit) -> tuple:
+    """Post RESULTS game results for HOT_PLAYERS players from THREADS threads."""
+    players = [user['username'] for user in db['user_scores'].find({}, {'username': 1}).limit(HOT_PLAYERS)]
+
+    def worker(count):
+        for _ in range(count):
+            submit(random.choice(players), random.randint(1, 100))
+
+    ops_before = write_ops(db)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(RESULTS // THREADS,)) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return started, ops_before
+
+
+def main():
+    db = get_bench_db()
+    users, events = db['user_scores'], db['score_events']
+    seed_users(users, 10_000)
+    score_events.ensure_indexes(events)
+
+    started, ops_before = run(db, lambda username, score: score_events.apply_score(
+        users, events, {'username': username}, score
+    ))
+    elapsed = time.perf_counter() - started
+    ops = write_ops(db) - ops_before
+    print(f"{'direct apply_score':<32} {RESULTS / elapsed:9.0f} results/s  {ops / elapsed:9.0f} write ops/s  ({ops} ops)")
+
+    buffer = write_buffer.ScoreWriteBuffer(users, events)
+    buffer.start()
+    started, ops_before = run(db, buffer.submit)
+    buffer.stop()
+    elapsed = time.perf_counter() - started
+    ops = write_ops(db) - ops_before
+    print(f"{'ScoreWriteBuffer':<32} {RESULTS / elapsed:9.0f} results/s  {ops / elapsed:9.0f} write ops/s  ({ops} ops)")
+    print(buffer.metrics())
+
+
+if __name__ == '__main__':
+    main()
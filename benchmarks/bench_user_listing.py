@@ -0,0 +1,67 @@
+import random
+
+from common import get_bench_db, seed_users, time_calls, report
+
+import pagination
+import score_stats
+
+SIZES = [10_000, 150_000, 1_000_000]
+ITERATIONS = 100
+PAGE_SIZE = 10
+
+
+def legacy_get_users(collection, page: int, limit: int):
+    """The old /api/user_scores pipeline that $push'ed every user into one document."""
+    skip = (page - 1) * limit
+    pipeline = [
+        {'$group': {'_id': None, 'totalScore': {'$sum': '$score'}, 'count': {'$sum': 1}, 'allUsers': {'$push': '$$ROOT'}}},
+        {'$project': {
+            'stats': {'totalScore': '$totalScore', 'count': '$count'},
+            'topPerformers': {'$slice': [{'$sortArray': {'input': '$allUsers', 'sortBy': {'score': -1}}}, 0, 3]},
+            'paginatedUsers': {'$slice': ['$allUsers', skip, limit]}
+        }}
+    ]
+    return list(collection.aggregate(pipeline, allowDiskUse=True))
+
+
+def indexed_get_users(collection, stats_collection, page: int, limit: int, sort: str):
+    """The index-driven path now used by /api/user_scores."""
+    users = pagination.fetch_page(collection, {}, page, limit, sort)
+    top = pagination.top_performers(collection)
+    stats = score_stats.get_stats(collection, stats_collection)
+    return users, top, stats
+
+
+def main():
+    db = get_bench_db()
+    collection = db['user_scores']
+    stats_collection = db['score_stats']
+    pagination.ensure_indexes(collection)
+
+    for size in SIZES:
+        seed_users(collection, size)
+        stats_collection.delete_many({})
+        max_page = size // PAGE_SIZE
+        print(f"\n=== {size} users ===")
+
+        try:
+            samples = time_calls(lambda: legacy_get_users(collection, random.randint(1, 50), PAGE_SIZE), 5)
+            report('legacy $push pipeline', samples)
+        except Exception as e:
+            print(f"legacy $push pipeline failed: {e}")
+
+        for sort in pagination.SORT_ORDERS:
+            report(f'indexed page (sort={sort}, first 50 pages)',
+                   time_calls(lambda: indexed_get_users(collection, stats_collection, random.randint(1, 50), PAGE_SIZE, sort), ITERATIONS))
+            report(f'indexed page (sort={sort}, any page)',
+                   time_calls(lambda: indexed_get_users(collection, stats_collection, random.randint(1, max_page), PAGE_SIZE, sort), ITERATIONS))
+
+            # Keyset mode: resume from random positions anywhere in the collection
+            anchors = list(collection.aggregate([{'$sample': {'size': ITERATIONS}}, {'$project': {'score': 1}}]))
+            cursors = iter([pagination.encode_cursor(doc, sort) for doc in anchors])
+            report(f'keyset page (sort={sort}, any position)',
+                   time_calls(lambda: pagination.fetch_after(collection, {}, next(cursors), PAGE_SIZE, sort), ITERATIONS))
+
+
+if __name__ == '__main__':
+    main()
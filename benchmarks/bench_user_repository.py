@@ -0,0 +1,76 @@
+import random
+from datetime import datetime
+
+import bson
+from bson import ObjectId
+from pymongo import MongoClient, monitoring
+
+from common import BENCH_MONGO_URI, BENCH_DB_NAME, make_user, report, time_calls
+
+from user_repository import UserRepository
+
+USERS = 2000
+ITERATIONS = 2000
+TASK_STATES = 300  # Per user; with score_days and wallet keys this makes ~40KB documents
+SCORE_DAYS = 16
+
+
+class ReplyBytes(monitoring.CommandListener):
+    """Adds up the BSON size of every find reply."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name == 'find':
+            self.bytes += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+def large_user() -> dict:
+    now = datetime.now()
+    return make_user(
+        task_states={
+            str(ObjectId()): {'status': 'claimed', 'evidence': f'https://example.com/proof/{ObjectId()}', 'timestamp': now}
+            for _ in range(TASK_STATES)
+        },
+        score_days={str(day): {'day': 20000 + day, 'total': random.randint(0, 500), 'count': 3} for day in range(SCORE_DAYS)},
+        bep20_wallet_address='0x' + ObjectId().binary.hex() * 2,
+        bep20_wallet_private_key='0x' + ObjectId().binary.hex() * 5,
+        ton_wallet='UQ' + ObjectId().binary.hex() * 4
+    )
+
+
+def main():
+    listener = ReplyBytes()
+    collection = MongoClient(BENCH_MONGO_URI, event_listeners=[listener])[BENCH_DB_NAME]['user_repository']
+    if collection.estimated_document_count() < USERS:
+        collection.drop()
+        collection.insert_many([large_user() for _ in range(USERS)])
+        collection.create_index('identifier')
+        collection.create_index('username')
+    identifiers = [user['identifier'] for user in collection.find({}, {'identifier': 1})]
+    repository = UserRepository(collection)
+
+    cases = [
+        ('score: full document', lambda i: collection.find_one({'identifier': i}).get('score', 0)),
+        ('score: UserRepository.score', lambda i: repository.score(identifier=i).score),
+        ('referral_code: full document', lambda i: collection.find_one({'identifier': i}).get('referral_code')),
+        ('referral_code: UserRepository.referral', lambda i: repository.referral(identifier=i).referral_code),
+        ('wallet: full document', lambda i: collection.find_one({'identifier': i}).get('bep20_wallet_address')),
+        ('wallet: UserRepository.wallets', lambda i: repository.wallets(identifier=i).bep20_wallet_address),
+    ]
+    for label, call in cases:
+        listener.bytes = 0
+        samples = time_calls(lambda: call(random.choice(identifiers)), ITERATIONS)
+        report(label, samples)
+        print(f"{'':<48} {listener.bytes / ITERATIONS:9.0f} reply bytes/call")
+
+
+if __name__ == '__main__':
+    main()
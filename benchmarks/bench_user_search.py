@@ -0,0 +1,36 @@
+from common import get_bench_db, seed_users, time_calls, report
+
+import pagination
+import user_search
+
+# Same size as the dataset generate_users.py builds
+USERS = 150_000
+ITERATIONS = 50
+QUERIES = ['whale', 'lucky', 'goldenking', 'olden', 'ape12', 'ter99', 'zz', '(a+)+$']
+
+
+def legacy_search(collection, username: str):
+    """The old unanchored, case-insensitive, unescaped $regex search."""
+    return list(collection.find({'username': {'$regex': username, '$options': 'i'}}).limit(100))
+
+
+def main():
+    db = get_bench_db()
+    collection = db['user_scores']
+    seed_users(collection, USERS)
+    user_search.ensure_indexes(collection)
+    user_search.backfill(collection, batch_size=5000, pause=0)
+
+    for query in QUERIES:
+        print(f"\n=== query {query!r} ===")
+        try:
+            report('legacy $regex', time_calls(lambda: legacy_search(collection, query), ITERATIONS))
+        except Exception as e:
+            print(f"legacy $regex failed: {e}")
+        report('prefix + trigram search', time_calls(
+            lambda: user_search.search(collection, query, 50, pagination.LIST_PROJECTION), ITERATIONS))
+        print(f"top matches: {[user['username'] for user in user_search.search(collection, query, 5)]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import random
+from datetime import datetime, timedelta
+
+from common import get_bench_db, make_user, time_calls, report
+
+import score_ring
+
+HEAVY_USERS = 50
+ENTRIES_PER_USER = [10_000, 20_000]
+ITERATIONS = 200
+
+
+def legacy_weekly_score(collection, identifier: str) -> int:
+    """The old get_weekly_score: load the whole document and sum recent entries in Python."""
+    nine_days_ago = datetime.utcnow() - timedelta(days=9)
+    user = collection.find_one({'identifier': identifier})
+    if not user or 'scores' not in user:
+        return 0
+    return sum(record['score'] for record in user['scores'] if record['timestamp'] >= nine_days_ago)
+
+
+def ring_weekly_score(collection, identifier: str, days: int = 9) -> int:
+    user = collection.find_one({'identifier': identifier}, {'score_days': 1})
+    return score_ring.window_total(user, days)
+
+
+def heavy_user(entries: int) -> dict:
+    """A user with `entries` score events spread over the last 60 days, stored both ways."""
+    now = datetime.now()
+    scores = []
+    rings = {}
+    for _ in range(entries):
+        timestamp = now - timedelta(minutes=random.randint(0, 60 * 24 * 60))
+        score = random.randint(1, 100)
+        scores.append({'score': score, 'timestamp': timestamp})
+    for record in sorted(scores, key=lambda r: r['timestamp']):
+        day = score_ring.day_number(record['timestamp'])
+        slot = rings.get(f'd{day % score_ring.RING_DAYS}')
+        if slot and slot['day'] == day:
+            slot['total'] += record['score']
+        else:
+            rings[f'd{day % score_ring.RING_DAYS}'] = {'day': day, 'total': record['score']}
+    return make_user(scores=scores, score_days=rings)
+
+
+def main():
+    db = get_bench_db()
+    collection = db['heavy_users']
+    collection.drop()
+    collection.create_index('identifier')
+
+    for entries in ENTRIES_PER_USER:
+        users = [heavy_user(entries) for _ in range(HEAVY_USERS)]
+        collection.insert_many(users)
+        identifiers = [user['identifier'] for user in users]
+        print(f"\n=== {entries} score entries per user ===")
+        report('legacy full document + Python sum', time_calls(lambda: legacy_weekly_score(collection, random.choice(identifiers)), ITERATIONS))
+        for days in (1, 7, 9, 30):
+            report(f'ring counters ({days}-day window)', time_calls(lambda: ring_weekly_score(collection, random.choice(identifiers), days), ITERATIONS))
+        collection.delete_many({})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+from common import get_bench_db, make_user
+
+import task_states
+
+ATTEMPTS = 100
+SCORE = 250
+
+
+def race(collection, events_collection, user: dict, task_id) -> list:
+    """Fire ATTEMPTS concurrent claims of the same approved task; returns each result."""
+    collection.delete_many({})
+    events_collection.delete_many({})
+    collection.insert_one(user)
+    barrier = threading.Barrier(ATTEMPTS)
+
+    def attempt(_):
+        barrier.wait()
+        return task_states.claim(collection, events_collection, user['username'], task_id, SCORE)
+
+    with ThreadPoolExecutor(max_workers=ATTEMPTS) as pool:
+        return list(pool.map(attempt, range(ATTEMPTS)))
+
+
+def main():
+    db = get_bench_db()
+    collection = db['claim_reward_race']
+    events_collection = db['claim_reward_race_events']
+    collection.drop()
+    collection.create_index('username')
+    task_id = ObjectId()
+    approved = {'status': 'approved', 'evidence': 'https://example.com/proof'}
+    cases = [
+        ('map task_states', {'task_states': {str(task_id): dict(approved)}}),
+        ('legacy list task_states', {'task_states': [{'task_id': task_id, **approved}]}),
+    ]
+
+    failed = False
+    for label, overrides in cases:
+        user = make_user(score=0, **overrides)
+        results = race(collection, events_collection, user, task_id)
+        claimed = sum(1 for result in results if result is not None)
+        stored = collection.find_one({'_id': user['_id']}, {'score': 1, 'task_states': 1})
+        status = task_states.get(stored, task_id)['status']
+        logged = sum(bucket['total'] for bucket in events_collection.find({'user_id': user['_id']}))
+        ok = claimed == 1 and stored['score'] == SCORE and status == 'claimed' and logged == SCORE
+        failed = failed or not ok
+        print(f"{'ok' if ok else 'FAIL':<5} {label:<28} {claimed}/{ATTEMPTS} claims succeeded, "
+              f"score={stored['score']}, logged={logged}, status={status}")
+    collection.drop()
+    events_collection.drop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
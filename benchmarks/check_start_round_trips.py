@@ -0,0 +1,77 @@
+import sys
+import uuid
+
+from pymongo import MongoClient, monitoring
+
+from common import BENCH_MONGO_URI, BENCH_DB_NAME
+
+import referrals
+import user_bootstrap
+
+BUDGET = 2  # Mongo round trips allowed per /start
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue'}
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def start(collection, credits, identifier: str, referrer: str = None) -> None:
+    """What bot.register_user does against Mongo for one /start."""
+    result = user_bootstrap.bootstrap(collection, identifier, 12345678, identifier, 'code' + identifier[:4], referrer)
+    if result['referred']:
+        credits.record(referrer, identifier)
+
+
+def main():
+    counter = CommandCounter()
+    db = MongoClient(BENCH_MONGO_URI, event_listeners=[counter])[BENCH_DB_NAME]
+    collection, edges = db['start_round_trips'], db['start_round_trip_edges']
+    collection.drop()
+    edges.drop()
+    collection.create_index('identifier', unique=True)
+    referrals.ensure_indexes(edges)
+    credits = referrals.ReferralCredits(collection, edges)
+
+    referrer = f'ref_{uuid.uuid4().hex[:8]}'
+    newcomer = f'new_{uuid.uuid4().hex[:8]}'
+    cases = [
+        ('new user', lambda: start(collection, credits, referrer)),
+        ('returning user', lambda: start(collection, credits, referrer)),
+        ('new user with referral link', lambda: start(collection, credits, newcomer, referrer)),
+        ('returning user with referral link', lambda: start(collection, credits, newcomer, referrer)),
+        ('self referral', lambda: start(collection, credits, referrer, referrer)),
+    ]
+
+    failed = False
+    for label, run in cases:
+        counter.commands.clear()
+        run()
+        over = len(counter.commands) > BUDGET
+        failed = failed or over
+        print(f"{'FAIL' if over else 'ok':<5} {label:<36} {len(counter.commands)} round trips {counter.commands}")
+
+    # Rewards are paid by the ledger flusher, outside /start
+    credits.flush()
+    user = collection.find_one({'identifier': referrer})
+    if user['referral_count'] != 1 or user['score'] != referrals.REFERRAL_REWARD:
+        print(f"FAIL  referrer was credited {user['referral_count']} times")
+        failed = True
+    collection.drop()
+    edges.drop()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from generate_users import generate_username, generate_referral_code, generate_score  # noqa: E402
+from user_search import search_fields  # noqa: E402
+
+# Benchmarks always run against a scratch database, never pool_degen itself
+BENCH_MONGO_URI = os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017/')
+BENCH_DB_NAME = os.getenv('BENCH_DB_NAME', 'pool_degen_bench')
+
+
+def get_bench_db():
+    """Connect to the scratch benchmark database."""
+    client = MongoClient(BENCH_MONGO_URI)
+    return client[BENCH_DB_NAME]
+
+
+def make_user(**overrides) -> dict:
+    """Build a user document shaped like the ones generate_users.py creates."""
+    identifier = str(ObjectId())
+    username = generate_username()
+    user = {
+        '_id': ObjectId(),
+        'identifier': identifier,
+        'username': username,
+        **search_fields(username),
+        'score': generate_score(),
+        'weekly_score': random.randint(0, 500),
+        'weekly_referrals': random.randint(0, 5),
+        'referral_code': generate_referral_code(),
+        'referrer': None,
+        'referral_count': 0,
+        'chat_id': random.randint(10000000, 99999999),
+        'created_at': datetime.now()
+    }
+    user.update(overrides)
+    return user
+
+
+def seed_users(collection, target: int, batch_size: int = 5000, **overrides) -> None:
+    """Top the collection up to `target` users."""
+    current = collection.estimated_document_count()
+    while current < target:
+        batch = [make_user(**overrides) for _ in range(min(batch_size, target - current))]
+        collection.insert_many(batch, ordered=False)
+        current += len(batch)
+        print(f"Seeded {current}/{target} users")
+
+
+def time_calls(fn, iterations: int) -> list:
+    """Call fn() `iterations` times and return the latencies in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples: list) -> dict:
+    """Return p50/p99/mean for a list of millisecond samples."""
+    ordered = sorted(samples)
+    return {
+        'p50': ordered[len(ordered) // 2],
+        'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        'mean': statistics.mean(ordered)
+    }
+
+
+def report(label: str, samples: list) -> None:
+    """Print one result line for a benchmark case."""
+    stats = summarize(samples)
+    print(f"{label:<48} p50={stats['p50']:9.2f}ms  p99={stats['p99']:9.2f}ms  mean={stats['mean']:9.2f}ms")
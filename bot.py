@@ -13,11 +13,35 @@ from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
 import pytz
 import json
+import traceback
 from datetime import datetime, timedelta
 import asyncio
+import async_db
 from eth_account import Account
 from web3 import Web3
 from pymongo import DESCENDING
+from pymongo.errors import PyMongoError
+from bson import ObjectId
+from bson.errors import InvalidId
+import idempotency
+import pagination
+import referrals
+import score_stats
+import score_batch
+import score_events
+import score_ring
+import task_availability
+import task_states
+import task_submissions
+from task_catalog import TaskCatalog
+import user_bootstrap
+from user_repository import UserRepository
+import user_search
+import weekly
+import write_buffer
+import leaderboard_history
+from leaderboard import Leaderboard
+from period_leaderboards import PeriodLeaderboards, PERIODS
 
 # Enable logging
 logging.basicConfig(
@@ -32,6 +56,7 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 assert TELEGRAM_BOT_TOKEN is not None, "Telegram bot token not found"
 TASK_WEB_APP_URL = 'https://app.pooldegens.com/home?username={username}'  # Replace with your task page URL
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '32'))  # Updates handled in parallel
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -43,7 +68,40 @@ try:
     client.server_info()
     db = client['pool_degen']
     user_scores_collection = db['user_scores']
+    user_repository = UserRepository(user_scores_collection)
     tasks_collection = db['tasks']
+    task_catalog = TaskCatalog(tasks_collection, db['app_state'])
+    task_catalog.ensure_state()
+    task_states.ensure_indexes(user_scores_collection)
+    task_submissions_collection = db['task_submissions']
+    task_submissions.ensure_indexes(task_submissions_collection)
+    review_queue = task_submissions.ReviewQueue(task_submissions_collection, task_catalog)
+    score_stats_collection = db['score_stats']
+    score_events_collection = db['score_events']
+    score_events.ensure_indexes(score_events_collection)
+    score_event_ids_collection = db['score_event_ids']
+    score_batch.ensure_indexes(score_event_ids_collection)
+    idempotency_cache = idempotency.IdempotencyCache(db['idempotency_keys'])
+    idempotency_cache.ensure_indexes()
+    pagination.ensure_indexes(user_scores_collection)
+    user_search.ensure_indexes(user_scores_collection)
+    global_stats = score_stats.ScoreStats(user_scores_collection, score_stats_collection)
+    week = weekly.WeekEpoch(db['app_state'])
+    week.ensure_state(user_scores_collection)
+    leaderboard = Leaderboard(user_scores_collection, week)
+    leaderboard.ensure_indexes()
+    period_boards = PeriodLeaderboards(user_scores_collection, score_events_collection, week, leaderboard)
+    leaderboard_history_collection = db['leaderboard_history']
+    leaderboard_ranks_collection = db['leaderboard_ranks']
+    leaderboard_history.ensure_indexes(leaderboard_history_collection, leaderboard_ranks_collection)
+    referrals.ensure_indexes(db['referral_edges'])
+    referral_credits = referrals.ReferralCredits(
+        user_scores_collection, db['referral_edges'], on_credit=lambda credited: credit_referrals(credited), week=week
+    )
+    # Optional: coalesce /api/save_score writes per user (SCORE_WRITE_BUFFER=1)
+    score_buffer = None
+    if write_buffer.buffer_enabled():
+        score_buffer = write_buffer.ScoreWriteBuffer(user_scores_collection, score_events_collection, stats=global_stats, week=week)
     logger.info("Successfully connected to MongoDB")
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {str(e)}")
@@ -63,8 +121,8 @@ def get_identifier(user) -> str:
 
 def get_referral_code(identifier: str) -> str:
     """Retrieve the user's referral code from the database."""
-    user = user_scores_collection.find_one({'identifier': identifier})
-    return user['referral_code'] if user and 'referral_code' in user else generate_referral_code()
+    user = user_repository.referral(identifier=identifier)
+    return user.referral_code if user and user.referral_code else generate_referral_code()
 
 def create_wallet():
     account = Account.create()
@@ -75,64 +133,62 @@ def create_wallet():
 
 def save_wallet(identifier: str, address: str, private_key: str):
     """Save the user's wallet address and private key to the database."""
-    user_scores_collection.update_one(
+    result = user_scores_collection.update_one(
         {'identifier': identifier},
         {'$set': {'bep20_wallet_address': address, 'bep20_wallet_private_key': private_key}},
         upsert=True
     )
+    if result.upserted_id:
+        global_stats.record(count=1)
 
 def get_wallet(identifier: str):
     """Retrieve the user's wallet address from the database."""
-    user = user_scores_collection.find_one({'identifier': identifier})
-    return user['bep20_wallet_address'] if user and 'bep20_wallet_address' in user else None
+    user = user_repository.wallets(identifier=identifier)
+    return user.bep20_wallet_address if user else None
 
 def get_ton_wallet(identifier: str):
     """Retrieve the user's TON wallet address from the database."""
-    user = user_scores_collection.find_one({'identifier': identifier})
-    return user['ton_wallet'] if user and 'ton_wallet' in user else None
+    user = user_repository.wallets(identifier=identifier)
+    return user.ton_wallet if user else None
 
 # Database functions
 def save_score(identifier: str, score: int) -> None:
     """Save the user's score to the database."""
-    timestamp = datetime.now()
-    user_scores_collection.update_one(
-        {'identifier': identifier},
-        {'$inc': {'score': score, 'weekly_score': score}, '$push': {'scores': {'score': score, 'timestamp': timestamp}}},
-        upsert=True
+    created = score_events.apply_score(
+        user_scores_collection, score_events_collection, {'identifier': identifier}, score,
+        week_epoch=week.current(), member=identifier
     )
+    global_stats.record(count=1 if created else 0, score=score)
+    leaderboard.incr('weekly_score', identifier, score)
 
 def get_score(identifier: str) -> int:
     """Retrieve the user's total score from the database."""
-    user = user_scores_collection.find_one({'identifier': identifier})
-    return user['score'] if user else 0
+    user = user_repository.score(identifier=identifier)
+    return user.get('score', 0) if user else 0
+
+def get_window_score(identifier: str, days: int) -> int:
+    """Retrieve the user's score over the last `days` days from their daily ring counters."""
+    return score_ring.window_total(user_repository.score_days(identifier=identifier), days)
 
 def get_weekly_score(identifier: str) -> int:
-    """Retrieve the user's weekly score from the database."""
-    nine_days_ago = datetime.utcnow() - timedelta(days=9)
-    user = user_scores_collection.find_one({'identifier': identifier})
-    if not user or 'scores' not in user:
-        return 0
-    return sum(score_record['score'] for score_record in user['scores'] if score_record['timestamp'] >= nine_days_ago)
+    """Retrieve the user's score over the last 9 days."""
+    return get_window_score(identifier, 9)
 
 def get_leaderboard(limit: int = 20) -> list:
-    """Retrieve the top users from the database."""
-    pipeline = [
-        {'$sort': {'weekly_score': -1}},  # Ensure sorting by weekly_score in descending order
-        {'$limit': limit}
-    ]
-    return list(user_scores_collection.aggregate(pipeline))
+    """Retrieve the top users by weekly score from the in-memory leaderboard."""
+    return leaderboard.top('weekly_score', limit)
 
 def get_referral_leaderboard(limit: int = 10) -> list:
-    """Retrieve the top users by weekly referral count from the database."""
-    pipeline = [
-        {'$sort': {'weekly_referrals': -1}},
-        {'$limit': limit}
-    ]
-    return list(user_scores_collection.aggregate(pipeline))
+    """Retrieve the top users by weekly referral count from the in-memory leaderboard."""
+    return leaderboard.top('weekly_referrals', limit)
+
+def get_weekly_rank(identifier: str, radius: int = 2) -> dict:
+    """Retrieve the user's weekly score rank and the players around them."""
+    return leaderboard.rank('weekly_score', identifier, radius)
 
 def get_referral_count(identifier: str) -> int:
     """Retrieve the number of referrals for the user."""
-    user = user_scores_collection.find_one({'identifier': identifier})
+    user = user_repository.referral(identifier=identifier)
     return user.get('referral_count', 0) if user else 0
 
 def get_referral_earnings(identifier: str) -> int:
@@ -140,29 +196,24 @@ def get_referral_earnings(identifier: str) -> int:
     referral_count = get_referral_count(identifier)
     return referral_count * 20  # Each referral earns 20 $POOLD tokens
 
-def update_referral(referrer_identifier: str, referred_identifier: str) -> None:
-    """Update the referrer's score and set the referrer for the referred user."""
-    logger.info(f"Updating referral: referrer_identifier={referrer_identifier}, referred_identifier={referred_identifier}")
-    referred_user = user_scores_collection.find_one({'identifier': referred_identifier})
-    if referred_user:
-        logger.info(f"Found referred user: {referred_user}")
-        if referred_user.get('referrer') is None:
-            referrer = user_scores_collection.find_one({'identifier': referrer_identifier})
-            if referrer:
-                logger.info(f"Found referrer: {referrer}")
-                user_scores_collection.update_one(
-                    {'identifier': referrer_identifier},
-                    {'$inc': {'score': 20, 'referral_count': 1, 'weekly_referrals': 1}, '$push': {'referrals': {'referral_id': referred_identifier, 'timestamp': datetime.now()}}},
-                    upsert=True
-                )
-                user_scores_collection.update_one({'identifier': referred_identifier}, {'$set': {'referrer': referrer_identifier}})
-                logger.info(f"User {referrer_identifier} received 20 points for referring {referred_identifier}")
-            else:
-                logger.warning(f"Referrer {referrer_identifier} not found in database")
-        else:
-            logger.info(f"Referred user {referred_identifier} already has a referrer")
-    else:
-        logger.warning(f"Referred user {referred_identifier} not found in database")
+def credit_referrals(credited: dict) -> None:
+    """Mirror referral rewards paid by the ledger flusher into the stats and leaderboard."""
+    for referrer_identifier, count in credited.items():
+        global_stats.record(score=referrals.REFERRAL_REWARD * count)
+        leaderboard.incr('weekly_referrals', referrer_identifier, count)
+        logger.info(f"User {referrer_identifier} received {referrals.REFERRAL_REWARD * count} points for {count} referrals")
+
+def register_user(identifier: str, chat_id: int, username: str, referrer_identifier: str = None) -> dict:
+    """Create or refresh the /start user and credit their referrer, in at most two round trips."""
+    result = user_bootstrap.bootstrap(
+        user_scores_collection, identifier, chat_id, username, generate_referral_code(), referrer_identifier
+    )
+    if result['created']:
+        global_stats.record(count=1)
+    if result['referred']:
+        referral_credits.record(referrer_identifier, identifier)
+    return result
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, user=None, from_button=False) -> None:
     """Send a message when the command /start is issued."""
     logger.info("Start command received")
@@ -170,40 +221,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE, user=None, f
         user = update.message.from_user if update.message else update.callback_query.from_user
     identifier = get_identifier(user)
     chat_id = update.message.chat_id if update.message else update.callback_query.message.chat_id  # Get the user's chat ID
-    score = get_score(identifier)
-    total_score = score
+    referrer_identifier = context.args[0] if context.args else None
+    registered = await async_db.run(
+        register_user, identifier, chat_id, user.username if user.username else identifier, referrer_identifier
+    )
+    total_score = registered['score']
     logger.info(f"User {identifier} started the bot with chat_id {chat_id}.")
 
-    # Check if the user exists in the database, if not, create a new entry with a referral code and chat ID
-    existing_user = user_scores_collection.find_one({'identifier': identifier})
-    if not existing_user:
-        referral_code = generate_referral_code()
-        user_scores_collection.insert_one({
-            'identifier': identifier,
-            'chat_id': chat_id,  # Store the chat ID
-            'username': user.username if user.username else identifier,
-            'score': 0,
-            'referral_code': referral_code,
-            'referrer': None,
-            'referral_count': 0,
-            'weekly_score': 0,
-            'weekly_referrals': 0,
-            'scores': [],
-            'referrals': []
-        })
-    else:
-        # Update the existing user's chat ID in case it has changed
-        user_scores_collection.update_one({'identifier': identifier}, {'$set': {'chat_id': chat_id}})
-        referral_code = existing_user.get('referral_code', generate_referral_code())
-        if 'referral_code' not in existing_user:
-            user_scores_collection.update_one({'identifier': identifier}, {'$set': {'referral_code': referral_code}})
-
-    # Check for referral after user is added to the database
-    if context.args:
-        referrer_identifier = context.args[0]
-        if referrer_identifier != identifier:
-            update_referral(referrer_identifier, identifier)
-
     # Description and banner (placeholder)
     banner_url = 'https://i.imgur.com/TPONakC.mp4'
     description = (
@@ -252,9 +276,17 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if query.data == 'my_profile':
         user = update.effective_user
         identifier = get_identifier(user)
-        score = get_score(identifier)
+        score = await async_db.run(get_score, identifier)
         total_score = score
         profile_text = f"❇️ My Pool Degen Profile ❇️\n\n👤 Username: {user.username if user.username else identifier}\n\n💰 $POOLD: {total_score}"
+        weekly_rank = get_weekly_rank(identifier)
+        if weekly_rank['rank']:
+            profile_text += f"\n\n🏆 Weekly Rank: #{weekly_rank['rank']} of {weekly_rank['ranked_players']}\n"
+            for neighbour in weekly_rank['neighbours']:
+                marker = "👉 " if neighbour['username'] == identifier else ""
+                profile_text += f"{marker}{neighbour['rank']}. {neighbour['username']} - {neighbour['weekly_score']}\n"
+        else:
+            profile_text += "\n\n🏆 Weekly Rank: play a game this week to get ranked!"
         # Add back button
         keyboard = [
             [InlineKeyboardButton("🔙 Go back to main menu", callback_data='back_to_menu')]
@@ -267,6 +299,8 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             await query.message.reply_text(text=profile_text, reply_markup=reply_markup)
     elif query.data == 'leaderboard':
         await show_leaderboard(update, context)
+    elif query.data.startswith('leaderboard:'):
+        await show_leaderboard(update, context, period=query.data.split(':', 1)[1])
     elif query.data == 'refer_earn':
         await show_referral_page(update, context)
     elif query.data == 'referral_leaderboard':
@@ -285,22 +319,34 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     elif query.data == 'generate_wallet':
         await generate_wallet(update, context)
 
-async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send the leaderboard when the command /leaderboard is issued."""
+PERIOD_TITLES = {'daily': 'Daily', 'weekly': 'Weekly', 'monthly': 'Monthly', 'all': 'All-Time'}
+
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE, period: str = None) -> None:
+    """Send the leaderboard when /leaderboard [daily|weekly|monthly|all] is issued or the button is pressed."""
     query = update.callback_query
-    top_users = get_leaderboard()
-    leaderboard_text = "🏆 Leaderboard 🏆\n\n"
+    if period is None:
+        period = context.args[0].lower() if context.args else 'weekly'
+    if period not in PERIODS:
+        await update.effective_message.reply_text(f"Usage: /leaderboard {'|'.join(PERIODS)}")
+        return
+
+    top_users = await async_db.run(period_boards.top, period, 20)
+    leaderboard_text = f"🏆 {PERIOD_TITLES[period]} Leaderboard 🏆\n\n"
     leaderboard_text += "Rank | Username | Score\n"
     leaderboard_text += "----------------------\n"
-    for i, user in enumerate(top_users, start=1):
-        leaderboard_text += f"{i}. {user['username'] if user['username'] else user['_id']} - {user['weekly_score']}\n"
+    for user in top_users:
+        leaderboard_text += f"{user['rank']}. {user['username']} - {user['score']}\n"
     
-    # Add back button
+    # Period switcher and back button
     keyboard = [
+        [InlineKeyboardButton(title, callback_data=f'leaderboard:{name}') for name, title in PERIOD_TITLES.items() if name != period],
         [InlineKeyboardButton("🔙 Go back to main menu", callback_data='back_to_menu')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
+    if not query:
+        await update.message.reply_text(text=leaderboard_text, reply_markup=reply_markup)
+        return
     try:
         await query.edit_message_text(text=leaderboard_text, reply_markup=reply_markup)
     except Exception as e:
@@ -312,8 +358,8 @@ async def show_referral_page(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = update.effective_user
     identifier = get_identifier(user)
     referral_link = f"https://t.me/pooldegen_bot?start={identifier}"
-    referral_count = get_referral_count(identifier)
-    referral_earnings = get_referral_earnings(identifier)
+    referral_count = await async_db.run(get_referral_count, identifier)
+    referral_earnings = referral_count * 20  # Each referral earns 20 $POOLD tokens
 
     referral_text = (
         f"Your Referral Link: {referral_link}\n\n"
@@ -346,7 +392,7 @@ async def show_referral_leaderboard(update: Update, context: ContextTypes.DEFAUL
     leaderboard_text += "Rank | Username | Referrals\n"
     leaderboard_text += "---------------------------\n"
     for i, user in enumerate(top_referrers, start=1):
-        leaderboard_text += f"{i}. {user['username'] if user['username'] else user['_id']} - {user.get('weekly_referrals', 0)}\n"
+        leaderboard_text += f"{i}. {user['username']} - {user['weekly_referrals']}\n"
 
     # Add back button
     keyboard = [
@@ -365,7 +411,7 @@ async def refresh_balance(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Refresh the user's $POOLD balance."""
     user = update.effective_user
     identifier = get_identifier(user)
-    score = get_score(identifier)
+    score = await async_db.run(get_score, identifier)
     total_score = score
 
     description = (
@@ -422,7 +468,7 @@ async def show_ton_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Show the user's TON wallet page."""
     user = update.effective_user
     identifier = get_identifier(user)
-    ton_wallet = get_ton_wallet(identifier)
+    ton_wallet = await async_db.run(get_ton_wallet, identifier)
     
     if ton_wallet:
         wallet_text = (
@@ -463,7 +509,7 @@ async def show_bep20_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Show the user's BEP20 wallet page."""
     user = update.effective_user
     identifier = get_identifier(user)
-    bep20_wallet = get_wallet(identifier)
+    bep20_wallet = await async_db.run(get_wallet, identifier)
     
     if bep20_wallet:
         wallet_text = (
@@ -505,7 +551,7 @@ async def generate_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     identifier = get_identifier(user)
     wallet = create_wallet()
-    save_wallet(identifier, wallet['address'], wallet['_private_key'])
+    await async_db.run(save_wallet, identifier, wallet['address'], wallet['_private_key'])
     
     wallet_text = (
         f"🔆 Your BEP20 Wallet has been generated successfully.\n\n"
@@ -525,29 +571,119 @@ async def generate_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"Error generating wallet: {e}")
         await context.bot.send_message(chat_id=update.callback_query.message.chat_id, text=wallet_text, reply_markup=reply_markup, parse_mode='Markdown')
 
+def save_scores(events: list) -> list:
+    """Apply score events through score_batch; returns the per-event results."""
+    results, applied, created = score_batch.save_scores(
+        user_scores_collection, score_events_collection, score_event_ids_collection, events,
+        submit=score_buffer.submit if score_buffer else None, week_epoch=week.current()
+    )
+    if not score_buffer:
+        global_stats.record(count=created, score=sum(event['score'] for event in applied))
+    for event in applied:
+        leaderboard.incr('weekly_score', event['username'], event['score'])
+    return results
+
+@app.route('/api/save_scores', methods=['POST'])
+@idempotency_cache.idempotent('save_scores')
+def save_scores_endpoint():
+    try:
+        data = request.json
+        events = data.get('events') if isinstance(data, dict) else None
+
+        if not isinstance(events, list) or not events:
+            return jsonify({'error': 'Invalid data'}), 400
+        if len(events) > score_batch.MAX_EVENTS:
+            return jsonify({'error': f'At most {score_batch.MAX_EVENTS} events per request'}), 400
+
+        results = save_scores(events)
+        applied = sum(1 for result in results if result['status'] == 'applied')
+        status = 503 if any(result['status'] == 'rejected' for result in results) else 200
+        headers = {'Retry-After': '1'} if status == 503 else {}
+        return jsonify({'results': results, 'applied': applied}), status, headers
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/save_score', methods=['POST'])
+@idempotency_cache.idempotent('save_score')
 def save_score_endpoint():
     try:
         data = request.json
-        username = data.get('username')
-        score = data.get('score')
-        timestamp = datetime.now()
-
-        if username is None or score is None:
+        if not isinstance(data, dict):
             return jsonify({'error': 'Invalid data'}), 400
 
-        user_scores_collection.update_one(
-            {'username': username},
-            {'$inc': {'score': int(score), 'weekly_score': int(score)}, '$push': {'scores': {'score': int(score), 'timestamp': timestamp}}},
-            upsert=True
-        )
+        result = save_scores([data])[0]
+        if result['status'] == 'invalid':
+            return jsonify({'error': result['error']}), 400
+        if result['status'] == 'rejected':
+            return jsonify({'error': 'Too many score updates, retry shortly'}), 503, {'Retry-After': '1'}
+        if result['status'] == 'failed':
+            return jsonify({'error': 'Internal server error'}), 500
+        if result['status'] == 'pending':
+            return jsonify({'error': 'An earlier submission of this event is still unresolved'}), 409
         update_user_count()
-        return jsonify({'message': 'Score saved successfully'}), 200
+        return jsonify({'message': 'Score saved successfully', 'status': result['status']}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/metrics/idempotency', methods=['GET'])
+def get_idempotency_metrics():
+    return jsonify(idempotency_cache.metrics()), 200
+
+@app.route('/api/metrics/score_writes', methods=['GET'])
+def get_score_write_metrics():
+    if not score_buffer:
+        return jsonify({'buffered': False}), 200
+    return jsonify({'buffered': True, **score_buffer.metrics()}), 200
+
+@app.route('/api/leaderboard/rank', methods=['GET'])
+def get_leaderboard_rank():
+    try:
+        username = request.args.get('username')
+        board = request.args.get('board', 'weekly_score')
+        if not username:
+            return jsonify({'error': 'Username is required'}), 400
+        if board not in leaderboard.boards:
+            return jsonify({'error': 'Invalid board'}), 400
+
+        radius = min(max(int(request.args.get('radius', 2)), 0), 25)
+        return jsonify(leaderboard.rank(board, username, radius)), 200
+    except Exception as e:
+        logger.error(f"Error in get_leaderboard_rank: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboards/<period>', methods=['GET'])
+def get_period_leaderboard(period):
+    try:
+        if period not in PERIODS:
+            return jsonify({'error': f"period must be one of {', '.join(PERIODS)}"}), 400
+        limit = int(request.args.get('limit', 10))
+        return jsonify({'period': period, 'leaderboard': period_boards.top(period, limit)}), 200
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    except Exception as e:
+        logger.error(f"Error in get_period_leaderboard: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboards/<period>/rank', methods=['GET'])
+def get_period_rank(period):
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({'error': 'Username is required'}), 400
+        if period not in PERIODS:
+            return jsonify({'error': f"period must be one of {', '.join(PERIODS)}"}), 400
+        return jsonify(period_boards.rank(period, username)), 200
+    except Exception as e:
+        logger.error(f"Error in get_period_rank: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/get_user_score', methods=['GET'])
 def get_user_score():
     try:
@@ -555,7 +691,7 @@ def get_user_score():
         if not username:
             return jsonify({'error': 'Username is required'}), 400
 
-        user = user_scores_collection.find_one({'username': username})
+        user = user_repository.score(username=username)
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
@@ -580,18 +716,36 @@ def add_task():
         }
         
         result = tasks_collection.insert_one(task)
+        task_catalog.bump()
         return jsonify({'message': 'Task added successfully', 'task_id': str(result.inserted_id)}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+def catalog_response(build):
+    """Serve task catalog data with its version as ETag, or 304 if the client's copy is current.
+
+    build() reads the in-memory catalog, so it runs first: only a resource that
+    exists (status 200) can be answered with 304.
+    """
+    etag = task_catalog.etag()
+    body, status = build()
+    if status == 200 and task_catalog.not_modified(request.headers.get('If-None-Match'), etag):
+        return '', 304, {'ETag': etag}
+    response = jsonify(body)
+    if status == 200:
+        response.headers['ETag'] = etag
+    return response, status
+
 @app.route('/api/get_tasks', methods=['GET'])
 def get_tasks():
     try:
-        tasks = list(tasks_collection.find({'recurInterval': {'$exists': False}}))
-        for task in tasks:
-            task['_id'] = str(task['_id'])
-        return jsonify(tasks), 200
+        def build():
+            tasks = task_catalog.tasks(recurring=False)
+            for task in tasks:
+                task['_id'] = str(task['_id'])
+            return tasks, 200
+        return catalog_response(build)
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -615,6 +769,7 @@ def update_task(task_id):
         
         if result.modified_count == 0:
             return jsonify({'message': 'No changes made to the task'}), 200
+        task_catalog.bump()
         
         return jsonify({'message': 'Task updated successfully'}), 200
     except Exception as e:
@@ -628,6 +783,7 @@ def delete_task(task_id):
         result = tasks_collection.delete_one({'_id': ObjectId(task_id)})
         if result.deleted_count == 0:
             return jsonify({'error': 'Task not found'}), 404
+        task_catalog.bump()
         return jsonify({'message': 'Task deleted successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -648,48 +804,32 @@ def complete_task():
             logger.warning("Missing required data in complete_task request")
             return jsonify({'error': 'Missing required data'}), 400
         
-        try:
-            task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        except InvalidId:
+        if not ObjectId.is_valid(task_id):
             logger.error(f"Invalid task_id format: {task_id}")
             return jsonify({'error': 'Invalid task ID format'}), 400
+        task = task_catalog.get(task_id)
         
         if not task:
             logger.warning(f"Task not found: {task_id}")
             return jsonify({'error': 'Task not found'}), 404
         
-        # First, retrieve the user document
-        user = user_scores_collection.find_one({'username': username})
+        # One single-path write; the rest of the user's task states are left alone
+        submitted_at = datetime.now()
+        update_result = task_states.update(
+            user_scores_collection,
+            {'username': username},
+            {'$set': {**task_states.submitted(task_id, evidence_url, submitted_at), **task_availability.submitted(task, submitted_at)}}
+        )
         
-        if user is None:
+        if update_result.matched_count == 0:
             logger.warning(f"User not found: {username}")
             return jsonify({'error': 'User not found'}), 404
-        
-        # Check if task_states exists and convert if it's an array
-        task_states = user.get('task_states', {})
-        if isinstance(task_states, list):
-            # Convert array to object
-            task_states = {str(item['task_id']): item for item in task_states}
-        
-        # Update the task state
-        task_states[task_id] = {
-            'status': 'validating',
-            'evidence': evidence_url,
-            'timestamp': datetime.now()
-        }
-        
-        # Update the user document with the new task_states
-        update_result = user_scores_collection.update_one(
-            {'username': username},
-            {'$set': {'task_states': task_states}}
+
+        task_submissions.submit(
+            task_submissions_collection, username, task['_id'], evidence_url,
+            is_recurring=bool(task.get('recurInterval')), submitted_at=submitted_at
         )
         
-        logger.info(f"Update result: modified_count={update_result.modified_count}")
-        
-        if update_result.modified_count == 0:
-            logger.error("Failed to update task state in database")
-            return jsonify({'error': 'Failed to update task state'}), 500
-        
         logger.info(f"Task submitted for validation successfully: username={username}, task_id={task_id}")
         return jsonify({'message': 'Task submitted for validation'}), 200
     except Exception as e:
@@ -697,6 +837,21 @@ def complete_task():
         logger.error(traceback.format_exc())
         return jsonify({'error': f"An error occurred: {str(e)}"}), 500
 
+@app.route('/api/tasks/available', methods=['GET'])
+def get_available_tasks():
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({'error': 'Username is required'}), 400
+        tasks = task_availability.available(user_scores_collection, task_catalog, username)
+        if tasks is None:
+            return jsonify({'error': 'User not found'}), 404
+        return jsonify({'tasks': tasks}), 200
+    except Exception as e:
+        logger.error(f"Error in get_available_tasks: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/get_task_states', methods=['GET'])
 def get_task_states():
     try:
@@ -707,26 +862,16 @@ def get_task_states():
             logger.warning("Username is missing in the request")
             return jsonify({'error': 'Username is required'}), 400
 
-        user = user_scores_collection.find_one({'username': username})
+        user = user_repository.task_states(username=username)
         logger.info(f"User found: {user is not None}")
         
         if not user:
             logger.warning(f"User not found for username: {username}")
             return jsonify({'error': 'User not found'}), 404
 
-        task_states = user.get('task_states', {})
-        logger.info(f"Task states for {username}: {task_states}")
-
-        # Convert task_states to list if it's a dict
-        if isinstance(task_states, dict):
-            task_states = [{"task_id": k, **v} for k, v in task_states.items()]
-
-        for state in task_states:
-            if 'task_id' in state:
-                state['task_id'] = str(state['task_id'])
-
-        logger.info(f"Returning {len(task_states)} task states for {username}")
-        return jsonify({'taskStates': task_states}), 200
+        states = task_states.as_list(user.task_states)
+        logger.info(f"Returning {len(states)} task states for {username}")
+        return jsonify({'taskStates': states}), 200
 
     except Exception as e:
         logger.error(f"Error fetching task states: {str(e)}")
@@ -751,66 +896,29 @@ def custom_jsonify(data):
 def get_pending_tasks():
     try:
         logger.info("Fetching pending tasks...")
-        pending_tasks = []
-        
-        # Get pending normal tasks
-        normal_tasks_pipeline = [
-            {'$unwind': '$task_states'},
-            {'$match': {'task_states.status': 'validating'}},
-            {'$lookup': {
-                'from': 'tasks',
-                'localField': 'task_states.task_id',
-                'foreignField': '_id',
-                'as': 'task_info'
-            }},
-            {'$unwind': '$task_info'},
-            {'$project': {
-                'taskId': {'$toString': '$task_states.task_id'},
-                'submissionId': {'$toString': '$task_states.task_id'},
-                'description': '$task_info.description',
-                'score': '$task_info.score',
-                'isRecurring': {'$literal': False},
-                'status': '$task_states.status',
-                'username': '$username',
-                'evidenceUrl': '$task_states.evidence'
-            }}
-        ]
-        
-        # Get pending recurring task submissions
-        recur_tasks_pipeline = [
-            {'$unwind': '$recurring_task_submissions'},
-            {'$match': {'recurring_task_submissions.status': 'validating'}},
-            {'$lookup': {
-                'from': 'tasks',
-                'localField': 'recurring_task_submissions.task_id',
-                'foreignField': '_id',
-                'as': 'task_info'
-            }},
-            {'$unwind': '$task_info'},
-            {'$project': {
-                'taskId': {'$toString': '$recurring_task_submissions.task_id'},
-                'submissionId': {'$toString': '$recurring_task_submissions._id'},
-                'description': '$task_info.description',
-                'score': '$task_info.score',
-                'isRecurring': {'$literal': True},
-                'status': '$recurring_task_submissions.status',
-                'username': '$username',
-                'evidenceUrl': '$recurring_task_submissions.evidence'
-            }}
+        try:
+            limit, after = task_submissions.parse_page_args(request.args)
+            submissions, next_cursor = task_submissions.pending(task_submissions_collection, task_catalog, limit, after)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Keyset page off task_submissions (status, submitted_at, _id)
+        pending_tasks = [
+            {
+                'taskId': str(submission['task_id']),
+                'submissionId': str(submission['_id'] if submission['is_recurring'] else submission['task_id']),
+                'description': submission['task'].get('description'),
+                'score': submission['task'].get('score'),
+                'isRecurring': submission['is_recurring'],
+                'status': submission['status'],
+                'username': submission['username'],
+                'evidenceUrl': submission['evidence_url']
+            }
+            for submission in submissions
         ]
         
-        normal_tasks = list(user_scores_collection.aggregate(normal_tasks_pipeline))
-        recur_tasks = list(user_scores_collection.aggregate(recur_tasks_pipeline))
-        
-        logger.info(f"Normal tasks found: {len(normal_tasks)}")
-        logger.info(f"Recurring tasks found: {len(recur_tasks)}")
-        
-        pending_tasks.extend(normal_tasks)
-        pending_tasks.extend(recur_tasks)
-        
         logger.info(f"Total number of pending tasks: {len(pending_tasks)}")
         
-        return jsonify({'pending_tasks': pending_tasks}), 200
+        return jsonify({'pending_tasks': pending_tasks, 'next_cursor': next_cursor}), 200
     except Exception as e:
         logger.error(f"Error occurred in get_pending_tasks: {str(e)}")
         logger.error(traceback.format_exc())
@@ -841,21 +949,36 @@ def validate_task():
 
         if action not in ['approve', 'reject']:
             return jsonify({'error': 'Invalid action'}), 400
-
-        update_query = {'username': username, f'task_states.{task_id}.status': 'validating'}
-        update_data = {f'task_states.{task_id}.status': 'approved' if action == 'approve' else 'rejected'}
+        reviewer = data.get('reviewer')
+        if not ObjectId.is_valid(str(task_id)):
+            return jsonify({'error': 'Invalid task ID format'}), 400
+        lease, held = review_queue.acquire([(username, ObjectId(task_id))], reviewer)
+        if held:
+            return jsonify({'error': 'Submission is leased to another reviewer'}), 409
+
+        update_query = {'username': username, task_states.path(task_id, 'status'): 'validating'}
+        update_data = {'$set': {task_states.path(task_id, 'status'): 'approved' if action == 'approve' else 'rejected'}}
+        awarded = 0
+        if action == 'reject':
+            update_data['$unset'] = task_availability.rejected(task_id)
         
         if action == 'approve':
-            task = tasks_collection.find_one({'_id': ObjectId(task_id)})
+            task = task_catalog.get(task_id)
             if task:
-                update_data['$inc'] = {'score': task['score']}
+                awarded = task['score']
+                update_data['$inc'] = {'score': awarded}
 
-        result = user_scores_collection.update_one(update_query, {'$set': update_data})
+        result = task_states.update(user_scores_collection, update_query, update_data)
 
         if result.modified_count == 0:
+            review_queue.release_lease(lease)
             logger.warning(f"Task not found or already processed: taskId={task_id}, username={username}")
             return jsonify({'error': 'Task not found or already processed'}), 404
 
+        task_submissions.resolve(
+            task_submissions_collection, username, ObjectId(task_id), 'approved' if action == 'approve' else 'rejected', reviewer
+        )
+        global_stats.record(score=awarded)
         logger.info(f"Normal task {action}d successfully: taskId={task_id}, username={username}")
         return jsonify({'message': f'Task {action}d successfully'}), 200
     except Exception as e:
@@ -864,15 +987,90 @@ def validate_task():
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 
+@app.route('/api/validate_tasks/bulk', methods=['POST'])
+def validate_tasks_bulk():
+    try:
+        data = request.json
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Missing required data'}), 400
+        if len(items) > task_submissions.MAX_BULK_ITEMS:
+            return jsonify({'error': f'At most {task_submissions.MAX_BULK_ITEMS} items per request'}), 400
+
+        results, awarded = task_submissions.validate_bulk(
+            user_scores_collection, task_submissions_collection, task_catalog, items,
+            reviewer=data.get('reviewer'), review_queue=review_queue
+        )
+        global_stats.record(score=awarded)
+        processed = sum(1 for result in results if result['status'] in ('approved', 'rejected'))
+        logger.info(f"Bulk validated {processed} of {len(items)} tasks")
+        return jsonify({'results': results, 'processed': processed, 'awarded': awarded}), 200
+    except Exception as e:
+        logger.error(f"Error in validate_tasks_bulk: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/review_queue/claim', methods=['POST'])
+def claim_review_submissions():
+    try:
+        data = request.json or {}
+        reviewer = data.get('reviewer')
+        if not reviewer:
+            return jsonify({'error': 'Reviewer is required'}), 400
+        try:
+            submissions, next_cursor = review_queue.claim(reviewer, int(data.get('count', 10)), data.get('after'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'submissions': [task_submissions.serialize(submission) for submission in submissions],
+            'next_cursor': next_cursor
+        }), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/review_queue/leased', methods=['GET'])
+def get_leased_submissions():
+    try:
+        reviewer = request.args.get('reviewer')
+        if not reviewer:
+            return jsonify({'error': 'Reviewer is required'}), 400
+        submissions = review_queue.leased(reviewer)
+        return jsonify({'submissions': [task_submissions.serialize(submission) for submission in submissions]}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/review_queue/release', methods=['POST'])
+def release_review_submissions():
+    try:
+        data = request.json or {}
+        reviewer = data.get('reviewer')
+        if not reviewer:
+            return jsonify({'error': 'Reviewer is required'}), 400
+        submission_ids = data.get('submissionIds')
+        if submission_ids is not None:
+            submission_ids = [ObjectId(submission_id) for submission_id in submission_ids]
+        return jsonify({'released': review_queue.release(reviewer, submission_ids)}), 200
+    except InvalidId:
+        return jsonify({'error': 'Invalid submission ID'}), 400
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/get_task_details/<task_id>', methods=['GET'])
 def get_task_details(task_id):
     try:
-        task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
-
-        task['_id'] = str(task['_id'])  # Convert ObjectId to string
-        return jsonify(task), 200
+        def build():
+            task = task_catalog.get(task_id)
+            if not task:
+                return {'error': 'Task not found'}, 404
+            task['_id'] = str(task['_id'])  # Convert ObjectId to string
+            return task, 200
+        return catalog_response(build)
     except Exception as e:
         logger.error(f"Error in get_task_details: {str(e)}")
         logger.error(traceback.format_exc())
@@ -898,14 +1096,7 @@ def update_user_score(username, score_change):
 
 # Helper function to check if a task is completable
 def is_task_completable(task, user):
-    if task.get('recurInterval'):
-        last_completion = user.get('task_states', {}).get(str(task['_id']), {}).get('lastCompletion')
-        if last_completion:
-            time_since_completion = datetime.now() - last_completion
-            return time_since_completion.total_seconds() / 3600 >= task['recurInterval']
-        return True
-    else:
-        return user.get('task_states', {}).get(str(task['_id']), {}).get('status') != 'completed'
+    return task_availability.is_completable(task, user)
 
 
 @app.route('/api/reject_task', methods=['POST'])
@@ -914,15 +1105,24 @@ def reject_task():
         data = request.json
         task_id = data.get('taskId')
         username = data.get('username')
+        reviewer = data.get('reviewer')
+        if not ObjectId.is_valid(str(task_id)):
+            return jsonify({'error': 'Invalid task ID format'}), 400
+        lease, held = review_queue.acquire([(username, ObjectId(task_id))], reviewer)
+        if held:
+            return jsonify({'error': 'Submission is leased to another reviewer'}), 409
         
-        result = user_scores_collection.update_one(
-            {'username': username, 'task_states.task_id': ObjectId(task_id)},
-            {'$set': {'task_states.$.status': 'rejected'}}
+        result = task_states.update(
+            user_scores_collection,
+            {'username': username, task_states.path(task_id, 'status'): 'validating'},
+            {'$set': {task_states.path(task_id, 'status'): 'rejected'}, '$unset': task_availability.rejected(task_id)}
         )
         
         if result.modified_count == 0:
-            return jsonify({'error': 'Task not found or already rejected'}), 404
-        
+            review_queue.release_lease(lease)
+            return jsonify({'error': 'Task not found or already processed'}), 404
+
+        task_submissions.resolve(task_submissions_collection, username, ObjectId(task_id), 'rejected', reviewer)
         return jsonify({'message': 'Task rejected successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -932,32 +1132,12 @@ def reject_task():
 @app.route('/api/user_scores/count', methods=['GET'])
 def get_user_scores_count():
     try:
-        pipeline = [
-            {
-                '$facet': {
-                    'count': [{'$count': 'total'}],
-                    'stats': [
-                        {
-                            '$group': {
-                                '_id': None,
-                                'totalScore': {'$sum': '$score'},
-                                'avgScore': {'$avg': '$score'}
-                            }
-                        }
-                    ]
-                }
-            }
-        ]
-        
-        result = list(user_scores_collection.aggregate(pipeline))[0]
-        count = result['count'][0]['total'] if result['count'] else 0
-        stats = result['stats'][0] if result['stats'] else {'totalScore': 0, 'avgScore': 0}
-        
+        stats = global_stats.get()
         return jsonify({
-            'count': count,
+            'count': stats['count'],
             'stats': {
                 'totalScore': stats['totalScore'],
-                'averageScore': stats['avgScore']
+                'averageScore': stats['averageScore']
             }
         })
     except Exception as e:
@@ -975,43 +1155,14 @@ def list_user_scores():
             logger.error(f"MongoDB connection error: {str(e)}")
             return jsonify({'error': 'Database connection error'}), 500
 
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 10))
-        skip = (page - 1) * limit
-
-        # First check if we have any users
-        total_users = user_scores_collection.count_documents({})
-        if total_users == 0:
-            return jsonify({
-                'users': [],
-                'stats': {
-                    'totalScore': 0,
-                    'averageScore': 0,
-                    'topPerformers': []
-                }
-            }), 200
-
-        # Get paginated users
-        users = list(user_scores_collection.find().skip(skip).limit(limit))
-        
-        # Get stats in a separate query
-        stats_pipeline = [
-            {
-                '$group': {
-                    '_id': None,
-                    'totalScore': {'$sum': '$score'},
-                    'count': {'$sum': 1}
-                }
-            }
-        ]
-        
-        # Get top performers in a separate query
-        top_performers = list(user_scores_collection.find().sort('score', -1).limit(3))
+        try:
+            users, page_info = pagination.paginate(user_scores_collection, {}, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        limit = pagination.parse_page_args(request.args)[1]
 
-        # Process stats
-        stats_result = list(user_scores_collection.aggregate(stats_pipeline))
-        stats = stats_result[0] if stats_result else {'totalScore': 0, 'count': 0}
-        avg_score = stats['totalScore'] / stats['count'] if stats['count'] > 0 else 0
+        top_performers = pagination.top_performers(user_scores_collection)
+        stats = global_stats.get()
 
         # Convert ObjectId to string
         for user in users + top_performers:
@@ -1021,9 +1172,11 @@ def list_user_scores():
             'users': users,
             'stats': {
                 'totalScore': stats['totalScore'],
-                'averageScore': avg_score,
+                'averageScore': stats['averageScore'],
                 'topPerformers': top_performers
-            }
+            },
+            'totalPages': (stats['count'] + limit - 1) // limit,
+            **page_info
         }), 200
     except Exception as e:
         logger.error(f"Error occurred: {e}")
@@ -1033,9 +1186,10 @@ def list_user_scores():
 @app.route('/api/user_scores/<string:id>', methods=['DELETE'])
 def delete_user_scores(id):
     try:
-        result = user_scores_collection.delete_one({'_id': ObjectId(id)})
-        if result.deleted_count == 0:
+        deleted = user_scores_collection.find_one_and_delete({'_id': ObjectId(id)}, projection={'score': 1})
+        if deleted is None:
             return jsonify({'error': 'User not found'}), 404
+        global_stats.record(count=-1, score=-deleted.get('score', 0))
         update_user_count()
         return jsonify({'success': True})
     except Exception as e:
@@ -1047,9 +1201,13 @@ def delete_user_scores(id):
 def edit_user_scores(id):
     try:
         data = request.get_json()
-        result = user_scores_collection.update_one({'_id': ObjectId(id)}, {'$set': data})
-        if result.matched_count == 0:
+        if 'username' in data:
+            data.update(user_search.search_fields(data['username']))
+        previous = user_scores_collection.find_one_and_update({'_id': ObjectId(id)}, {'$set': data}, projection={'score': 1})
+        if previous is None:
             return jsonify({'error': 'User not found'}), 404
+        if 'score' in data:
+            global_stats.record(score=int(data['score'] or 0) - previous.get('score', 0))
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error occurred: {e}")
@@ -1073,7 +1231,7 @@ def report_issue():
 
 def update_user_count():
     try:
-        count = user_scores_collection.count_documents({})
+        count = global_stats.get()['count']
         socketio.emit('update_user_count', count)
     except Exception as e:
         logger.error(f"Error updating user count: {str(e)}")
@@ -1081,7 +1239,7 @@ def update_user_count():
 @app.route('/api/user_count', methods=['GET'])
 def get_user_count():
     try:
-        count = user_scores_collection.count_documents({})
+        count = global_stats.get()['count']
         update_user_count()  # Emit the update to all connected clients
         return jsonify({'count': count})
     except Exception as e:
@@ -1099,11 +1257,13 @@ def save_ton_wallet():
         if not all([username, ton_wallet]):
             return jsonify({'error': 'Invalid data'}), 400
 
-        user_scores_collection.update_one(
+        result = user_scores_collection.update_one(
             {'username': username},
-            {'$set': {'ton_wallet': ton_wallet}},
+            {'$set': {'ton_wallet': ton_wallet}, '$setOnInsert': user_search.search_fields(username)},
             upsert=True
         )
+        if result.upserted_id:
+            global_stats.record(count=1)
         update_user_count()
         return jsonify({'message': 'Wallet saved successfully'}), 200
     except Exception as e:
@@ -1118,7 +1278,11 @@ def search_users():
         if not username:
             return jsonify({'error': 'Username is required'}), 400
 
-        users = list(user_scores_collection.find({'username': {'$regex': username, '$options': 'i'}}))
+        try:
+            limit = user_search.parse_limit(request.args.get('limit'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        users = user_search.search(user_scores_collection, username, limit, pagination.LIST_PROJECTION)
         for user in users:
             user['_id'] = str(user['_id'])
         return jsonify({'users': users}), 200
@@ -1130,14 +1294,20 @@ def search_users():
 @app.route('/api/user_scores/referrals/<identifier>', methods=['GET'])
 def get_user_referrals(identifier):
     try:
-        user = user_scores_collection.find_one({'identifier': identifier})
-        if not user:
+        if user_repository.id_of(identifier=identifier) is None:
             return jsonify({'error': 'User not found'}), 404
 
-        referrals = list(user_scores_collection.find({'referrer': identifier}))
+        page_info = {}
+        if any(arg in request.args for arg in ('page', 'limit', 'after')):
+            try:
+                referrals, page_info = pagination.paginate(user_scores_collection, {'referrer': identifier}, request.args)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            referrals = list(user_scores_collection.find({'referrer': identifier}, pagination.LIST_PROJECTION))
         for referral in referrals:
             referral['_id'] = str(referral['_id'])
-        return jsonify({'referrals': referrals}), 200
+        return jsonify({'referrals': referrals, **page_info}), 200
     except Exception as e:
         logger.error(f"Error occurred: {e}")
         logger.error(traceback.format_exc())
@@ -1158,6 +1328,7 @@ def add_recur_task():
         }
         
         result = tasks_collection.insert_one(task)
+        task_catalog.bump()
         return jsonify({'message': 'Recurring task added successfully', 'task_id': str(result.inserted_id)}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -1167,46 +1338,40 @@ def add_recur_task():
 @app.route('/api/get_recur_tasks', methods=['GET'])
 def get_recur_tasks():
     try:
-        tasks = list(tasks_collection.find({'recurInterval': {'$exists': True}}))
-        for task in tasks:
-            task['_id'] = str(task['_id'])
-        return jsonify(tasks), 200
+        def build():
+            tasks = task_catalog.tasks(recurring=True)
+            for task in tasks:
+                task['_id'] = str(task['_id'])
+            return tasks, 200
+        return catalog_response(build)
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 
 @app.route('/api/claim_reward', methods=['POST'])
+@idempotency_cache.idempotent('claim_reward')
 def claim_reward():
     try:
         data = request.json
         username = data.get('username')
         task_id = data.get('task_id')
-        score = data.get('score')
         
-        if not all([username, task_id, score]):
+        if not all([username, task_id]):
             return jsonify({'error': 'Missing required data'}), 400
         
-        user = user_scores_collection.find_one({'username': username})
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        # The reward is the task's score from the catalog, whatever the client sends
+        task = task_catalog.get(task_id)
+        if not task:
+            return jsonify({'error': 'Task not found'}), 404
+        score = task.get('score', 0)
         
-        task_state = user.get('task_states', {}).get(task_id)
-        if not task_state or task_state.get('status') != 'approved':
+        if task_states.claim(user_scores_collection, score_events_collection, username, task_id, score, week.current()) is None:
             return jsonify({'error': 'Task is not approved for claiming'}), 400
         
-        update_result = user_scores_collection.update_one(
-            {'username': username},
-            {
-                '$inc': {'score': int(score)},
-                '$set': {f'task_states.{task_id}.status': 'claimed'}
-            }
-        )
-        
-        if update_result.modified_count == 0:
-            return jsonify({'error': 'Failed to claim reward'}), 500
-        
-        return jsonify({'message': 'Reward claimed successfully'}), 200
+        global_stats.record(score=score)
+        leaderboard.incr('weekly_score', username, score)
+        return jsonify({'message': 'Reward claimed successfully', 'score': score}), 200
     except Exception as e:
         logger.error(f"Error in claim_reward: {str(e)}")
         return jsonify({'error': f"An error occurred: {str(e)}"}), 500
@@ -1219,7 +1384,7 @@ def get_referral_earnings():
         if not username:
             return jsonify({'error': 'Invalid data'}), 400
 
-        user = user_scores_collection.find_one({'username': username})
+        user = user_repository.referral(username=username)
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
@@ -1251,7 +1416,7 @@ def submit_task_evidence():
         
         logger.info(f"Fetching task with ID: {task_id}")
         try:
-            task = tasks_collection.find_one({'_id': ObjectId(task_id)})
+            task = task_catalog.get(task_id)
             logger.info(f"Task found: {task}")
         except PyMongoError as e:
             logger.error(f"MongoDB error fetching task: {str(e)}")
@@ -1264,27 +1429,12 @@ def submit_task_evidence():
             logger.warning(f"Task not found: {task_id}")
             return jsonify({'error': 'Task not found'}), 404
 
-        submission = {
-            'username': username,
-            'task_id': ObjectId(task_id),
-            'evidence_url': evidence_url,
-            'status': 'pending',
-            'submitted_at': datetime.now(),
-            'is_recurring': bool(task.get('recurInterval'))
-        }
-
-        logger.info(f"Preparing to insert submission: {submission}")
         try:
-            # Check if task_submissions_collection is defined and accessible
-            if not task_submissions_collection:
-                logger.error("task_submissions_collection is not defined")
-                return jsonify({'error': 'Database configuration error'}), 500
-
-            # Test database connection
-            task_submissions_collection.database.client.server_info()
-            
-            result = task_submissions_collection.insert_one(submission)
-            logger.info(f"Submission inserted successfully. ID: {result.inserted_id}")
+            submission_id = task_submissions.submit(
+                task_submissions_collection, username, task['_id'], evidence_url, is_recurring=bool(task.get('recurInterval'))
+            )
+            user_scores_collection.update_one({'username': username}, {'$set': task_availability.submitted(task)})
+            logger.info(f"Submission queued successfully. ID: {submission_id}")
         except PyMongoError as e:
             logger.error(f"MongoDB error inserting submission: {str(e)}")
             return jsonify({'error': 'Database error inserting submission', 'details': str(e)}), 500
@@ -1294,7 +1444,7 @@ def submit_task_evidence():
 
         return jsonify({
             'message': 'Task evidence submitted successfully',
-            'submission_id': str(result.inserted_id)
+            'submission_id': str(submission_id)
         }), 200
     except Exception as e:
         logger.error(f"Unexpected error in submit_task_evidence: {str(e)}")
@@ -1304,38 +1454,51 @@ def submit_task_evidence():
 @app.route('/api/get_pending_submissions', methods=['GET'])
 def get_pending_submissions():
     try:
-        pipeline = [
-            {'$match': {'status': 'pending'}},
-            {'$lookup': {
-                'from': 'tasks',
-                'localField': 'task_id',
-                'foreignField': '_id',
-                'as': 'task_info'
-            }},
-            {'$unwind': '$task_info'},
-            {'$project': {
-                'submission_id': {'$toString': '$_id'},
-                'task_id': {'$toString': '$task_id'},
-                'username': 1,
-                'evidence_url': 1,
-                'submitted_at': 1,
-                'is_recurring': 1,
-                'task_description': '$task_info.description',
-                'task_score': '$task_info.score'
-            }}
+        try:
+            limit, after = task_submissions.parse_page_args(request.args)
+            submissions, next_cursor = task_submissions.pending(task_submissions_collection, task_catalog, limit, after)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        pending_submissions = [
+            {
+                'submission_id': str(submission['_id']),
+                'task_id': str(submission['task_id']),
+                'username': submission['username'],
+                'evidence_url': submission['evidence_url'],
+                'submitted_at': submission['submitted_at'],
+                'is_recurring': submission['is_recurring'],
+                'task_description': submission['task'].get('description'),
+                'task_score': submission['task'].get('score')
+            }
+            for submission in submissions
         ]
-
-        pending_submissions = list(task_submissions_collection.aggregate(pipeline))
-        return jsonify({'pending_submissions': pending_submissions}), 200
+        return jsonify({'pending_submissions': pending_submissions, 'next_cursor': next_cursor}), 200
     except Exception as e:
         logger.error(f"Error in get_pending_submissions: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 # Function to send reminder messages
+def get_reminder_recipients(after_id=None, limit: int = 500) -> list:
+    """One _id-ordered batch of the users a reminder goes to, after `after_id`."""
+    query = {'_id': {'$gt': after_id}} if after_id is not None else {}
+    return list(user_scores_collection.find(
+        query, {'identifier': 1, 'chat_id': 1, 'username': 1}
+    ).sort('_id', 1).limit(limit))
+
+async def iter_reminder_recipients():
+    """Every user, read a batch at a time on the database pool so the event loop never blocks."""
+    after_id = None
+    while True:
+        batch = await async_db.run(get_reminder_recipients, after_id)
+        if not batch:
+            return
+        for user in batch:
+            yield user
+        after_id = batch[-1]['_id']
+
 async def send_reminder_messages(application):
     logger.info("Starting to send reminder messages...")
-    users = user_scores_collection.find({})
-    for user in users:
+    async for user in iter_reminder_recipients():
         identifier = user.get('identifier')
         chat_id = user.get('chat_id')  # Retrieve the stored chat ID
         if not chat_id:
@@ -1369,16 +1532,29 @@ def run_send_reminder_messages(application):
 
 def reset_leaderboards():
     logger.info("Resetting leaderboards...")
-    user_scores_collection.update_many({}, {'$set': {'weekly_score': 0, 'weekly_referrals': 0}})
+    leaderboard.load()  # Include writes made by other processes in the archive
+    leaderboard_history.snapshot(leaderboard_history_collection, leaderboard_ranks_collection, leaderboard, week.current())
+    week.advance()  # Last week's counters now read as zero; compact_weekly_counters tidies them up later
+    leaderboard.clear()
     logger.info("Leaderboards reset successfully.")
 
+def compact_weekly_counters():
+    weekly.compact(user_scores_collection, week.current())
+
 
 if __name__ == '__main__':
+    global_stats.start()
+    leaderboard.load()
+    referral_credits.start()
+    review_queue.start()
+    if score_buffer:
+        score_buffer.start()
+
     from threading import Thread
     flask_thread = Thread(target=lambda: app.run(host='0.0.0.0', port=5002))
     flask_thread.start()
 
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(BOT_CONCURRENT_UPDATES).build()
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("leaderboard", show_leaderboard))
     application.add_handler(CallbackQueryHandler(button))
@@ -1388,6 +1564,9 @@ if __name__ == '__main__':
     # scheduler.add_job(lambda: run_send_reminder_messages(application), 'interval', hours=25, next_run_time=datetime.now())  # Run immediately and then every 150 hours
     # scheduler.add_job(lambda: run_send_reminder_messages(application), 'interval', hours=150)  # Send every 24 hours
     scheduler.add_job(reset_leaderboards, CronTrigger(day_of_week='sun', hour=12, minute=0, timezone=pytz.UTC))  # Reset every Sunday at 12:00 UTC
+    scheduler.add_job(global_stats.reconcile, 'interval', hours=1)  # Correct any drift in the global score stats
+    scheduler.add_job(leaderboard.load, 'interval', minutes=5)  # Pick up weekly scores written by other processes
+    scheduler.add_job(compact_weekly_counters, CronTrigger(day_of_week='sun', hour=14, minute=0, timezone=pytz.UTC))  # Clear stale weekly counters after the reset
 
     # Schedule the presale notification to run 1 minute after start
     start_time = datetime.now() + timedelta(seconds=60)
@@ -1396,3 +1575,4 @@ if __name__ == '__main__':
     scheduler.start()
 
     application.run_polling()
+    async_db.shutdown()
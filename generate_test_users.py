@@ -3,6 +3,7 @@ from bson import ObjectId
 import random
 import string
 from datetime import datetime
+from user_search import search_fields
 
 # Connect to MongoDB
 client = MongoClient('mongodb://localhost:27017/')
@@ -42,9 +43,11 @@ def create_test_users(count=50):
                 break
         
         score = generate_score()
+        username = generate_username()
         user = {
             'identifier': str(ObjectId()),
-            'username': generate_username(),
+            'username': username,
+            **search_fields(username),
             'score': score,
             'weekly_score': random.randint(0, score),
             'referral_code': referral_code,
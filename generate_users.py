@@ -4,6 +4,7 @@ import random
 import string
 import time
 from datetime import datetime
+from user_search import search_fields
 
 # Connect to MongoDB
 client = MongoClient('mongodb://localhost:27017/')
@@ -45,10 +46,12 @@ def create_fake_users(count):
                 referral_codes.add(referral_code)
                 break
         
+        username = generate_username()
         user = {
             '_id': ObjectId(),
             'identifier': str(ObjectId()),  # Unique identifier
-            'username': generate_username(),
+            'username': username,
+            **search_fields(username),
             'score': generate_score(),
             'weekly_score': 0,  # All weekly scores start at 0
             'referral_code': referral_code,
@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import request, jsonify, make_response
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+TTL_SECONDS = 24 * 3600
+MAX_ENTRIES = 10000
+PENDING_TIMEOUT = 60  # A reservation older than this belongs to a request that died
+
+
+class IdempotencyCache:
+    """Replays the stored response for a repeated Idempotency-Key.
+
+    Completed responses live in a bounded in-memory LRU (checked first) and in a
+    Mongo collection whose TTL index expires them after `ttl` seconds, so replays
+    are also caught by other processes and after a restart. The first request for
+    a key reserves it with a unique insert; a concurrent replay gets 409 until the
+    original finishes, or until PENDING_TIMEOUT if the original never does. A key
+    reused with a different body gets 422. Responses with a 5xx status are not
+    stored, so the client can retry them.
+    """
+
+    def __init__(self, collection, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {'requests': 0, 'memory_hits': 0, 'store_hits': 0, 'in_progress': 0, 'mismatches': 0, 'misses': 0}
+
+    def ensure_indexes(self) -> None:
+        self.collection.create_index([('created_at', ASCENDING)], expireAfterSeconds=self.ttl)
+
+    def _get_local(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put_local(self, key: str, fingerprint: str, status: int, body: str, mimetype: str) -> None:
+        with self._lock:
+            self._entries[key] = {
+                'fingerprint': fingerprint, 'status': status, 'body': body, 'mimetype': mimetype,
+                'expires': time.monotonic() + self.ttl
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, metric: str) -> None:
+        with self._lock:
+            self._metrics[metric] += 1
+
+    def _replay(self, entry: dict, fingerprint: str, metric: str):
+        if entry['fingerprint'] != fingerprint:
+            self._count('mismatches')
+            return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+        self._count(metric)
+        response = make_response(entry['body'], entry['status'])
+        response.mimetype = entry['mimetype']
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def _reserve(self, key: str, fingerprint: str):
+        """Claim the key for this request; returns None, or the response to send instead."""
+        for _ in range(2):
+            try:
+                self.collection.insert_one({'_id': key, 'state': 'pending', 'fingerprint': fingerprint, 'created_at': datetime.now()})
+                return None
+            except DuplicateKeyError:
+                stored = self.collection.find_one({'_id': key})
+            if stored is None:
+                continue
+            if stored.get('fingerprint') != fingerprint:
+                self._count('mismatches')
+                return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+            if stored.get('state') == 'completed':
+                self._put_local(key, stored['fingerprint'], stored['status'], stored['body'], stored['mimetype'])
+                return self._replay(stored, fingerprint, 'store_hits')
+            if (datetime.now() - stored['created_at']).total_seconds() > PENDING_TIMEOUT:
+                self.collection.delete_one({'_id': key, 'state': 'pending', 'created_at': stored['created_at']})
+                continue
+            break
+        self._count('in_progress')
+        return jsonify({'error': f'A request with this {HEADER} is still in progress'}), 409
+
+    def idempotent(self, scope: str):
+        """Decorator for a Flask view; requests without the header run as before."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = request.headers.get(HEADER)
+                if not key:
+                    return view(*args, **kwargs)
+                if len(key) > MAX_KEY_LENGTH:
+                    return jsonify({'error': f'{HEADER} is too long'}), 400
+
+                self._count('requests')
+                key = f'{scope}:{key}'
+                fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+                entry = self._get_local(key)
+                if entry:
+                    return self._replay(entry, fingerprint, 'memory_hits')
+
+                replay = self._reserve(key, fingerprint)
+                if replay is not None:
+                    return replay
+
+                self._count('misses')
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except Exception:
+                    self.collection.delete_one({'_id': key})
+                    raise
+                if response.status_code >= 500:
+                    self.collection.delete_one({'_id': key})
+                    return response
+
+                body = response.get_data(as_text=True)
+                try:
+                    self.collection.update_one({'_id': key}, {'$set': {
+                        'state': 'completed', 'status': response.status_code, 'body': body, 'mimetype': response.mimetype
+                    }})
+                except Exception as e:
+                    logger.error(f"Failed to store idempotent response for {key}: {str(e)}")
+                self._put_local(key, fingerprint, response.status_code, body, response.mimetype)
+                return response
+            return wrapper
+        return decorator
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['entries'] = len(self._entries)
+        hits = metrics['memory_hits'] + metrics['store_hits']
+        metrics['hit_rate'] = hits / metrics['requests'] if metrics['requests'] else 0.0
+        return metrics
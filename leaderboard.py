@@ -0,0 +1,208 @@
+import logging
+import random
+import threading
+
+import weekly
+
+logger = logging.getLogger(__name__)
+
+BOARDS = ('weekly_score', 'weekly_referrals')
+MAX_LEVELS = 24  # Plenty for 2**24 ranked members
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedIndex:
+    """Indexable skiplist of members ordered by score (descending), then member.
+
+    Every link stores how many positions it skips, so insert, remove, rank lookup
+    and fetching the member at a given rank are all O(log n).
+    """
+
+    def __init__(self):
+        self._tail = _Node((float('inf'), ''), 0)
+        self._head = _Node(None, MAX_LEVELS)
+        self._head.next = [self._tail] * MAX_LEVELS
+        self._scores = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, member) -> bool:
+        return member in self._scores
+
+    def score(self, member):
+        return self._scores.get(member, 0)
+
+    def _chain(self, key) -> tuple:
+        """Return the rightmost node before `key` on each level and its position."""
+        chain = [None] * MAX_LEVELS
+        positions = [0] * MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions, position
+
+    def _insert(self, key) -> None:
+        chain, positions, position = self._chain(key)
+        levels = 1
+        while levels < MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        node = _Node(key, levels)
+        for level in range(levels):
+            prev = chain[level]
+            skipped = position - positions[level]
+            node.next[level] = prev.next[level]
+            node.width[level] = prev.width[level] - skipped
+            prev.next[level] = node
+            prev.width[level] = skipped + 1
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+
+    def _remove(self, key) -> None:
+        chain, _, _ = self._chain(key)
+        node = chain[0].next[0]
+        for level in range(len(node.next)):
+            chain[level].width[level] += node.width[level] - 1
+            chain[level].next[level] = node.next[level]
+        for level in range(len(node.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+
+    def set(self, member, score) -> None:
+        """Set a member's score; members at zero or below leave the ranking."""
+        if member in self._scores:
+            self._remove((-self._scores.pop(member), member))
+        if score > 0:
+            self._scores[member] = score
+            self._insert((-score, member))
+
+    def incr(self, member, delta) -> None:
+        self.set(member, self._scores.get(member, 0) + delta)
+
+    def rank(self, member):
+        """1-based rank of `member`, or None when it is not ranked."""
+        if member not in self._scores:
+            return None
+        return self._chain((-self._scores[member], member))[2] + 1
+
+    def rank_of_score(self, score) -> int:
+        """1 plus the number of members with a strictly higher score; ties share it."""
+        # '' sorts before every member, so this counts exactly the higher scores
+        return self._chain((-score, ''))[2] + 1
+
+    def _node_at(self, rank: int):
+        node, remaining = self._head, rank
+        for level in reversed(range(MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start_rank: int, count: int) -> list:
+        """Return up to `count` (rank, member, score) entries starting at `start_rank`."""
+        entries = []
+        if start_rank > len(self):
+            return entries
+        node = self._node_at(start_rank)
+        rank = start_rank
+        while node is not self._tail and len(entries) < count:
+            entries.append((rank, node.key[1], -node.key[0]))
+            node = node.next[0]
+            rank += 1
+        return entries
+
+    def top(self, count: int) -> list:
+        return self.slice(1, count)
+
+
+class Leaderboard:
+    """In-process weekly leaderboards kept fresh by write-through from the score paths.
+
+    Members are keyed by username, which matches the identifier for users created
+    through /start. load() rebuilds the boards from user_scores and is also run
+    periodically to pick up writes made by other processes. With a
+    weekly.WeekEpoch, only counters from the current week are loaded.
+    """
+
+    def __init__(self, user_scores_collection, week=None):
+        self.user_scores_collection = user_scores_collection
+        self.week = week
+        self.boards = {board: RankedIndex() for board in BOARDS}
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self) -> None:
+        """Index (week_epoch, board) so load() only reads players who scored this week."""
+        weekly.ensure_indexes(self.user_scores_collection)
+
+    def load(self) -> None:
+        boards = {board: RankedIndex() for board in BOARDS}
+        epoch = self.week.current() if self.week else None
+        for board, index in boards.items():
+            query = {board: {'$gt': 0}}
+            if epoch is not None:
+                query['week_epoch'] = epoch
+            cursor = self.user_scores_collection.find(
+                query,
+                {board: 1, 'username': 1, 'identifier': 1, '_id': 0}
+            )
+            for user in cursor:
+                member = user.get('username') or user.get('identifier')
+                if member:
+                    index.set(member, user[board])
+        with self._lock:
+            self.boards = boards
+        logger.info(f"Loaded leaderboards: {', '.join(f'{b}={len(i)}' for b, i in boards.items())}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self.boards = {board: RankedIndex() for board in BOARDS}
+
+    def incr(self, board: str, member: str, delta: int) -> None:
+        with self._lock:
+            self.boards[board].incr(member, delta)
+
+    def top(self, board: str, limit: int) -> list:
+        with self._lock:
+            entries = self.boards[board].top(limit)
+        return [{'rank': rank, 'username': member, board: score} for rank, member, score in entries]
+
+    def rank_of_score(self, board: str, score) -> int:
+        with self._lock:
+            return self.boards[board].rank_of_score(score)
+
+    def standings(self, board: str) -> list:
+        """Every ranked member of the board as (rank, member, score), best first."""
+        with self._lock:
+            index = self.boards[board]
+            return index.slice(1, len(index))
+
+    def rank(self, board: str, member: str, radius: int = 2) -> dict:
+        """Return the member's rank and score plus the `radius` players on either side."""
+        with self._lock:
+            index = self.boards[board]
+            rank = index.rank(member)
+            score = index.score(member)
+            total = len(index)
+            if rank is None:
+                neighbours = index.slice(max(total - radius + 1, 1), radius)
+            else:
+                start = max(rank - radius, 1)
+                neighbours = index.slice(start, rank - start + radius + 1)
+        return {
+            'username': member,
+            'rank': rank,
+            board: score,
+            'ranked_players': total,
+            'neighbours': [{'rank': r, 'username': m, board: s} for r, m, s in neighbours]
+        }
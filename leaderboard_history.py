@@ -0,0 +1,101 @@
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 100
+BATCH_SIZE = 5000
+MAX_LISTED = 100
+
+
+def ensure_indexes(history_collection, ranks_collection) -> None:
+    history_collection.create_index([('board', ASCENDING), ('epoch', DESCENDING)])
+    ranks_collection.create_index([('username', ASCENDING), ('board', ASCENDING), ('epoch', DESCENDING)])
+    ranks_collection.create_index([('epoch', ASCENDING), ('board', ASCENDING), ('rank', ASCENDING)])
+
+
+def _distribution(standings: list) -> list:
+    """Run-length encode the scores, highest first: [[score, players with that score], ...]."""
+    runs = []
+    for _, _, score in standings:
+        if runs and runs[-1][0] == score:
+            runs[-1][1] += 1
+        else:
+            runs.append([score, 1])
+    return runs
+
+
+def snapshot(history_collection, ranks_collection, leaderboard, epoch: int, top_n: int = TOP_N) -> dict:
+    """Archive the final standings of week `epoch` for every board before it is reset.
+
+    Each board gets one leaderboard_history document with the top `top_n` and the
+    whole score distribution, plus one leaderboard_ranks row per ranked player
+    for rank history lookups. Re-running for the same epoch replaces the archive.
+    """
+    summary = {}
+    taken_at = datetime.now()
+    for board in leaderboard.boards:
+        standings = leaderboard.standings(board)
+        history_collection.replace_one(
+            {'_id': f'{epoch}:{board}'},
+            {
+                'epoch': epoch,
+                'board': board,
+                'taken_at': taken_at,
+                'players': len(standings),
+                'top': [{'rank': rank, 'username': member, board: score} for rank, member, score in standings[:top_n]],
+                'distribution': _distribution(standings)
+            },
+            upsert=True
+        )
+        ranks_collection.delete_many({'epoch': epoch, 'board': board})
+        for start in range(0, len(standings), BATCH_SIZE):
+            ranks_collection.insert_many([
+                {'epoch': epoch, 'board': board, 'username': member, 'rank': rank, 'value': score}
+                for rank, member, score in standings[start:start + BATCH_SIZE]
+            ], ordered=False)
+        summary[board] = len(standings)
+    logger.info(f"Archived week {epoch} leaderboards: {summary}")
+    return summary
+
+
+def weeks(history_collection, board: str, limit: int = 20) -> list:
+    """Archived weeks for a board, newest first, with their winner."""
+    cursor = history_collection.find(
+        {'board': board},
+        {'_id': 0, 'epoch': 1, 'taken_at': 1, 'players': 1, 'top': {'$slice': 1}}
+    ).sort('epoch', DESCENDING).limit(min(max(limit, 1), MAX_LISTED))
+    return [
+        {'epoch': week['epoch'], 'taken_at': week['taken_at'], 'players': week['players'],
+         'winner': week['top'][0] if week.get('top') else None}
+        for week in cursor
+    ]
+
+
+def winners(history_collection, board: str, epoch: int, limit: int = 10):
+    """Top `limit` players of an archived week, or None if that week was not archived."""
+    return history_collection.find_one(
+        {'_id': f'{epoch}:{board}'},
+        {'_id': 0, 'distribution': 0, 'top': {'$slice': min(max(limit, 1), TOP_N)}}
+    )
+
+
+def rank_history(history_collection, ranks_collection, username: str, board: str, limit: int = 20) -> list:
+    """The user's final rank in each archived week they were ranked, newest first."""
+    rows = list(ranks_collection.find(
+        {'username': username, 'board': board},
+        {'_id': 0, 'epoch': 1, 'rank': 1, 'value': 1}
+    ).sort('epoch', DESCENDING).limit(min(max(limit, 1), MAX_LISTED)))
+    players = {
+        week['epoch']: week['players']
+        for week in history_collection.find(
+            {'_id': {'$in': [f"{row['epoch']}:{board}" for row in rows]}}, {'_id': 0, 'epoch': 1, 'players': 1}
+        )
+    }
+    for row in rows:
+        row[board] = row.pop('value')
+        row['players'] = players.get(row['epoch'])
+        row['percentile'] = round(100 * (1 - (row['rank'] - 1) / row['players']), 2) if row['players'] else None
+    return rows
@@ -0,0 +1,94 @@
+import base64
+import json
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+MAX_PAGE_SIZE = 100
+
+# Heavy or private fields that list views never need
+LIST_PROJECTION = {
+    'scores': 0,
+    'referrals': 0,
+    'bep20_wallet_private_key': 0,
+    'username_trigrams': 0
+}
+
+# Sort orders for the user list; each one is backed by an index from ensure_indexes()
+SORT_ORDERS = {
+    '_id': [('_id', ASCENDING)],
+    'score': [('score', DESCENDING), ('_id', DESCENDING)]
+}
+
+
+def ensure_indexes(user_scores_collection) -> None:
+    """Create the indexes that keep every page an index range read."""
+    user_scores_collection.create_index([('score', DESCENDING), ('_id', DESCENDING)])
+    user_scores_collection.create_index([('referrer', ASCENDING), ('_id', ASCENDING)])
+    user_scores_collection.create_index([('referrer', ASCENDING), ('score', DESCENDING), ('_id', DESCENDING)])
+
+
+def parse_page_args(args) -> tuple:
+    """Read page/limit from request args, clamping them to sane values."""
+    page = max(int(args.get('page', 1)), 1)
+    limit = min(max(int(args.get('limit', 10)), 1), MAX_PAGE_SIZE)
+    return page, limit
+
+
+def encode_cursor(doc: dict, sort: str) -> str:
+    """Build the opaque cursor that resumes a listing right after `doc`."""
+    key = [str(doc['_id'])] if sort == '_id' else [doc.get('score'), str(doc['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(token: str, sort: str) -> dict:
+    """Turn an opaque cursor back into the query that selects the rows after it."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if sort == '_id':
+            return {'_id': {'$gt': ObjectId(key[0])}}
+        score, last_id = key[0], ObjectId(key[1])
+    except (ValueError, TypeError, IndexError, InvalidId):
+        raise ValueError('Invalid cursor')
+
+    # Users without a score sort after every numeric score in descending order
+    if score is None:
+        return {'score': None, '_id': {'$lt': last_id}}
+    return {'$or': [
+        {'score': {'$lt': score}},
+        {'score': score, '_id': {'$lt': last_id}},
+        {'score': None}
+    ]}
+
+
+def fetch_after(collection, query: dict, after: str, limit: int, sort: str = '_id') -> tuple:
+    """Fetch the rows following `after` (empty for the first page) and the next cursor."""
+    if after:
+        query = {'$and': [query, decode_cursor(after, sort)]} if query else decode_cursor(after, sort)
+    docs = list(collection.find(query, LIST_PROJECTION).sort(SORT_ORDERS[sort]).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1], sort) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def paginate(collection, query: dict, args) -> tuple:
+    """Serve either page/limit or keyset mode (when `after` is present) from request args."""
+    sort = args.get('sort', '_id')
+    if sort not in SORT_ORDERS:
+        raise ValueError('Invalid sort')
+    page, limit = parse_page_args(args)
+    if 'after' in args:
+        docs, next_cursor = fetch_after(collection, query, args.get('after'), limit, sort)
+        return docs, {'next_cursor': next_cursor}
+    return fetch_page(collection, query, page, limit, sort), {}
+
+
+def fetch_page(collection, query: dict, page: int, limit: int, sort: str = '_id') -> list:
+    """Fetch one page of documents in index order without materializing the collection."""
+    cursor = collection.find(query, LIST_PROJECTION).sort(SORT_ORDERS[sort])
+    return list(cursor.skip((page - 1) * limit).limit(limit))
+
+
+def top_performers(collection, limit: int = 3) -> list:
+    """Return the highest scoring users straight off the score index."""
+    return list(collection.find({}, LIST_PROJECTION).sort(SORT_ORDERS['score']).limit(limit))
@@ -0,0 +1,150 @@
+import logging
+import time
+from datetime import datetime
+
+from pymongo import DESCENDING, UpdateMany, UpdateOne
+
+import score_events
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('daily', 'weekly', 'monthly', 'all')
+MAX_LIMIT = 100
+
+
+class PeriodLeaderboards:
+    """Top-N and rank lookups for the daily, weekly, monthly and all-time score boards.
+
+    Every board is a pre-aggregated total read through a (period, total) index:
+    daily from the score_events day buckets, monthly from score_months, weekly
+    from the epoch-tagged weekly_score (or the in-memory Leaderboard when one is
+    given) and all-time from score. The score writes keep every total up to
+    date, so no query touches individual events. On every board, the in-memory
+    weekly one included, a rank is one plus the number of players with a
+    strictly higher total, so tied players share a rank.
+    """
+
+    def __init__(self, user_scores_collection, score_events_collection, week, leaderboard=None):
+        self.user_scores_collection = user_scores_collection
+        self.score_events_collection = score_events_collection
+        self.score_months_collection = score_events.months_collection(score_events_collection)
+        self.week = week
+        self.leaderboard = leaderboard
+
+    def _board(self, period: str, now: datetime = None) -> tuple:
+        """(collection, query, total field, member fields) for the period's current board."""
+        now = now or datetime.now()
+        if period == 'daily':
+            return self.score_events_collection, {'day': score_events.day_start(now)}, 'total', ('member',)
+        if period == 'monthly':
+            return self.score_months_collection, {'month': score_events.month_start(now)}, 'total', ('member',)
+        if period == 'weekly':
+            return self.user_scores_collection, {'week_epoch': self.week.current()}, 'weekly_score', ('username', 'identifier')
+        if period == 'all':
+            return self.user_scores_collection, {}, 'score', ('username', 'identifier')
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+
+    def top(self, period: str, limit: int = 10) -> list:
+        """The period's best players as [{'rank', 'username', 'score'}], ties sharing a rank."""
+        limit = min(max(limit, 1), MAX_LIMIT)
+        if period == 'weekly' and self.leaderboard:
+            rows = [
+                (entry['username'], entry['weekly_score'])
+                for entry in self.leaderboard.top('weekly_score', limit)
+            ]
+        else:
+            collection, query, field, member_fields = self._board(period)
+            cursor = collection.find(
+                {**query, field: {'$gt': 0}},
+                {field: 1, **{name: 1 for name in member_fields}, '_id': 0}
+            ).sort(field, DESCENDING).limit(limit)
+            rows = [(next((row[name] for name in member_fields if row.get(name)), None), row[field]) for row in cursor]
+
+        entries = []
+        for position, (member, score) in enumerate(rows, start=1):
+            rank = entries[-1]['rank'] if entries and entries[-1]['score'] == score else position
+            entries.append({'rank': rank, 'username': member, 'score': score})
+        return entries
+
+    def rank(self, period: str, member: str) -> dict:
+        """The member's score and rank on the period's board; rank is None without a score."""
+        if period == 'weekly' and self.leaderboard:
+            entry = self.leaderboard.rank('weekly_score', member, radius=0)
+            score = entry['weekly_score']
+            rank = self.leaderboard.rank_of_score('weekly_score', score) if entry['rank'] is not None else None
+            return {'period': period, 'username': member, 'rank': rank, 'score': score}
+        collection, query, field, member_fields = self._board(period)
+        row = collection.find_one(
+            {**query, '$or': [{name: member} for name in member_fields]}, {field: 1, '_id': 0}
+        )
+        score = (row or {}).get(field) or 0
+        rank = None
+        if score > 0:
+            rank = collection.count_documents({**query, field: {'$gt': score}}) + 1
+        return {'period': period, 'username': member, 'rank': rank, 'score': score}
+
+
+def backfill(user_scores_collection, score_events_collection, since: datetime = None,
+             batch_size: int = 1000, pause: float = 0.1) -> int:
+    """Tag day buckets from `since` (default: this month) with their member and rebuild those months' totals.
+
+    Monthly totals are recomputed from the buckets and overwritten, so run this
+    before score writers that maintain score_months start. Safe to re-run.
+    """
+    since = since or score_events.month_start(datetime.now())
+    score_months_collection = score_events.months_collection(score_events_collection)
+    tagged = 0
+    while True:
+        buckets = list(score_events_collection.find(
+            {'day': {'$gte': since}, 'member': {'$exists': False}}, {'user_id': 1}
+        ).limit(batch_size))
+        if not buckets:
+            break
+        user_ids = list({bucket['user_id'] for bucket in buckets})
+        members = {
+            user['_id']: user.get('username') or user.get('identifier')
+            for user in user_scores_collection.find({'_id': {'$in': user_ids}}, {'username': 1, 'identifier': 1})
+        }
+        result = score_events_collection.bulk_write([
+            UpdateMany({'user_id': user_id, 'day': {'$gte': since}, 'member': {'$exists': False}},
+                       {'$set': {'member': members.get(user_id)}})
+            for user_id in user_ids
+        ], ordered=False)
+        tagged += result.modified_count
+        logger.info(f"Tagged {tagged} score buckets with their member")
+        time.sleep(pause)
+
+    months = score_events_collection.aggregate([
+        {'$match': {'day': {'$gte': since}}},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'month': {'$dateFromParts': {'year': {'$year': '$day'}, 'month': {'$month': '$day'}}}},
+            'member': {'$last': '$member'},
+            'count': {'$sum': '$count'},
+            'total': {'$sum': '$total'}
+        }}
+    ])
+    ops, rebuilt = [], 0
+    for month in months:
+        ops.append(UpdateOne(
+            {'user_id': month['_id']['user_id'], 'month': month['_id']['month']},
+            {'$set': {'member': month['member'], 'count': month['count'], 'total': month['total']}},
+            upsert=True
+        ))
+        if len(ops) >= batch_size:
+            rebuilt += len(ops)
+            score_months_collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        rebuilt += len(ops)
+        score_months_collection.bulk_write(ops, ordered=False)
+    logger.info(f"Rebuilt {rebuilt} monthly score totals")
+    return tagged
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    score_events.ensure_indexes(db['score_events'])
+    print(f"Tagged {backfill(db['user_scores'], db['score_events'])} score buckets")
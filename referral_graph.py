@@ -0,0 +1,346 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 60
+FULL_RELOAD_INTERVAL = 3600  # Incremental refreshes only add edges; a full reload also picks up removed ones
+MAX_DEPTH = 10
+MAX_LISTED = 1000
+
+
+class ReferralGraph:
+    """In-memory referral tree over every user, answering multi-level queries.
+
+    Users are numbered 0..n-1 in load order. `parent[i]` is the referrer's index
+    (-1 for none), children are kept in CSR form (`offsets`, `children`) plus a
+    small overflow map for edges added since the last full build, and `sizes[i]`
+    is the size of i's subtree including i. Referrers that form a cycle are
+    flagged in `in_cycle`; their subtree sizes only count the acyclic part.
+    refresh() adds users and referral_edges created since the last call and
+    updates sizes along the ancestor chain, so steady-state refreshes touch only
+    what changed.
+    """
+
+    def __init__(self, user_scores_collection, referral_edges_collection=None,
+                 refresh_interval=REFRESH_INTERVAL, full_reload_interval=FULL_RELOAD_INTERVAL):
+        self.user_scores_collection = user_scores_collection
+        self.referral_edges_collection = referral_edges_collection
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.ids = []
+        self.index = {}
+        self.parent = array('i')
+        self.offsets = array('i', [0])
+        self.children = array('i')
+        self.sizes = array('i')
+        self.in_cycle = bytearray()
+        self._extra_children = {}
+        self._waiting = {}  # referrer identifier not loaded yet -> child indexes
+        self.self_referrals = []
+        self._top_cache = None
+        self._last_id = None
+        self._last_edge_at = None
+        self.loaded_at = None
+        self.built_at = None
+
+    # Loading
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='referral-graph', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if not self.loaded_at or time.monotonic() - self.loaded_at > self.full_reload_interval:
+                    self.load()
+                else:
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh referral graph: {str(e)}")
+            self._stop.wait(self.refresh_interval)
+
+    def load(self) -> None:
+        """Rebuild the whole graph from user_scores."""
+        started = time.perf_counter()
+        ids, referrers = [], []
+        last_id = None
+        edges_since = datetime.now()
+        for user in self.user_scores_collection.find({}, {'identifier': 1, 'referrer': 1}).sort('_id', 1):
+            last_id = user['_id']
+            if not user.get('identifier'):
+                continue
+            ids.append(user['identifier'])
+            referrers.append(user.get('referrer'))
+
+        with self._lock:
+            self._reset()
+            self.ids = ids
+            self.index = {identifier: i for i, identifier in enumerate(ids)}
+            n = len(ids)
+            self.parent = array('i', [-1]) * n
+            for i, referrer in enumerate(referrers):
+                if not referrer:
+                    continue
+                if referrer == ids[i]:
+                    self.self_referrals.append(i)
+                    continue
+                p = self.index.get(referrer, -1)
+                if p >= 0:
+                    self.parent[i] = p
+                else:
+                    self._waiting.setdefault(referrer, []).append(i)
+            self._build()
+            self._last_id = last_id
+            self._last_edge_at = edges_since
+            self.loaded_at = self.built_at = time.monotonic()
+        logger.info(f"Loaded referral graph with {len(ids)} users in {time.perf_counter() - started:.2f}s")
+
+    def _build(self) -> None:
+        """Rebuild CSR adjacency, cycle flags and subtree sizes from `parent`."""
+        n = len(self.ids)
+        parent = self.parent
+        counts = array('i', [0]) * (n + 1)
+        for p in parent:
+            if p >= 0:
+                counts[p + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.offsets = array('i', counts)
+        cursor = array('i', counts[:n])
+        self.children = array('i', [0]) * counts[n]
+        for i, p in enumerate(parent):
+            if p >= 0:
+                self.children[cursor[p]] = i
+                cursor[p] += 1
+        self._extra_children = {}
+
+        # Everything reachable from a root is acyclic; what is left hangs off a cycle
+        order = [i for i in range(n) if parent[i] < 0]
+        for i in order:
+            order.extend(self._child_list(i))
+        self.in_cycle = bytearray(n)
+        if len(order) < n:
+            visited = bytearray(n)
+            for i in order:
+                visited[i] = 1
+            for start in range(n):
+                if visited[start]:
+                    continue
+                path, node = [], start
+                while node >= 0 and not visited[node]:
+                    visited[node] = 2
+                    path.append(node)
+                    node = parent[node]
+                if node >= 0 and visited[node] == 2:
+                    # The walk came back to itself: mark the loop
+                    loop_start = path.index(node)
+                    for member in path[loop_start:]:
+                        self.in_cycle[member] = 1
+                for member in path:
+                    visited[member] = 1
+            cycle_roots = [i for i in range(n) if self.in_cycle[i]]
+            position = len(order)
+            order.extend(cycle_roots)
+            while position < len(order):
+                order.extend(c for c in self._child_list(order[position]) if not self.in_cycle[c])
+                position += 1
+
+        self.sizes = array('i', [1]) * n
+        for i in reversed(order):
+            p = parent[i]
+            if p >= 0 and not self.in_cycle[i]:
+                self.sizes[p] += self.sizes[i]
+        self._top_cache = None
+        self.built_at = time.monotonic()
+
+    def refresh(self) -> int:
+        """Add users and referral edges created since the last load or refresh; returns edges added."""
+        if not self.loaded_at:
+            self.load()
+            return 0
+        query = {'_id': {'$gt': self._last_id}} if self._last_id is not None else {}
+        new_users = list(self.user_scores_collection.find(query, {'identifier': 1, 'referrer': 1}).sort('_id', 1))
+        edges = []
+        edges_since = datetime.now()
+        if self.referral_edges_collection is not None and self._last_edge_at:
+            edges = list(self.referral_edges_collection.find(
+                {'created_at': {'$gte': self._last_edge_at}}, {'referrer': 1, 'referred': 1, '_id': 0}
+            ))
+
+        added = 0
+        with self._lock:
+            for user in new_users:
+                self._last_id = user['_id']
+                identifier = user.get('identifier')
+                if not identifier or identifier in self.index:
+                    continue
+                i = self._add_node(identifier)
+                for child in self._waiting.pop(identifier, []):
+                    added += self._attach(child, i)
+                referrer = user.get('referrer')
+                if referrer:
+                    added += self._link(i, referrer)
+            for edge in edges:
+                child = self.index.get(edge['referred'])
+                if child is not None and self.parent[child] < 0:
+                    added += self._link(child, edge['referrer'])
+            self._last_edge_at = edges_since
+            if added:
+                self._top_cache = None
+            if len(self._extra_children) > max(1000, len(self.ids) // 20):
+                self._build()
+        return added
+
+    def _add_node(self, identifier: str) -> int:
+        i = len(self.ids)
+        self.ids.append(identifier)
+        self.index[identifier] = i
+        self.parent.append(-1)
+        self.offsets.append(self.offsets[-1])
+        self.sizes.append(1)
+        self.in_cycle.append(0)
+        return i
+
+    def _link(self, child: int, referrer: str) -> int:
+        if referrer == self.ids[child]:
+            self.self_referrals.append(child)
+            return 0
+        p = self.index.get(referrer)
+        if p is None:
+            self._waiting.setdefault(referrer, []).append(child)
+            return 0
+        return self._attach(child, p)
+
+    def _attach(self, child: int, p: int) -> int:
+        """Make p the parent of child and grow the sizes of p and its ancestors."""
+        if self.parent[child] >= 0:
+            return 0
+        self.parent[child] = p
+        self._extra_children.setdefault(p, []).append(child)
+        node, steps = p, 0
+        while node >= 0 and steps <= len(self.ids):
+            if node == child:
+                # child was already an ancestor of p: the new edge closes a cycle
+                self._build()
+                return 1
+            self.sizes[node] += self.sizes[child]
+            if self.in_cycle[node]:
+                break
+            node = self.parent[node]
+            steps += 1
+        return 1
+
+    # Queries
+
+    def _child_list(self, i: int) -> list:
+        listed = self.children[self.offsets[i]:self.offsets[i + 1]].tolist() if i + 1 < len(self.offsets) else []
+        return listed + self._extra_children.get(i, [])
+
+    def _require(self, identifier: str) -> int:
+        if not self.loaded_at:
+            raise RuntimeError('Referral graph is not loaded yet')
+        i = self.index.get(identifier)
+        if i is None:
+            raise KeyError(identifier)
+        return i
+
+    def subtree_size(self, identifier: str) -> int:
+        """Number of users referred by `identifier`, directly or further down."""
+        with self._lock:
+            return self.sizes[self._require(identifier)] - 1
+
+    def descendants(self, identifier: str, depth: int = 3, limit: int = 100) -> dict:
+        """Users referred by `identifier` level by level, down to `depth` levels."""
+        depth = min(max(depth, 1), MAX_DEPTH)
+        limit = min(max(limit, 0), MAX_LISTED)
+        with self._lock:
+            i = self._require(identifier)
+            levels = []
+            frontier = [i]
+            seen = {i}
+            for level in range(1, depth + 1):
+                frontier = [c for node in frontier for c in self._child_list(node) if c not in seen]
+                if not frontier:
+                    break
+                seen.update(frontier)
+                levels.append({
+                    'level': level,
+                    'count': len(frontier),
+                    'identifiers': [self.ids[c] for c in frontier[:limit]]
+                })
+            return {
+                'identifier': identifier,
+                'referrer': self.ids[self.parent[i]] if self.parent[i] >= 0 else None,
+                'subtree_size': self.sizes[i] - 1,
+                'in_cycle': bool(self.in_cycle[i]),
+                'levels': levels
+            }
+
+    def top_referrers(self, limit: int = 20) -> list:
+        """Users with the largest total downline."""
+        limit = min(max(limit, 1), MAX_LISTED)
+        with self._lock:
+            if not self.loaded_at:
+                raise RuntimeError('Referral graph is not loaded yet')
+            if self._top_cache is None or len(self._top_cache) < limit:
+                self._top_cache = heapq.nlargest(max(limit, 100), range(len(self.ids)), key=self.sizes.__getitem__)
+            return [
+                {
+                    'identifier': self.ids[i],
+                    'downline': self.sizes[i] - 1,
+                    'direct': self.offsets[i + 1] - self.offsets[i] + len(self._extra_children.get(i, []))
+                }
+                for i in self._top_cache[:limit] if self.sizes[i] > 1
+            ]
+
+    def anomalies(self, limit: int = 100) -> dict:
+        """Self-referrals, referral cycles and referrers that are not known users."""
+        limit = min(max(limit, 1), MAX_LISTED)
+        with self._lock:
+            if not self.loaded_at:
+                raise RuntimeError('Referral graph is not loaded yet')
+            cycles, seen = [], set()
+            for i in range(len(self.ids)):
+                if not self.in_cycle[i] or i in seen:
+                    continue
+                loop, node = [], i
+                while node not in seen:
+                    seen.add(node)
+                    loop.append(self.ids[node])
+                    node = self.parent[node]
+                cycles.append(loop)
+            return {
+                'self_referrals': [self.ids[i] for i in self.self_referrals[:limit]],
+                'self_referral_count': len(self.self_referrals),
+                'cycles': cycles[:limit],
+                'cycle_count': len(cycles),
+                'unknown_referrers': list(self._waiting)[:limit],
+                'unknown_referrer_count': len(self._waiting)
+            }
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'loaded': bool(self.loaded_at),
+                'users': len(self.ids),
+                'referred_users': sum(1 for p in self.parent if p >= 0),
+                'pending_edges': sum(len(children) for children in self._extra_children.values()),
+                'seconds_since_build': time.monotonic() - self.built_at if self.built_at else None
+            }
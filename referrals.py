@@ -0,0 +1,212 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne, InsertOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+
+import weekly
+
+logger = logging.getLogger(__name__)
+
+REFERRAL_REWARD = 20
+FLUSH_INTERVAL = 1.0
+
+
+def ensure_indexes(referral_edges_collection) -> None:
+    referral_edges_collection.create_index([('referred', ASCENDING)], unique=True)
+    referral_edges_collection.create_index([('referrer', ASCENDING), ('created_at', ASCENDING)])
+    referral_edges_collection.create_index([('credited', ASCENDING), ('batch', ASCENDING)])
+    referral_edges_collection.create_index([('created_at', ASCENDING)])
+
+
+class ReferralCredits:
+    """Exactly-once referral crediting through the referral_edges ledger.
+
+    record() inserts one edge per referred user; the unique `referred` index turns
+    any repeat into a no-op. Rewards are paid by a background flusher: it claims
+    every uncredited edge under a new batch id, then applies one $inc per referrer
+    that is guarded by the batch id, so a batch that is replayed after a crash
+    (see recover()) never pays a referrer twice. Edges pointing at unknown
+    referrers are dropped and the referred user's referrer is cleared again.
+    """
+
+    def __init__(self, user_scores_collection, referral_edges_collection, flush_interval=FLUSH_INTERVAL, on_credit=None, week=None):
+        self.user_scores_collection = user_scores_collection
+        self.referral_edges_collection = referral_edges_collection
+        self.week = week
+        self.flush_interval = flush_interval
+        self.on_credit = on_credit
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self.recover()
+        self._thread = threading.Thread(target=self._run, name='referral-credits', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush referral credits on shutdown: {str(e)}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush referral credits: {str(e)}")
+
+    def record(self, referrer: str, referred: str) -> bool:
+        """Add the referral edge; returns False if `referred` already has one."""
+        try:
+            self.referral_edges_collection.insert_one({
+                'referred': referred,
+                'referrer': referrer,
+                'created_at': datetime.now(),
+                'credited': False,
+                'batch': None
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def flush(self) -> dict:
+        """Credit every pending edge; returns {referrer: referrals credited}."""
+        with self._lock:
+            batch = ObjectId()
+            claimed = self.referral_edges_collection.update_many(
+                {'credited': False, 'batch': None}, {'$set': {'batch': batch}}
+            )
+            if not claimed.modified_count:
+                return {}
+            return self._credit(batch)
+
+    def recover(self) -> None:
+        """Finish batches that were claimed but not completed, e.g. by a process that died."""
+        with self._lock:
+            for batch in self.referral_edges_collection.distinct('batch', {'credited': False, 'batch': {'$ne': None}}):
+                self._credit(batch)
+
+    @staticmethod
+    def _reward(batch, attempt, count: int, epoch: int = None):
+        if epoch is None:
+            return {
+                '$inc': {'score': REFERRAL_REWARD * count, 'referral_count': count, 'weekly_referrals': count},
+                '$push': {'referral_batches': batch, 'referral_attempts': attempt}
+            }
+        return [{'$set': {
+            'score': {'$add': [{'$ifNull': ['$score', 0]}, REFERRAL_REWARD * count]},
+            'referral_count': {'$add': [{'$ifNull': ['$referral_count', 0]}, count]},
+            'referral_batches': {'$concatArrays': [{'$ifNull': ['$referral_batches', []]}, [batch]]},
+            'referral_attempts': {'$concatArrays': [{'$ifNull': ['$referral_attempts', []]}, [attempt]]},
+            **weekly.week_fields(epoch, referrals=count)
+        }}]
+
+    def _credit(self, batch) -> dict:
+        """Pay a claimed batch; returns {referrer: referrals credited by this call}.
+
+        Each guarded $inc also stamps the referrer with this call's attempt id.
+        Reading the stamps back tells which referrers this call paid, as opposed
+        to ones a replay or another process had already paid. Only those reach
+        on_credit, so in-memory stats and leaderboards never count a batch twice.
+        """
+        counts = {}
+        for edge in self.referral_edges_collection.find({'batch': batch, 'credited': False}, {'referrer': 1, 'referred': 1}):
+            counts.setdefault(edge['referrer'], []).append(edge['referred'])
+        if not counts:
+            return {}
+
+        known = {
+            user['identifier']
+            for user in self.user_scores_collection.find({'identifier': {'$in': list(counts)}}, {'identifier': 1, '_id': 0})
+        }
+        epoch = self.week.current() if self.week else None
+        attempt = ObjectId()
+        ops = [
+            UpdateOne({'identifier': referrer, 'referral_batches': {'$ne': batch}}, self._reward(batch, attempt, len(referred), epoch))
+            for referrer, referred in counts.items() if referrer in known
+        ]
+        paid = set()
+        if ops:
+            self.user_scores_collection.bulk_write(ops, ordered=False)
+            paid = {
+                user['identifier']
+                for user in self.user_scores_collection.find(
+                    {'identifier': {'$in': list(known)}, 'referral_attempts': attempt}, {'identifier': 1, '_id': 0}
+                )
+            }
+
+        for referrer in set(counts) - known:
+            logger.warning(f"Referrer {referrer} not found in database")
+            self.user_scores_collection.update_many(
+                {'identifier': {'$in': counts[referrer]}, 'referrer': referrer}, {'$set': {'referrer': None}}
+            )
+            self.referral_edges_collection.delete_many({'batch': batch, 'referrer': referrer})
+
+        self.referral_edges_collection.update_many({'batch': batch}, {'$set': {'credited': True}})
+        if known:
+            self.user_scores_collection.update_many(
+                {'identifier': {'$in': list(known)}}, {'$pull': {'referral_batches': batch, 'referral_attempts': attempt}}
+            )
+
+        credited = {referrer: len(counts[referrer]) for referrer in paid}
+        if self.on_credit:
+            self.on_credit(credited)
+        return credited
+
+
+def backfill(user_scores_collection, referral_edges_collection, batch_size: int = 1000, pause: float = 0.1) -> int:
+    """Add ledger edges for users referred before the ledger existed; safe to re-run.
+
+    Those referrals were already paid through the old `referrals` arrays, so the
+    edges are written as credited.
+    """
+    inserted = 0
+    last_id = None
+    while True:
+        query = {'referrer': {'$nin': [None, '']}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        users = list(user_scores_collection.find(query, {'identifier': 1, 'referrer': 1}).sort('_id', 1).limit(batch_size))
+        if not users:
+            break
+        ops = [
+            InsertOne({
+                'referred': user['identifier'],
+                'referrer': user['referrer'],
+                'created_at': user['_id'].generation_time.replace(tzinfo=None) if isinstance(user['_id'], ObjectId) else datetime.now(),
+                'credited': True,
+                'batch': None
+            })
+            for user in users if user.get('identifier')
+        ]
+        try:
+            if ops:
+                inserted += referral_edges_collection.bulk_write(ops, ordered=False).inserted_count
+        except BulkWriteError as e:
+            inserted += e.details.get('nInserted', 0)
+        last_id = users[-1]['_id']
+        logger.info(f"Backfilled {inserted} referral edges")
+        time.sleep(pause)
+    return inserted
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    ensure_indexes(db['referral_edges'])
+    print(f"Backfilled {backfill(db['user_scores'], db['referral_edges'])} referral edges")
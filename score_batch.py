@@ -0,0 +1,176 @@
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+import score_events
+import user_search
+
+logger = logging.getLogger(__name__)
+
+MAX_EVENTS = 500
+DEDUPE_TTL_SECONDS = 7 * 24 * 3600  # How long a client_event_id is remembered
+MAX_EVENT_AGE = timedelta(days=1)
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+DUPLICATE_KEY = 11000
+UNRESOLVED_AFTER = timedelta(minutes=5)  # A reservation still pending this long was likely orphaned by a crash
+
+
+def ensure_indexes(score_event_ids_collection) -> None:
+    score_event_ids_collection.create_index([('created_at', ASCENDING)], expireAfterSeconds=DEDUPE_TTL_SECONDS)
+
+
+def parse_timestamp(value, now: datetime) -> datetime:
+    """Accept epoch seconds or ISO 8601; returns naive local time like datetime.now()."""
+    if value is None:
+        return now
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            timestamp = datetime.fromtimestamp(value)
+        elif isinstance(value, str):
+            timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if timestamp.tzinfo:
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+        else:
+            raise ValueError
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError('Invalid timestamp')
+    # Older results would land in ring slots that may already hold a newer day
+    if not now - MAX_EVENT_AGE <= timestamp <= now + MAX_CLOCK_SKEW:
+        raise ValueError('Timestamp out of range')
+    return min(timestamp, now)
+
+
+def parse_event(raw, now: datetime) -> dict:
+    if not isinstance(raw, dict):
+        raise ValueError('Invalid event')
+    username = raw.get('username')
+    score = raw.get('score')
+    event_id = raw.get('client_event_id')
+    if not isinstance(username, str) or not username or score is None or isinstance(score, bool):
+        raise ValueError('Invalid data')
+    if event_id is not None and (not isinstance(event_id, str) or not event_id):
+        raise ValueError('Invalid client_event_id')
+    try:
+        score = int(score)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid score')
+    timestamp = parse_timestamp(raw.get('timestamp'), now)
+    return {'username': username, 'score': score, 'timestamp': timestamp, 'client_event_id': event_id}
+
+
+def _reserve(score_event_ids_collection, event_ids: list) -> dict:
+    """Record event ids as pending; returns {id: status} for ids that had been seen before.
+
+    The status of an earlier reservation is 'applied' once its event was
+    written, and 'pending' while it is in flight or if the process handling it
+    stopped before it could tell. Those ids stay reserved rather than being
+    applied a second time.
+    """
+    if not event_ids:
+        return {}
+    now = datetime.now()
+    try:
+        score_event_ids_collection.insert_many(
+            [{'_id': event_id, 'status': 'pending', 'created_at': now} for event_id in event_ids], ordered=False
+        )
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            raise
+        seen = [event_ids[error['index']] for error in errors]
+        statuses = {doc['_id']: doc for doc in score_event_ids_collection.find({'_id': {'$in': seen}})}
+        result = {}
+        for event_id in seen:
+            doc = statuses.get(event_id) or {}
+            # Ids recorded before reservations had a status were all applied
+            result[event_id] = doc.get('status', 'applied')
+            if result[event_id] == 'pending' and doc.get('created_at') and now - doc['created_at'] > UNRESOLVED_AFTER:
+                logger.warning(f"Score event {event_id} has been pending since {doc['created_at']}")
+        return result
+    return {}
+
+
+def _confirm(score_event_ids_collection, event_ids: list) -> None:
+    """Mark reserved ids whose events were written or queued."""
+    if event_ids:
+        score_event_ids_collection.update_many({'_id': {'$in': event_ids}}, {'$set': {'status': 'applied'}})
+
+
+def _release(score_event_ids_collection, event_ids: list) -> None:
+    """Forget ids of events known not to be applied so the client can retry them."""
+    if event_ids:
+        score_event_ids_collection.delete_many({'_id': {'$in': event_ids}})
+
+
+def save_scores(user_scores_collection, score_events_collection, score_event_ids_collection, raw_events: list,
+                submit=None, week_epoch: int = None) -> tuple:
+    """Apply a batch of score events from the game client.
+
+    Events are deduplicated by client_event_id, within the batch and against ids
+    seen in the last DEDUPE_TTL_SECONDS, then written with score_events.apply_batch.
+    With `submit(username, score, timestamp) -> bool` (a ScoreWriteBuffer) events
+    are queued instead. Returns (results, applied events, users created) where
+    results holds one {'client_event_id', 'status'} per input event, in order.
+    Status is applied, duplicate, pending (an earlier submission of the id is
+    unresolved), invalid, failed or rejected (buffer full).
+
+    Only ids of events known not to be applied are released. If the user write
+    fails in a way that leaves that unknown, the error is raised and the ids
+    stay pending, so a retry cannot credit the scores twice.
+    """
+    now = datetime.now()
+    results = []
+    accepted = []
+    seen = set()
+    for raw in raw_events:
+        event_id = raw.get('client_event_id') if isinstance(raw, dict) else None
+        try:
+            event = parse_event(raw, now)
+        except ValueError as e:
+            results.append({'client_event_id': event_id, 'status': 'invalid', 'error': str(e)})
+            continue
+        if event_id is not None:
+            if event_id in seen:
+                results.append({'client_event_id': event_id, 'status': 'duplicate'})
+                continue
+            seen.add(event_id)
+        results.append({'client_event_id': event_id, 'status': 'applied'})
+        accepted.append((len(results) - 1, event))
+
+    earlier = _reserve(score_event_ids_collection, [event['client_event_id'] for _, event in accepted if event['client_event_id']])
+    pending = []
+    for index, event in accepted:
+        if event['client_event_id'] in earlier:
+            results[index]['status'] = 'duplicate' if earlier[event['client_event_id']] == 'applied' else 'pending'
+        else:
+            pending.append((index, event))
+
+    not_applied = []
+    created = 0
+    if submit:
+        for index, event in pending:
+            if not submit(event['username'], event['score'], event['timestamp']):
+                not_applied.append((index, 'rejected'))
+    else:
+        batch, positions = {}, []
+        for index, event in pending:
+            events = batch.setdefault(event['username'], [])
+            positions.append((index, event['username'], len(events)))
+            events.append((event['score'], event['timestamp']))
+        created, _, failed = score_events.apply_batch(
+            user_scores_collection, score_events_collection, batch,
+            on_insert=user_search.search_fields, week_epoch=week_epoch
+        )
+        for index, username, position in positions:
+            if position in failed.get(username, ()):
+                not_applied.append((index, 'failed'))
+
+    for index, status in not_applied:
+        results[index]['status'] = status
+    skipped = {index for index, _ in not_applied}
+    _release(score_event_ids_collection, [results[index]['client_event_id'] for index in skipped if results[index]['client_event_id']])
+    _confirm(score_event_ids_collection, [event['client_event_id'] for index, event in pending if index not in skipped and event['client_event_id']])
+    applied = [event for index, event in pending if index not in skipped]
+    return results, applied, created
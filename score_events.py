@@ -0,0 +1,255 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+import score_ring
+
+logger = logging.getLogger(__name__)
+
+BUCKET_CAP = 500  # Most recent events kept per user per day; count/total cover all of them
+MONTHS_COLLECTION = 'score_months'  # Per user per month totals, kept next to score_events
+DUPLICATE_KEY = 11000
+
+
+def months_collection(score_events_collection):
+    return score_events_collection.database[MONTHS_COLLECTION]
+
+
+def ensure_indexes(score_events_collection) -> None:
+    score_events_collection.create_index([('user_id', ASCENDING), ('day', ASCENDING)], unique=True)
+    score_events_collection.create_index([('day', ASCENDING), ('total', DESCENDING)])  # Daily leaderboard
+    score_months = months_collection(score_events_collection)
+    score_months.create_index([('user_id', ASCENDING), ('month', ASCENDING)], unique=True)
+    score_months.create_index([('month', ASCENDING), ('total', DESCENDING)])  # Monthly leaderboard
+
+
+def day_start(timestamp: datetime) -> datetime:
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+
+def month_start(timestamp: datetime) -> datetime:
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def _bucket_updates(user_id, events: list, member: str = None) -> list:
+    by_day = {}
+    for score, timestamp in events:
+        by_day.setdefault(day_start(timestamp), []).append({'score': score, 'timestamp': timestamp})
+    updates = []
+    for day, entries in by_day.items():
+        update = {
+            '$inc': {'count': len(entries), 'total': sum(entry['score'] for entry in entries)},
+            '$push': {'events': {'$each': entries, '$slice': -BUCKET_CAP}}
+        }
+        if member:
+            update['$set'] = {'member': member}
+        updates.append(({'user_id': user_id, 'day': day}, update))
+    return updates
+
+
+def _month_updates(user_id, events: list, member: str = None) -> list:
+    by_month = {}
+    for score, timestamp in events:
+        totals = by_month.setdefault(month_start(timestamp), [0, 0])
+        totals[0] += 1
+        totals[1] += score
+    updates = []
+    for month, (count, total) in by_month.items():
+        update = {'$inc': {'count': count, 'total': total}}
+        if member:
+            update['$set'] = {'member': member}
+        updates.append(({'user_id': user_id, 'month': month}, update))
+    return updates
+
+
+def bucket_ops(user_id, events: list, member: str = None) -> list:
+    """Bulk upserts that add (score, timestamp) events to the user's daily buckets."""
+    return [UpdateOne(query, update, upsert=True) for query, update in _bucket_updates(user_id, events, member)]
+
+
+def month_ops(user_id, events: list, member: str = None) -> list:
+    """Bulk upserts that add (score, timestamp) events to the user's monthly totals."""
+    return [UpdateOne(query, update, upsert=True) for query, update in _month_updates(user_id, events, member)]
+
+
+def record(score_events_collection, user_id, score: int, timestamp: datetime, member: str = None) -> None:
+    """Append one score event to the user's bucket for that day and add it to the month's total.
+
+    `member` is the name the period leaderboards list the user under.
+    """
+    query, update = _bucket_updates(user_id, [(score, timestamp)], member)[0]
+    score_events_collection.update_one(query, update, upsert=True)
+    query, update = _month_updates(user_id, [(score, timestamp)], member)[0]
+    months_collection(score_events_collection).update_one(query, update, upsert=True)
+
+
+def apply_score(user_scores_collection, score_events_collection, user_filter: dict, score: int,
+                timestamp: datetime = None, on_insert: dict = None, week_epoch: int = None, member: str = None) -> bool:
+    """Add `score` to the user's balances and log the event; returns True if the user was created.
+
+    The user document only carries running totals and the daily ring from
+    score_ring; history goes to score_events. `on_insert` fields are filled in
+    wherever they are missing.
+    """
+    timestamp = timestamp or datetime.now()
+    previous = user_scores_collection.find_one_and_update(
+        user_filter, score_ring.score_update(score, timestamp, on_insert, week_epoch),
+        projection={'_id': 1}, upsert=True, return_document=ReturnDocument.BEFORE
+    )
+    created = previous is None
+    if created:
+        previous = user_scores_collection.find_one(user_filter, {'_id': 1})
+    record(score_events_collection, previous['_id'], score, timestamp, member)
+    return created
+
+
+def apply_batch(user_scores_collection, score_events_collection, batch: dict, on_insert=None, week_epoch: int = None) -> tuple:
+    """Apply {username: [(score, timestamp)]} with one bulk write per collection.
+
+    Each user gets one update per day touched, so a burst from one player costs a
+    single write. `on_insert(username)` returns fields to fill in where missing.
+    Returns (users created, user writes issued, {username: positions in that
+    user's event list that were not applied}). Positions come from the failed
+    op's index, so identical events are told apart. Bucket write failures are
+    logged rather than raised: the user totals are already applied, and
+    retrying them would credit the scores twice. Any other error from the user
+    write is raised as is, since the unordered write may have partly applied.
+    """
+    ops, op_positions = [], []
+    for username, events in batch.items():
+        by_day = {}
+        for position, (score, timestamp) in enumerate(events):
+            by_day.setdefault(score_ring.day_number(timestamp), []).append(position)
+        for positions in by_day.values():
+            day_events = [events[position] for position in positions]
+            ops.append(UpdateOne(
+                {'username': username},
+                score_ring.score_update(
+                    sum(score for score, _ in day_events),
+                    max(timestamp for _, timestamp in day_events),
+                    on_insert(username) if on_insert else None,
+                    week_epoch
+                ),
+                upsert=True
+            ))
+            op_positions.append((username, positions))
+    if not ops:
+        return 0, 0, {}
+
+    failed = {}
+    try:
+        created = user_scores_collection.bulk_write(ops, ordered=False).upserted_count
+    except BulkWriteError as e:
+        # Unordered: every op without a write error was applied
+        for error in e.details.get('writeErrors', []):
+            username, positions = op_positions[error['index']]
+            failed.setdefault(username, set()).update(positions)
+        created = e.details.get('nUpserted', 0)
+
+    applied = {
+        username: [event for position, event in enumerate(events) if position not in failed.get(username, ())]
+        for username, events in batch.items()
+    }
+    try:
+        history_ops, monthly_ops = [], []
+        for user in user_scores_collection.find({'username': {'$in': list(applied)}}, {'username': 1}):
+            events = applied.get(user['username'], [])
+            history_ops.extend(bucket_ops(user['_id'], events, user['username']))
+            monthly_ops.extend(month_ops(user['_id'], events, user['username']))
+        if history_ops:
+            score_events_collection.bulk_write(history_ops, ordered=False)
+            months_collection(score_events_collection).bulk_write(monthly_ops, ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to record score history for {len(applied)} users: {str(e)}")
+    return created, len(ops), failed
+
+
+def window_total(score_events_collection, user_id, days: int, now: datetime = None) -> int:
+    """Sum of the user's scores over the last `days` calendar days, today included."""
+    since = day_start(now or datetime.now()) - timedelta(days=days - 1)
+    buckets = score_events_collection.find({'user_id': user_id, 'day': {'$gte': since}}, {'total': 1, '_id': 0})
+    return sum(bucket.get('total', 0) for bucket in buckets)
+
+
+def history(score_events_collection, user_id, limit_days: int = 30) -> list:
+    """Most recent daily buckets for a user, newest first."""
+    cursor = score_events_collection.find({'user_id': user_id}, {'_id': 0, 'user_id': 0})
+    return list(cursor.sort('day', -1).limit(limit_days))
+
+
+def _migration_ops(user_id, events: list, batch) -> list:
+    """bucket_ops that apply at most once per migration `batch`.
+
+    A bucket that already lists the batch no longer matches, so its upsert hits
+    the unique (user_id, day) index and fails with a duplicate key instead of
+    adding the events again.
+    """
+    ops = []
+    for query, update in _bucket_updates(user_id, events):
+        update['$addToSet'] = {'migrated_batches': batch}
+        ops.append(UpdateOne({**query, 'migrated_batches': {'$ne': batch}}, update, upsert=True))
+    return ops
+
+
+def migrate_scores_arrays(user_scores_collection, score_events_collection, batch_size: int = 500, pause: float = 0.1) -> int:
+    """Drain legacy embedded `scores` arrays into score_events.
+
+    Before writing buckets, each user is stamped with scores_migration
+    {batch, count}, naming the entries at the front of the array being moved.
+    The bucket writes are tagged with that batch and apply at most once. The
+    trim that removes those entries also clears the stamp, in one update.
+    A run that stops anywhere in between resumes the same batch, so it is
+    safe to stop and re-run. Entries appended meanwhile by an old writer stay
+    put for the next run.
+    """
+    migrated = 0
+    last_id = None
+    while True:
+        query = {'scores.0': {'$exists': True}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        users = list(user_scores_collection.find(query, {'scores': 1, 'scores_migration': 1}).sort('_id', 1).limit(batch_size))
+        if not users:
+            break
+
+        for user in users:
+            pending = user.get('scores_migration')
+            if not pending:
+                pending = {'batch': ObjectId(), 'count': len(user['scores'])}
+                user_scores_collection.update_one({'_id': user['_id']}, {'$set': {'scores_migration': pending}})
+            entries = user['scores'][:pending['count']]
+            events = [(entry.get('score', 0), entry.get('timestamp') or datetime.now()) for entry in entries]
+            try:
+                score_events_collection.bulk_write(_migration_ops(user['_id'], events, pending['batch']), ordered=False)
+            except BulkWriteError as e:
+                # Duplicate keys are buckets an interrupted run already wrote
+                if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])):
+                    raise
+            user_scores_collection.update_one(
+                {'_id': user['_id'], 'scores_migration.batch': pending['batch']},
+                [
+                    {'$set': {'scores': {'$slice': ['$scores', pending['count'], {'$max': [{'$size': '$scores'}, 1]}]}}},
+                    {'$unset': 'scores_migration'}
+                ]
+            )
+            migrated += 1
+
+        last_id = users[-1]['_id']
+        logger.info(f"Migrated score history for {migrated} users")
+        time.sleep(pause)
+
+    user_scores_collection.update_many({'scores': {'$size': 0}}, {'$unset': {'scores': ''}})
+    return migrated
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    ensure_indexes(db['score_events'])
+    print(f"Migrated score history for {migrate_scores_arrays(db['user_scores'], db['score_events'])} users")
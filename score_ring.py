@@ -0,0 +1,111 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+import weekly
+
+logger = logging.getLogger(__name__)
+
+# Daily totals live in user.score_days.d<day % RING_DAYS> as {'day': <ordinal>, 'total': n}.
+# A slot whose 'day' is not the one being asked about is stale and counts as zero,
+# so windows of up to RING_DAYS days are answered from the user document alone.
+RING_DAYS = 32
+
+
+def day_number(timestamp: datetime) -> int:
+    return timestamp.date().toordinal()
+
+
+def slot_path(day: int) -> str:
+    return f'score_days.d{day % RING_DAYS}'
+
+
+def score_update(score: int, timestamp: datetime, defaults: dict = None, week_epoch: int = None) -> list:
+    """Pipeline update adding `score` to the running totals and to today's ring slot.
+
+    Runs as a single atomic update: a slot left over from RING_DAYS days ago is
+    overwritten instead of incremented. `defaults` are set only where missing,
+    as literals, since they may hold client-supplied strings such as usernames.
+    With `week_epoch`, the weekly counters restart if they belong to an earlier week.
+    """
+    day = day_number(timestamp)
+    slot = slot_path(day)
+    fields = {field: {'$ifNull': [f'${field}', {'$literal': value}]} for field, value in (defaults or {}).items()}
+    fields.update({
+        'score': {'$add': [{'$ifNull': ['$score', 0]}, score]},
+        slot: {'$cond': [
+            {'$eq': [f'${slot}.day', day]},
+            {'day': day, 'total': {'$add': [f'${slot}.total', score]}},
+            {'day': day, 'total': score}
+        ]}
+    })
+    if week_epoch is None:
+        fields['weekly_score'] = {'$add': [{'$ifNull': ['$weekly_score', 0]}, score]}
+    else:
+        fields.update(weekly.week_fields(week_epoch, score=score))
+    return [{'$set': fields}]
+
+
+def window_total(user: dict, days: int, now: datetime = None) -> int:
+    """Sum of the user's daily totals over the last `days` days, today included."""
+    if not 1 <= days <= RING_DAYS:
+        raise ValueError(f'Window must be between 1 and {RING_DAYS} days')
+    today = day_number(now or datetime.now())
+    slots = (user or {}).get('score_days') or {}
+    return sum(
+        slot.get('total', 0)
+        for slot in slots.values()
+        if today - days < slot.get('day', 0) <= today
+    )
+
+
+def recompute(user_scores_collection, score_events_collection, batch_size: int = 1000, pause: float = 0.05) -> int:
+    """Rebuild every user's ring from the score_events buckets of the last RING_DAYS days.
+
+    Run after the score history migration to backfill rings. Users are rewritten
+    in bulk batches, with `pause` seconds between batches to limit load.
+    """
+    since = datetime.now() - timedelta(days=RING_DAYS - 1)
+    since = datetime(since.year, since.month, since.day)
+    cursor = score_events_collection.find(
+        {'day': {'$gte': since}},
+        {'user_id': 1, 'day': 1, 'total': 1, '_id': 0}
+    ).sort([('user_id', 1), ('day', 1)])
+
+    rings = {}
+    ops = []
+    updated = 0
+
+    def flush():
+        nonlocal ops, updated
+        if ops:
+            user_scores_collection.bulk_write(ops, ordered=False)
+            updated += len(ops)
+            logger.info(f"Recomputed score rings for {updated} users")
+            ops = []
+            time.sleep(pause)
+
+    current_user = None
+    for bucket in cursor:
+        if bucket['user_id'] != current_user:
+            if current_user is not None:
+                ops.append(UpdateOne({'_id': current_user}, {'$set': {'score_days': rings}}))
+                if len(ops) >= batch_size:
+                    flush()
+            current_user, rings = bucket['user_id'], {}
+        day = day_number(bucket['day'])
+        rings[f'd{day % RING_DAYS}'] = {'day': day, 'total': bucket.get('total', 0)}
+    if current_user is not None:
+        ops.append(UpdateOne({'_id': current_user}, {'$set': {'score_days': rings}}))
+    flush()
+    return updated
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    print(f"Recomputed score rings for {recompute(db['user_scores'], db['score_events'])} users")
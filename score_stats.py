@@ -0,0 +1,179 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+STATS_SHARDS = 16
+FLUSH_INTERVAL = 1.0
+BASELINE_ID = 'baseline'
+BASELINE_RETRY_SECONDS = 10
+BASELINE_RETRY_MAX_SECONDS = 600
+
+
+def compute_stats(user_scores_collection) -> dict:
+    """Recompute the global score stats with a single streaming $group."""
+    pipeline = [
+        {'$group': {'_id': None, 'totalScore': {'$sum': '$score'}, 'count': {'$sum': 1}}}
+    ]
+    result = list(user_scores_collection.aggregate(pipeline))
+    if not result:
+        return {'totalScore': 0, 'count': 0}
+    return {'totalScore': result[0]['totalScore'], 'count': result[0]['count']}
+
+
+class ScoreStats:
+    """Global user count and score total kept as sharded counters next to the writes.
+
+    Writers call record() with the delta they just applied. Deltas are summed
+    in-process and flushed every FLUSH_INTERVAL seconds as one $inc against a
+    random shard document, so hot write paths neither wait on nor contend for a
+    single counter. Reads add up the shard documents plus this process's unflushed
+    deltas. reconcile() compares the counters with a full $group and corrects drift.
+
+    Deltas only mean something on top of a baseline recount. {_id: 'baseline'}
+    records whether one has succeeded yet; until it has, start() keeps retrying
+    reconcile() on a background thread with backoff, and get() reports
+    baselinePending.
+    """
+
+    def __init__(self, user_scores_collection, stats_collection, shards=STATS_SHARDS, flush_interval=FLUSH_INTERVAL):
+        self.user_scores_collection = user_scores_collection
+        self.stats_collection = stats_collection
+        self.shard_ids = [f'shard:{i}' for i in range(shards)]
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending_count = 0
+        self._pending_score = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._baseline_thread = None
+
+    def start(self) -> None:
+        """Start the background flusher and make sure pending deltas survive shutdown."""
+        if self._thread:
+            return
+        # Deployments that predate the flag get one baseline recount as well
+        self.stats_collection.update_one({'_id': BASELINE_ID}, {'$setOnInsert': {'pending': True}}, upsert=True)
+        self._thread = threading.Thread(target=self._run, name='score-stats-flusher', daemon=True)
+        self._thread.start()
+        self._baseline_thread = threading.Thread(target=self._establish_baseline, name='score-stats-baseline', daemon=True)
+        self._baseline_thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush score stats: {str(e)}")
+
+    def baseline_pending(self) -> bool:
+        state = self.stats_collection.find_one({'_id': BASELINE_ID}, {'pending': 1})
+        return (state or {}).get('pending', True)
+
+    def _establish_baseline(self) -> None:
+        """Retry reconcile() until one succeeds, backing off while writes keep the counters moving."""
+        delay = BASELINE_RETRY_SECONDS
+        while not self._stop.is_set():
+            try:
+                if not self.baseline_pending() or self.reconcile()['reconciled']:
+                    return
+            except Exception as e:
+                logger.error(f"Failed to reconcile score stats baseline: {str(e)}")
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, BASELINE_RETRY_MAX_SECONDS)
+
+    def record(self, count: int = 0, score: int = 0) -> None:
+        """Account for users added/removed and score added/removed by a write."""
+        if not count and not score:
+            return
+        with self._lock:
+            self._pending_count += count
+            self._pending_score += score
+
+    def flush(self) -> None:
+        """Push the accumulated deltas to one randomly chosen shard."""
+        with self._lock:
+            count, score = self._pending_count, self._pending_score
+            self._pending_count = self._pending_score = 0
+        if not count and not score:
+            return
+        try:
+            self.stats_collection.update_one(
+                {'_id': random.choice(self.shard_ids)},
+                {'$inc': {'count': count, 'totalScore': score}},
+                upsert=True
+            )
+        except Exception:
+            # Keep the deltas so the next flush retries them
+            self.record(count, score)
+            raise
+
+    def _read_shards(self) -> dict:
+        totals = {'totalScore': 0, 'count': 0}
+        for doc in self.stats_collection.find({'_id': {'$in': self.shard_ids}}):
+            totals['totalScore'] += doc.get('totalScore', 0)
+            totals['count'] += doc.get('count', 0)
+        return totals
+
+    def get(self) -> dict:
+        """Return totalScore/count/averageScore without touching user_scores."""
+        totals, baseline_pending = {'totalScore': 0, 'count': 0}, True
+        for doc in self.stats_collection.find({'_id': {'$in': self.shard_ids + [BASELINE_ID]}}):
+            if doc['_id'] == BASELINE_ID:
+                baseline_pending = doc.get('pending', True)
+                continue
+            totals['totalScore'] += doc.get('totalScore', 0)
+            totals['count'] += doc.get('count', 0)
+        with self._lock:
+            count = totals['count'] + self._pending_count
+            total_score = totals['totalScore'] + self._pending_score
+        return {
+            'totalScore': total_score,
+            'count': count,
+            'averageScore': total_score / count if count > 0 else 0,
+            'baselinePending': baseline_pending
+        }
+
+    def reconcile(self) -> dict:
+        """Compare the counters with a full recount and fold any drift into shard 0.
+
+        The recount is skipped when the counters move while it runs, because the
+        difference would then include in-flight writes rather than real drift.
+        Waiting two flush intervals lets every process publish deltas from writes
+        that landed during the recount before the counters are compared again.
+        """
+        self.flush()
+        before = self._read_shards()
+        actual = compute_stats(self.user_scores_collection)
+        time.sleep(self.flush_interval * 2)
+        self.flush()
+        after = self._read_shards()
+        if before != after:
+            logger.info("Score stats changed during reconcile, retrying on the next run")
+            return {'reconciled': False}
+
+        drift = {
+            'count': actual['count'] - after['count'],
+            'totalScore': actual['totalScore'] - after['totalScore']
+        }
+        if drift['count'] or drift['totalScore']:
+            logger.warning(f"Correcting score stats drift: {drift}")
+            self.stats_collection.update_one(
+                {'_id': self.shard_ids[0]},
+                {'$inc': drift},
+                upsert=True
+            )
+        self.stats_collection.update_one(
+            {'_id': BASELINE_ID}, {'$set': {'pending': False, 'reconciled_at': datetime.now()}}, upsert=True
+        )
+        return {'reconciled': True, 'drift': drift}
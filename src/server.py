@@ -4,11 +4,32 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from pymongo import MongoClient
 from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
 import logging
 import sys
 import traceback
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import idempotency
+import leaderboard_history
+import pagination
+import referrals
+import score_stats
+import score_batch
+import score_events
+import task_availability
+import task_states
+import task_submissions
+from task_catalog import TaskCatalog
+import user_search
+from user_repository import UserRepository
+from leaderboard import BOARDS
+from period_leaderboards import PeriodLeaderboards, PERIODS
+import weekly
+from referral_graph import ReferralGraph
+import write_buffer
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
@@ -27,12 +48,49 @@ try:
     client = MongoClient('mongodb://localhost:27017/')
     db = client['pool_degen']
     tasks_collection = db['tasks']
+    task_catalog = TaskCatalog(tasks_collection, db['app_state'])
+    task_submissions_collection = db['task_submissions']
     user_scores_collection = db['user_scores']
+    user_repository = UserRepository(user_scores_collection)
+    score_stats_collection = db['score_stats']
+    score_events_collection = db['score_events']
+    score_event_ids_collection = db['score_event_ids']
+    idempotency_cache = idempotency.IdempotencyCache(db['idempotency_keys'])
     
     # Ensure indexes for better performance
     user_scores_collection.create_index([('score', -1)])  # For sorting by score
     user_scores_collection.create_index([('username', 1)])  # For username search
     user_scores_collection.create_index([('referrer', 1)])  # For referral lookups
+    pagination.ensure_indexes(user_scores_collection)  # For paginated listings
+    user_search.ensure_indexes(user_scores_collection)  # For prefix and substring search
+    score_events.ensure_indexes(score_events_collection)  # One bucket per user per day
+    task_submissions.ensure_indexes(task_submissions_collection)  # Review queue by (status, submitted_at, _id)
+    task_catalog.ensure_state()  # Version document other processes poll for task changes
+    task_states.ensure_indexes(user_scores_collection)  # Wildcard index over task_states.<task_id> paths
+    task_states_migration = task_states.Migration(user_scores_collection, db['app_state'])
+    score_batch.ensure_indexes(score_event_ids_collection)  # Expire remembered client_event_ids
+    idempotency_cache.ensure_indexes()  # Expire stored Idempotency-Key responses
+
+    global_stats = score_stats.ScoreStats(user_scores_collection, score_stats_collection)
+    global_stats.start()
+    review_queue = task_submissions.ReviewQueue(task_submissions_collection, task_catalog)
+    review_queue.start()  # Clears expired review leases in the background
+    week = weekly.WeekEpoch(db['app_state'])
+    week.ensure_state(user_scores_collection)
+    period_boards = PeriodLeaderboards(user_scores_collection, score_events_collection, week)
+    leaderboard_history_collection = db['leaderboard_history']
+    leaderboard_ranks_collection = db['leaderboard_ranks']
+    leaderboard_history.ensure_indexes(leaderboard_history_collection, leaderboard_ranks_collection)  # Archived weekly standings
+
+    referrals.ensure_indexes(db['referral_edges'])
+    referral_graph = ReferralGraph(user_scores_collection, db['referral_edges'])
+    referral_graph.start()  # Loads in the background; graph endpoints answer 503 until then
+
+    # Optional: coalesce /api/save_score writes per user (SCORE_WRITE_BUFFER=1)
+    score_buffer = None
+    if write_buffer.buffer_enabled():
+        score_buffer = write_buffer.ScoreWriteBuffer(user_scores_collection, score_events_collection, stats=global_stats, week=week)
+        score_buffer.start()
     
     logger.info("Connected to MongoDB successfully")
     logger.info("Created indexes for better performance")
@@ -48,74 +106,29 @@ def index():
 @app.route('/api/user_scores', methods=['GET'])
 def get_users():
     try:
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 10))
-        skip = (page - 1) * limit
-
-        # Use aggregation pipeline for efficient querying
-        pipeline = [
-            # First get total count and score
-            {
-                '$group': {
-                    '_id': None,
-                    'totalScore': {'$sum': '$score'},
-                    'count': {'$sum': 1},
-                    'allUsers': {'$push': '$$ROOT'}
-                }
-            },
-            # Then process the collected data
-            {
-                '$project': {
-                    'stats': {
-                        'totalScore': '$totalScore',
-                        'count': '$count',
-                        'averageScore': {'$divide': ['$totalScore', '$count']}
-                    },
-                    'topPerformers': {
-                        '$slice': [
-                            {'$sortArray': {'input': '$allUsers', 'sortBy': {'score': -1}}},
-                            0,
-                            3
-                        ]
-                    },
-                    'paginatedUsers': {
-                        '$slice': ['$allUsers', skip, limit]
-                    }
-                }
-            }
-        ]
-        
-        result = list(user_scores_collection.aggregate(pipeline))[0]
-        
-        # Check if we have any results
-        if not result:
-            return jsonify({
-                'users': [],
-                'stats': {
-                    'totalScore': 0,
-                    'averageScore': 0,
-                    'topPerformers': []
-                }
-            }), 200
-
-        # Process stats
-        stats = result.get('stats', {'totalScore': 0, 'count': 0})
-        avg_score = stats.get('totalScore', 0) / stats.get('count', 1) if stats.get('count', 0) > 0 else 0
-        
+        try:
+            users, page_info = pagination.paginate(user_scores_collection, {}, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        limit = pagination.parse_page_args(request.args)[1]
+
+        # Each part is an index read; stats come from the maintained stats document
+        top_performers = pagination.top_performers(user_scores_collection)
+        stats = global_stats.get()
+
         # Convert ObjectId to string
-        users = result.get('paginatedUsers', [])
-        top_performers = result.get('topPerformers', [])
         for user in users + top_performers:
-            if '_id' in user:
-                user['_id'] = str(user['_id'])
+            user['_id'] = str(user['_id'])
 
         return jsonify({
             'users': users,
             'stats': {
-                'totalScore': stats.get('totalScore', 0),
-                'averageScore': avg_score,
+                'totalScore': stats['totalScore'],
+                'averageScore': stats['averageScore'],
                 'topPerformers': top_performers
-            }
+            },
+            'totalPages': (stats['count'] + limit - 1) // limit,
+            **page_info
         }), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -125,65 +138,179 @@ def get_users():
 @app.route('/api/user_scores/count', methods=['GET'])
 def get_user_count():
     try:
-        count = user_scores_collection.count_documents({})
+        count = global_stats.get()['count']
         return jsonify({'count': count}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/user_scores/stats/reconcile', methods=['POST'])
+def reconcile_user_stats():
+    try:
+        result = global_stats.reconcile()
+        return jsonify({**result, 'stats': global_stats.get()}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboards/<period>', methods=['GET'])
+def get_period_leaderboard(period):
+    try:
+        if period not in PERIODS:
+            return jsonify({'error': f"period must be one of {', '.join(PERIODS)}"}), 400
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        return jsonify({'period': period, 'leaderboard': period_boards.top(period, limit)}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboards/<period>/rank', methods=['GET'])
+def get_period_rank(period):
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({'error': 'Invalid data'}), 400
+        if period not in PERIODS:
+            return jsonify({'error': f"period must be one of {', '.join(PERIODS)}"}), 400
+        return jsonify(period_boards.rank(period, username)), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+def history_args():
+    """Parse the board and limit query parameters shared by the leaderboard history endpoints."""
+    board = request.args.get('board', 'weekly_score')
+    if board not in BOARDS:
+        raise ValueError(f"board must be one of {', '.join(BOARDS)}")
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return board, limit
+
+@app.route('/api/leaderboards/history', methods=['GET'])
+def get_leaderboard_weeks():
+    try:
+        board, limit = history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify({'board': board, 'weeks': leaderboard_history.weeks(leaderboard_history_collection, board, limit)}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboards/history/<int:epoch>', methods=['GET'])
+def get_leaderboard_winners(epoch):
+    try:
+        board, limit = history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        week_standings = leaderboard_history.winners(leaderboard_history_collection, board, epoch, limit)
+        if not week_standings:
+            return jsonify({'error': 'Week not archived'}), 404
+        return jsonify(week_standings), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leaderboards/history/users/<username>', methods=['GET'])
+def get_user_rank_history(username):
+    try:
+        board, limit = history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        history = leaderboard_history.rank_history(
+            leaderboard_history_collection, leaderboard_ranks_collection, username, board, limit
+        )
+        return jsonify({'username': username, 'board': board, 'history': history}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/referrals/graph', methods=['GET'])
+def get_referral_graph_summary():
+    return jsonify(referral_graph.summary()), 200
+
+@app.route('/api/referrals/graph/users/<identifier>', methods=['GET'])
+def get_referral_tree(identifier):
+    try:
+        depth = int(request.args.get('depth', 3))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'depth and limit must be integers'}), 400
+    try:
+        return jsonify(referral_graph.descendants(identifier, depth, limit)), 200
+    except KeyError:
+        return jsonify({'error': 'User not found'}), 404
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route('/api/referrals/graph/top', methods=['GET'])
+def get_top_referrers():
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        return jsonify({'referrers': referral_graph.top_referrers(limit)}), 200
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route('/api/referrals/graph/anomalies', methods=['GET'])
+def get_referral_anomalies():
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        return jsonify(referral_graph.anomalies(limit)), 200
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route('/api/referrals/graph/refresh', methods=['POST'])
+def refresh_referral_graph():
+    try:
+        if request.args.get('full') == '1':
+            referral_graph.load()
+            added = None
+        else:
+            added = referral_graph.refresh()
+        return jsonify({'added': added, **referral_graph.summary()}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/user_scores/search', methods=['GET'])
 def search_users():
     try:
         username = request.args.get('username', '')
+        try:
+            limit = user_search.parse_limit(request.args.get('limit'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Index-backed prefix/trigram search; the stats cover every match, the users only this page
+        users, stats = user_search.search_with_stats(user_scores_collection, username, limit, pagination.LIST_PROJECTION)
         
-        # Use aggregation pipeline for consistent stats
-        pipeline = [
-            # Match users by username
-            {
-                '$match': {
-                    'username': {'$regex': username, '$options': 'i'}
-                }
-            },
-            # Get stats and users in one query
-            {
-                '$facet': {
-                    'stats': [
-                        {
-                            '$group': {
-                                '_id': None,
-                                'totalScore': {'$sum': '$score'},
-                                'count': {'$sum': 1}
-                            }
-                        }
-                    ],
-                    'users': [{'$limit': 100}]  # Limit search results
-                }
-            }
-        ]
-        
-        result = list(user_scores_collection.aggregate(pipeline))[0]
-        
-        # Process stats
-        stats = result['stats'][0] if result['stats'] else {'totalScore': 0, 'count': 0}
-        avg_score = stats['totalScore'] / stats['count'] if stats['count'] > 0 else 0
-        
-        # Get top performers from search results
-        users = result['users']
-        top_performers = sorted(users, key=lambda x: x.get('score', 0), reverse=True)[:3]
-        
-        # Convert ObjectId to string
-        for user in users + top_performers:
+        # Convert ObjectId to string; top performers may be the same dicts as page rows
+        for user in users + stats['topPerformers']:
             user['_id'] = str(user['_id'])
             
-        return jsonify({
-            'users': users,
-            'stats': {
-                'totalScore': stats['totalScore'],
-                'averageScore': avg_score,
-                'topPerformers': top_performers
-            }
-        }), 200
+        return jsonify({'users': users, 'stats': stats}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
@@ -193,12 +320,17 @@ def search_users():
 def update_user(user_id):
     try:
         data = request.json
-        result = user_scores_collection.update_one(
+        if 'username' in data:
+            data.update(user_search.search_fields(data['username']))
+        previous = user_scores_collection.find_one_and_update(
             {'_id': ObjectId(user_id)},
-            {'$set': data}
+            {'$set': data},
+            projection={'score': 1}
         )
-        if result.modified_count == 0:
+        if previous is None:
             return jsonify({'error': 'User not found'}), 404
+        if 'score' in data:
+            global_stats.record(score=int(data['score'] or 0) - previous.get('score', 0))
         return jsonify({'message': 'User updated successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -208,9 +340,10 @@ def update_user(user_id):
 @app.route('/api/user_scores/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
     try:
-        result = user_scores_collection.delete_one({'_id': ObjectId(user_id)})
-        if result.deleted_count == 0:
+        deleted = user_scores_collection.find_one_and_delete({'_id': ObjectId(user_id)}, projection={'score': 1})
+        if deleted is None:
             return jsonify({'error': 'User not found'}), 404
+        global_stats.record(count=-1, score=-deleted.get('score', 0))
         return jsonify({'message': 'User deleted successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -220,13 +353,52 @@ def delete_user(user_id):
 @app.route('/api/user_scores/referrals/<identifier>', methods=['GET'])
 def get_referrals(identifier):
     try:
-        referrals = list(user_scores_collection.find({'referrer': identifier}))
+        page_info = {}
+        if any(arg in request.args for arg in ('page', 'limit', 'after')):
+            try:
+                referrals, page_info = pagination.paginate(user_scores_collection, {'referrer': identifier}, request.args)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            referrals = list(user_scores_collection.find({'referrer': identifier}, pagination.LIST_PROJECTION))
         
         # Convert ObjectId to string
         for referral in referrals:
             referral['_id'] = str(referral['_id'])
             
-        return jsonify({'referrals': referrals}), 200
+        return jsonify({'referrals': referrals, **page_info}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+def save_scores(events: list) -> list:
+    """Apply score events through score_batch; returns the per-event results."""
+    results, applied, created = score_batch.save_scores(
+        user_scores_collection, score_events_collection, score_event_ids_collection, events,
+        submit=score_buffer.submit if score_buffer else None, week_epoch=week.current()
+    )
+    if not score_buffer:
+        global_stats.record(count=created, score=sum(event['score'] for event in applied))
+    return results
+
+@app.route('/api/save_scores', methods=['POST'])
+@idempotency_cache.idempotent('save_scores')
+def save_scores_endpoint():
+    try:
+        data = request.json
+        events = data.get('events') if isinstance(data, dict) else None
+
+        if not isinstance(events, list) or not events:
+            return jsonify({'error': 'Invalid data'}), 400
+        if len(events) > score_batch.MAX_EVENTS:
+            return jsonify({'error': f'At most {score_batch.MAX_EVENTS} events per request'}), 400
+
+        results = save_scores(events)
+        applied = sum(1 for result in results if result['status'] == 'applied')
+        status = 503 if any(result['status'] == 'rejected' for result in results) else 200
+        headers = {'Retry-After': '1'} if status == 503 else {}
+        return jsonify({'results': results, 'applied': applied}), status, headers
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
@@ -234,27 +406,38 @@ def get_referrals(identifier):
 
 # Original endpoints...
 @app.route('/api/save_score', methods=['POST'])
+@idempotency_cache.idempotent('save_score')
 def save_score_endpoint():
     try:
         data = request.json
-        username = data.get('username')
-        score = data.get('score')
-        timestamp = datetime.now()
-
-        if username is None or score is None:
+        if not isinstance(data, dict):
             return jsonify({'error': 'Invalid data'}), 400
 
-        user_scores_collection.update_one(
-            {'username': username},
-            {'$inc': {'score': int(score), 'weekly_score': int(score)}, '$push': {'scores': {'score': int(score), 'timestamp': timestamp}}},
-            upsert=True
-        )
-        return jsonify({'message': 'Score saved successfully'}), 200
+        result = save_scores([data])[0]
+        if result['status'] == 'invalid':
+            return jsonify({'error': result['error']}), 400
+        if result['status'] == 'rejected':
+            return jsonify({'error': 'Too many score updates, retry shortly'}), 503, {'Retry-After': '1'}
+        if result['status'] == 'failed':
+            return jsonify({'error': 'Internal server error'}), 500
+        if result['status'] == 'pending':
+            return jsonify({'error': 'An earlier submission of this event is still unresolved'}), 409
+        return jsonify({'message': 'Score saved successfully', 'status': result['status']}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/metrics/idempotency', methods=['GET'])
+def get_idempotency_metrics():
+    return jsonify(idempotency_cache.metrics()), 200
+
+@app.route('/api/metrics/score_writes', methods=['GET'])
+def get_score_write_metrics():
+    if not score_buffer:
+        return jsonify({'buffered': False}), 200
+    return jsonify({'buffered': True, **score_buffer.metrics()}), 200
+
 @app.route('/api/get_user_score', methods=['GET'])
 def get_user_score():
     try:
@@ -262,12 +445,12 @@ def get_user_score():
         if not username:
             return jsonify({'error': 'Invalid data'}), 400
 
-        user = user_scores_collection.find_one({'username': username})
+        user = user_repository.score(username=username)
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
         score = user.get('score', 0)
-        weekly_score = user.get('weekly_score', 0)
+        weekly_score = weekly.current_value(user, 'weekly_score', week.current())
         return jsonify({'score': score, 'weekly_score': weekly_score}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -294,6 +477,7 @@ def add_task():
         }
         
         result = tasks_collection.insert_one(task)
+        task_catalog.bump()
         logger.info(f"Task added successfully: {result.inserted_id}")
         
         return jsonify({'message': 'Task added successfully', 'task_id': str(result.inserted_id)}), 200
@@ -302,13 +486,30 @@ def add_task():
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+def catalog_response(build):
+    """Serve task catalog data with its version as ETag, or 304 if the client's copy is current.
+
+    build() reads the in-memory catalog, so it runs first: only a resource that
+    exists (status 200) can be answered with 304.
+    """
+    etag = task_catalog.etag()
+    body, status = build()
+    if status == 200 and task_catalog.not_modified(request.headers.get('If-None-Match'), etag):
+        return '', 304, {'ETag': etag}
+    response = jsonify(body)
+    if status == 200:
+        response.headers['ETag'] = etag
+    return response, status
+
 @app.route('/api/get_tasks', methods=['GET'])
 def get_tasks():
     try:
-        tasks = list(tasks_collection.find())
-        for task in tasks:
-            task['_id'] = str(task['_id'])
-        return jsonify(tasks), 200
+        def build():
+            tasks = task_catalog.tasks()
+            for task in tasks:
+                task['_id'] = str(task['_id'])
+            return tasks, 200
+        return catalog_response(build)
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
@@ -323,7 +524,7 @@ def update_task(task_id):
         score = data.get('score')
         icon = data.get('icon')
         
-        task = tasks_collection.find_one({'_id': ObjectId(task_id)})
+        task = task_catalog.get(task_id)
         if not task:
             return jsonify({'error': 'Task not found'}), 404
 
@@ -341,6 +542,7 @@ def update_task(task_id):
         
         if result.modified_count == 0:
             return jsonify({'message': 'No changes made to the task'}), 200
+        task_catalog.bump()
         
         return jsonify({'message': 'Task updated successfully'}), 200
     except Exception as e:
@@ -354,6 +556,7 @@ def delete_task(task_id):
         result = tasks_collection.delete_one({'_id': ObjectId(task_id)})
         if result.deleted_count == 0:
             return jsonify({'error': 'Task not found'}), 404
+        task_catalog.bump()
         return jsonify({'message': 'Task deleted successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -370,20 +573,24 @@ def complete_task():
         
         if not username or not task_id or not evidence_url:
             return jsonify({'error': 'Missing required data'}), 400
+        if not ObjectId.is_valid(task_id):
+            return jsonify({'error': 'Invalid task ID format'}), 400
+        task = task_catalog.get(task_id)
+        if not task:
+            return jsonify({'error': 'Task not found'}), 404
         
         # Update the database with the task completion and evidence URL
-        user_scores_collection.update_one(
-            {'username': username},
-            {
-                '$push': {
-                    'task_states': {
-                        'task_id': ObjectId(task_id),
-                        'status': 'validating',
-                        'evidence': evidence_url
-                    }
-                }
-            },
-            upsert=True
+        submitted_at = datetime.now()
+        update = {
+            '$set': {**task_states.submitted(task['_id'], evidence_url, submitted_at), **task_availability.submitted(task, submitted_at)},
+            '$setOnInsert': user_search.search_fields(username)
+        }
+        result = task_states.update(user_scores_collection, {'username': username}, update, upsert=True)
+        if result.upserted_id:
+            global_stats.record(count=1)
+        task_submissions.submit(
+            task_submissions_collection, username, task['_id'], evidence_url,
+            is_recurring=bool(task.get('recurInterval')), submitted_at=submitted_at
         )
         return jsonify({'message': 'Task submitted for validation', 'evidence_url': evidence_url}), 200
     except Exception as e:
@@ -391,6 +598,21 @@ def complete_task():
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+@app.route('/api/tasks/available', methods=['GET'])
+def get_available_tasks():
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({'error': 'Invalid data'}), 400
+        tasks = task_availability.available(user_scores_collection, task_catalog, username)
+        if tasks is None:
+            return jsonify({'error': 'User not found'}), 404
+        return jsonify({'tasks': tasks}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/get_task_states', methods=['GET'])
 def get_task_states():
     try:
@@ -398,14 +620,22 @@ def get_task_states():
         if not username:
             return jsonify({'error': 'Invalid data'}), 400
 
-        user = user_scores_collection.find_one({'username': username})
-        task_states = user.get('task_states', []) if user else []
-        
-        # Convert ObjectId to string for JSON serialization
-        for state in task_states:
-            state['task_id'] = str(state['task_id'])
-        
-        return jsonify({'taskStates': task_states}), 200
+        user = user_repository.task_states(username=username)
+        return jsonify({'taskStates': task_states.as_list(user.task_states if user else None)}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/migrations/task_states', methods=['GET', 'POST'])
+def task_states_migration_status():
+    try:
+        started = task_states_migration.start() if request.method == 'POST' else False
+        return jsonify({
+            'running': task_states_migration.running,
+            'started': started,
+            **task_states.progress(db['app_state'])
+        }), 202 if started else 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
@@ -415,42 +645,105 @@ def get_task_states():
 def get_pending_tasks():
     try:
         logger.info("Fetching pending tasks")
-        pending_tasks = list(user_scores_collection.find(
-            {'task_states.status': 'validating'},
-            {'username': 1, 'task_states.$': 1}
-        ))
+        try:
+            limit, after = task_submissions.parse_page_args(request.args)
+            pending_tasks, next_cursor = task_submissions.pending_page(
+                task_submissions_collection, limit, after, {'username': 1, 'task_id': 1, 'evidence_url': 1, 'submitted_at': 1}
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         formatted_tasks = []
-        for user in pending_tasks:
-            task = user['task_states'][0]
+        for submission in pending_tasks:
             formatted_tasks.append({
-                'username': user['username'],
-                'taskId': str(task['task_id']),
-                'evidenceUrl': task['evidence']
+                'username': submission['username'],
+                'taskId': str(submission['task_id']),
+                'evidenceUrl': submission['evidence_url']
             })
         
         logger.info(f"Fetched {len(formatted_tasks)} pending tasks")
-        return jsonify(formatted_tasks), 200
+        # The body stays a bare list for existing clients; the next page's cursor goes in a header
+        return jsonify(formatted_tasks), 200, {'X-Next-Cursor': next_cursor} if next_cursor else {}
     except Exception as e:
         logger.error(f"Error occurred in get_pending_tasks: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
+@app.route('/api/review_queue/claim', methods=['POST'])
+def claim_review_submissions():
+    try:
+        data = request.json or {}
+        reviewer = data.get('reviewer')
+        if not reviewer:
+            return jsonify({'error': 'Reviewer is required'}), 400
+        try:
+            submissions, next_cursor = review_queue.claim(reviewer, int(data.get('count', 10)), data.get('after'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'submissions': [task_submissions.serialize(submission) for submission in submissions],
+            'next_cursor': next_cursor
+        }), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/review_queue/leased', methods=['GET'])
+def get_leased_submissions():
+    try:
+        reviewer = request.args.get('reviewer')
+        if not reviewer:
+            return jsonify({'error': 'Reviewer is required'}), 400
+        submissions = review_queue.leased(reviewer)
+        return jsonify({'submissions': [task_submissions.serialize(submission) for submission in submissions]}), 200
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/review_queue/release', methods=['POST'])
+def release_review_submissions():
+    try:
+        data = request.json or {}
+        reviewer = data.get('reviewer')
+        if not reviewer:
+            return jsonify({'error': 'Reviewer is required'}), 400
+        submission_ids = data.get('submissionIds')
+        if submission_ids is not None:
+            submission_ids = [ObjectId(submission_id) for submission_id in submission_ids]
+        return jsonify({'released': review_queue.release(reviewer, submission_ids)}), 200
+    except InvalidId:
+        return jsonify({'error': 'Invalid submission ID'}), 400
+    except Exception as e:
+        logger.error(f"Error occurred: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/approve_task', methods=['POST'])
 def approve_task():
     try:
         data = request.json
         task_id = data.get('taskId')
         username = data.get('username')
-        
-        result = user_scores_collection.update_one(
-            {'username': username, 'task_states.task_id': ObjectId(task_id)},
-            {'$set': {'task_states.$.status': 'approved'}}
+        reviewer = data.get('reviewer')
+        if not ObjectId.is_valid(str(task_id)):
+            return jsonify({'error': 'Invalid task ID format'}), 400
+        lease, held = review_queue.acquire([(username, ObjectId(task_id))], reviewer)
+        if held:
+            return jsonify({'error': 'Submission is leased to another reviewer'}), 409
+        
+        result = task_states.update(
+            user_scores_collection,
+            {'username': username, task_states.path(ObjectId(task_id), 'status'): 'validating'},
+            {'$set': {task_states.path(ObjectId(task_id), 'status'): 'approved'}}
         )
         
         if result.modified_count == 0:
-            return jsonify({'error': 'Task not found or already approved'}), 404
-        
+            review_queue.release_lease(lease)
+            return jsonify({'error': 'Task not found or already processed'}), 404
+
+        task_submissions.resolve(task_submissions_collection, username, ObjectId(task_id), 'approved', reviewer)
         return jsonify({'message': 'Task approved successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -463,15 +756,24 @@ def reject_task():
         data = request.json
         task_id = data.get('taskId')
         username = data.get('username')
-        
-        result = user_scores_collection.update_one(
-            {'username': username, 'task_states.task_id': ObjectId(task_id)},
-            {'$set': {'task_states.$.status': 'rejected'}}
+        reviewer = data.get('reviewer')
+        if not ObjectId.is_valid(str(task_id)):
+            return jsonify({'error': 'Invalid task ID format'}), 400
+        lease, held = review_queue.acquire([(username, ObjectId(task_id))], reviewer)
+        if held:
+            return jsonify({'error': 'Submission is leased to another reviewer'}), 409
+        
+        result = task_states.update(
+            user_scores_collection,
+            {'username': username, task_states.path(ObjectId(task_id), 'status'): 'validating'},
+            {'$set': {task_states.path(ObjectId(task_id), 'status'): 'rejected'}, '$unset': task_availability.rejected(task_id)}
         )
         
         if result.modified_count == 0:
-            return jsonify({'error': 'Task not found or already rejected'}), 404
-        
+            review_queue.release_lease(lease)
+            return jsonify({'error': 'Task not found or already processed'}), 404
+
+        task_submissions.resolve(task_submissions_collection, username, ObjectId(task_id), 'rejected', reviewer)
         return jsonify({'message': 'Task rejected successfully'}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
@@ -479,34 +781,27 @@ def reject_task():
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/claim_reward', methods=['POST'])
+@idempotency_cache.idempotent('claim_reward')
 def claim_reward():
     try:
         data = request.json
         username = data.get('username')
         task_id = data.get('task_id')
-        score = data.get('score')
         
-        user = user_scores_collection.find_one({'username': username})
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        task_state = next((state for state in user.get('task_states', []) if str(state['task_id']) == task_id), None)
-        if not task_state or task_state['status'] != 'approved':
-            return jsonify({'error': 'Task not approved or already claimed'}), 400
+        if not username or not task_id:
+            return jsonify({'error': 'Invalid data'}), 400
         
-        result = user_scores_collection.update_one(
-            {'username': username, 'task_states.task_id': ObjectId(task_id)},
-            {
-                '$inc': {'score': score},
-                '$set': {'task_states.$.status': 'claimed'},
-                '$push': {'scores': {'score': score, 'timestamp': datetime.now()}}
-            }
-        )
+        # The reward is the task's score from the catalog, whatever the client sends
+        task = task_catalog.get(task_id)
+        if not task:
+            return jsonify({'error': 'Task not found'}), 404
+        score = task.get('score', 0)
         
-        if result.modified_count == 0:
-            return jsonify({'error': 'Failed to claim reward'}), 500
+        if task_states.claim(user_scores_collection, score_events_collection, username, task_id, score, week.current()) is None:
+            return jsonify({'error': 'Task not approved or already claimed'}), 400
         
-        return jsonify({'message': 'Reward claimed successfully'}), 200
+        global_stats.record(score=score)
+        return jsonify({'message': 'Reward claimed successfully', 'score': score}), 200
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         logger.error(traceback.format_exc())
@@ -0,0 +1,134 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+import task_states
+
+logger = logging.getLogger(__name__)
+
+FIELD = 'next_eligible_at'
+
+# Each user carries next_eligible_at: {task_id: datetime or None}. A task is
+# missing from the map until the user first submits it; None means a one-off
+# task that is done (or awaiting review), a date is when a recurring task can
+# be submitted again. A rejection removes the entry. Every task-state write sets
+# its entry in the same update, so the available-tasks listing needs nothing
+# beyond this map, the approved states and the in-memory task catalog.
+
+
+def next_eligible_at(task: dict, now: datetime = None):
+    """When a user who submits `task` now may submit it again; None for never."""
+    if task.get('recurInterval'):
+        return (now or datetime.now()) + timedelta(hours=task['recurInterval'])
+    return None
+
+
+def submitted(task: dict, now: datetime = None) -> dict:
+    """$set fields recording that the user just submitted `task`."""
+    return {f"{FIELD}.{task['_id']}": next_eligible_at(task, now)}
+
+
+def rejected(task_id) -> dict:
+    """$unset fields making the task available again after a rejection."""
+    return {f'{FIELD}.{task_id}': ''}
+
+
+def is_completable(task: dict, user: dict, now: datetime = None) -> bool:
+    eligibility = (user or {}).get(FIELD) or {}
+    task_id = str(task['_id'])
+    if task_id not in eligibility:
+        return True
+    return eligibility[task_id] is not None and eligibility[task_id] <= (now or datetime.now())
+
+
+def available(user_scores_collection, task_catalog, username: str, now: datetime = None):
+    """Active tasks the user can act on, or None if the user does not exist.
+
+    One read by username (two for users still on the legacy task_states
+    list); each task gets an `action`: 'complete' when it can be
+    submitted, 'claim' when it was approved and the reward is waiting.
+    """
+    tasks = [task for task in task_catalog.tasks() if task.get('status', 'active') == 'active']
+    user = user_scores_collection.find_one(
+        {'username': username},
+        {FIELD: 1, **{task_states.path(task['_id'], 'status'): 1 for task in tasks}, '_id': 0}
+    )
+    if user is None:
+        return None
+    if isinstance(user.get('task_states'), list):
+        # Legacy list layout: the per-task projection came back empty, so read it whole
+        user['task_states'] = (user_scores_collection.find_one({'username': username}, {'task_states': 1}) or {}).get('task_states')
+    states = task_states.canonical(user.get('task_states'))
+
+    actionable = []
+    for task in tasks:
+        task_id = str(task['_id'])
+        if (states.get(task_id) or {}).get('status') == 'approved':
+            action = 'claim'
+        elif is_completable(task, user, now):
+            action = 'complete'
+        else:
+            continue
+        actionable.append({**task, '_id': task_id, 'action': action})
+    return actionable
+
+
+def _user_eligibility(user: dict, tasks: dict) -> dict:
+    default_time = user['_id'].generation_time.replace(tzinfo=None) if isinstance(user['_id'], ObjectId) else datetime.now()
+
+    fields = {}
+    for state in task_states.as_list(user.get('task_states')):
+        task = tasks.get(state['task_id'])
+        if not task or state.get('status') in (None, 'rejected'):
+            continue
+        fields[f"{FIELD}.{task['_id']}"] = next_eligible_at(task, state.get('timestamp') or default_time)
+    for submission in user.get('recurring_task_submissions') or []:
+        task = tasks.get(str(submission.get('task_id')))
+        if not task or submission.get('status') in (None, 'rejected'):
+            continue
+        submitted_at = submission.get('timestamp') or submission.get('submitted_at') or default_time
+        eligible = next_eligible_at(task, submitted_at)
+        key = f"{FIELD}.{task['_id']}"
+        # Keep the latest submission's date; None (never again) wins over any date
+        if key in fields and (fields[key] is None or (eligible is not None and eligible <= fields[key])):
+            continue
+        fields[key] = eligible
+    return fields
+
+
+def backfill(user_scores_collection, tasks_collection, batch_size: int = 500, pause: float = 0.1) -> int:
+    """Derive next_eligible_at from existing task states, a batch at a time; safe to re-run."""
+    tasks = {str(task['_id']): task for task in tasks_collection.find()}
+    updated = 0
+    last_id = None
+    while True:
+        query = {'$or': [{'task_states': {'$exists': True}}, {'recurring_task_submissions': {'$exists': True}}]}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        users = list(user_scores_collection.find(
+            query, {'task_states': 1, 'recurring_task_submissions': 1}
+        ).sort('_id', 1).limit(batch_size))
+        if not users:
+            break
+        ops = []
+        for user in users:
+            fields = _user_eligibility(user, tasks)
+            if fields:
+                ops.append(UpdateOne({'_id': user['_id']}, {'$set': fields}))
+        if ops:
+            updated += user_scores_collection.bulk_write(ops, ordered=False).modified_count
+        last_id = users[-1]['_id']
+        logger.info(f"Backfilled task eligibility for {updated} users")
+        time.sleep(pause)
+    return updated
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    print(f"Backfilled task eligibility for {backfill(db['user_scores'], db['tasks'])} users")
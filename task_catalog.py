@@ -0,0 +1,126 @@
+import copy
+import logging
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = 'task_catalog'
+POLL_SECONDS = 2
+MAX_AGE_SECONDS = 300  # Reload even without a version change, in case a write skipped bump()
+
+
+class TaskCatalog:
+    """Process-local copy of the tasks collection, versioned through app_state.
+
+    Every task write calls bump(), which increments {_id: 'task_catalog'} in
+    app_state and reloads this process's copy. Other processes check that
+    version at most every POLL_SECONDS on read and reload when it moved, so a
+    change is visible everywhere within that window. The version also serves as
+    the ETag for task listings.
+    """
+
+    def __init__(self, tasks_collection, app_state_collection, poll_seconds=POLL_SECONDS, max_age_seconds=MAX_AGE_SECONDS):
+        self.tasks_collection = tasks_collection
+        self.app_state_collection = app_state_collection
+        self.poll_seconds = poll_seconds
+        self.max_age_seconds = max_age_seconds
+        self._tasks = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()  # Guards swapping in a freshly loaded copy
+        self._refresh_lock = threading.Lock()  # One poll or reload at a time
+
+    def ensure_state(self) -> None:
+        self.app_state_collection.update_one(
+            {'_id': STATE_ID}, {'$setOnInsert': {'version': 1, 'updated_at': datetime.now()}}, upsert=True
+        )
+
+    def _load(self, version: int) -> None:
+        """Read every task and swap the copy in; the query runs without the lock held."""
+        tasks = {task['_id']: task for task in self.tasks_collection.find()}
+        with self._lock:
+            # A concurrent bump() may already have installed a newer version
+            if self._version is not None and version < self._version:
+                return
+            self._tasks, self._version, self._loaded_at = tasks, version, time.monotonic()
+        logger.info(f"Loaded task catalog version {version} with {len(tasks)} tasks")
+
+    def _fresh(self) -> None:
+        """Reload if another process bumped the version.
+
+        One thread polls at a time; the others keep serving the current copy
+        meanwhile, and only wait when there is no copy yet.
+        """
+        if self._version is not None and time.monotonic() - self._checked_at < self.poll_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=self._version is None):
+            return
+        try:
+            now = time.monotonic()
+            if self._version is not None and now - self._checked_at < self.poll_seconds:
+                return
+            state = self.app_state_collection.find_one({'_id': STATE_ID}, {'version': 1})
+            version = state['version'] if state else 0
+            if version != self._version or now - self._loaded_at > self.max_age_seconds:
+                self._load(version)
+            self._checked_at = now
+        finally:
+            self._refresh_lock.release()
+
+    def bump(self) -> int:
+        """Record that the tasks changed; returns the new version."""
+        state = self.app_state_collection.find_one_and_update(
+            {'_id': STATE_ID},
+            {'$inc': {'version': 1}, '$set': {'updated_at': datetime.now()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._load(state['version'])
+        self._checked_at = time.monotonic()
+        return state['version']
+
+    @property
+    def version(self) -> int:
+        self._fresh()
+        return self._version
+
+    def etag(self) -> str:
+        return f'"tasks-{self.version}"'
+
+    def not_modified(self, if_none_match: str, etag: str = None) -> bool:
+        """True if an If-None-Match header value already names `etag` (default: the current version)."""
+        if not if_none_match:
+            return False
+        etag = etag or self.etag()
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+    def get(self, task_id):
+        """A copy of the task with this id (string or ObjectId), or None."""
+        if not isinstance(task_id, ObjectId):
+            if not ObjectId.is_valid(str(task_id)):
+                return None
+            task_id = ObjectId(str(task_id))
+        self._fresh()
+        task = self._tasks.get(task_id)
+        return copy.deepcopy(task) if task else None
+
+    def by_ids(self, task_ids) -> dict:
+        """{task _id: task} for the ids that exist."""
+        self._fresh()
+        tasks = self._tasks
+        return {task_id: copy.deepcopy(tasks[task_id]) for task_id in task_ids if task_id in tasks}
+
+    def tasks(self, recurring: bool = None) -> list:
+        """Copies of every task, optionally only recurring (or only one-off) ones."""
+        self._fresh()
+        tasks = list(self._tasks.values())
+        if recurring is not None:
+            tasks = [task for task in tasks if ('recurInterval' in task) == recurring]
+        return copy.deepcopy(tasks)
@@ -0,0 +1,216 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING
+from pymongo.errors import WriteError
+
+import score_events
+import score_ring
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = 'task_states_migration'
+PATH_NOT_VIABLE = 28
+INTERNAL_FIELDS = ('review_batch',)  # Bulk validation bookkeeping, not part of the state
+
+# Canonical layout: task_states is a map keyed by the task id string,
+#   task_states: {'<task_id>': {'status', 'evidence', 'timestamp', ...}}
+# so every write touches a single task_states.<task_id> path. Older documents
+# written by src/server.py hold a list of {'task_id': ObjectId, ...} entries
+# instead; migrate() converts them in the background, and update() converts a
+# legacy document on the spot when a write reaches it first.
+
+
+def ensure_indexes(user_scores_collection) -> None:
+    # Covers lookups on any task_states.<task_id>.<field>, whatever the task id
+    user_scores_collection.create_index([('task_states.$**', ASCENDING)])
+
+
+def path(task_id, field: str = None) -> str:
+    return f'task_states.{task_id}.{field}' if field else f'task_states.{task_id}'
+
+
+def canonical(task_states) -> dict:
+    """The map form of a task_states value in either layout; later list entries win."""
+    if isinstance(task_states, dict):
+        return task_states
+    states = {}
+    for entry in task_states or []:
+        if isinstance(entry, dict) and entry.get('task_id') is not None:
+            states[str(entry['task_id'])] = {key: value for key, value in entry.items() if key != 'task_id'}
+    return states
+
+
+def get(user: dict, task_id) -> dict:
+    """The user's state for one task, or None."""
+    return canonical((user or {}).get('task_states')).get(str(task_id))
+
+
+def as_list(task_states) -> list:
+    """[{'task_id', ...state}] as returned by the get_task_states endpoints."""
+    return [
+        {'task_id': task_id, **{key: value for key, value in state.items() if key not in INTERNAL_FIELDS}}
+        for task_id, state in canonical(task_states).items() if isinstance(state, dict)
+    ]
+
+
+def submitted(task_id, evidence_url: str, now: datetime = None) -> dict:
+    """$set fields putting the task in validation with the given evidence."""
+    return {path(task_id): {'status': 'validating', 'evidence': evidence_url, 'timestamp': now or datetime.now()}}
+
+
+def _normalize(user_scores_collection, user: dict) -> bool:
+    """Rewrite one legacy list to the map form unless it changed since it was read."""
+    return user_scores_collection.update_one(
+        {'_id': user['_id'], 'task_states': user['task_states']},
+        {'$set': {'task_states': canonical(user['task_states'])}}
+    ).modified_count == 1
+
+
+def normalize(user_scores_collection, query: dict) -> int:
+    """Convert the legacy lists of the users matching `query` now; returns how many changed."""
+    return sum(
+        1 for user in user_scores_collection.find({**query, 'task_states': {'$type': 'array'}}, {'task_states': 1})
+        if _normalize(user_scores_collection, user)
+    )
+
+
+def update(user_scores_collection, query: dict, update: dict, upsert: bool = False):
+    """update_one for task_states.<task_id> paths that also copes with unmigrated documents.
+
+    On a legacy list the path update fails with PathNotViable, and a filter on
+    a task_states.<task_id> path matches nothing. Either way the user's list is
+    converted to the map form and the update retried once, so only writes that
+    reach an unmigrated user pay for the extra round trips.
+    """
+    user_query = {key: value for key, value in query.items() if not key.startswith('task_states')}
+    try:
+        result = user_scores_collection.update_one(query, update, upsert=upsert)
+    except WriteError as e:
+        if e.code != PATH_NOT_VIABLE:
+            raise
+        normalize(user_scores_collection, user_query)
+        return user_scores_collection.update_one(query, update, upsert=upsert)
+    if result.matched_count == 0 and user_query != query and normalize(user_scores_collection, user_query):
+        return user_scores_collection.update_one(query, update, upsert=upsert)
+    return result
+
+
+def claim(user_scores_collection, score_events_collection, username: str, task_id, score: int,
+          week_epoch: int = None, now: datetime = None):
+    """Mark an approved task claimed and credit `score` like any other score write.
+
+    One conditional pipeline update flips the status and applies
+    score_ring.score_update (total, daily ring slot and weekly counters); the
+    event then goes to the score_events day and month buckets. Returns the
+    user's _id, or None when there is nothing to claim: unknown user, task
+    never approved, or already claimed. Of any number of concurrent claims for
+    the same task exactly one matches.
+    """
+    now = now or datetime.now()
+    query = {'username': username, path(task_id, 'status'): 'approved'}
+    update = score_ring.score_update(score, now, week_epoch=week_epoch)
+    update[0]['$set'].update({path(task_id, 'status'): 'claimed', path(task_id, 'claimed_at'): now})
+    user = user_scores_collection.find_one_and_update(query, update, projection={'_id': 1})
+    if user is None and normalize(user_scores_collection, {'username': username}):
+        user = user_scores_collection.find_one_and_update(query, update, projection={'_id': 1})
+    if user is None:
+        return None
+    score_events.record(score_events_collection, user['_id'], score, now, username)
+    return user['_id']
+
+
+def progress(app_state_collection) -> dict:
+    state = app_state_collection.find_one({'_id': STATE_ID}, {'_id': 0}) or {}
+    return {
+        'migrated': state.get('migrated', 0),
+        'skipped': state.get('skipped', 0),
+        'last_id': str(state['last_id']) if state.get('last_id') is not None else None,
+        'started_at': state.get('started_at'),
+        'updated_at': state.get('updated_at'),
+        'finished_at': state.get('finished_at')
+    }
+
+
+def migrate(user_scores_collection, app_state_collection, batch_size: int = 500, pause: float = 0.2, stop=None) -> dict:
+    """Convert every list-form task_states to the map form; resumable and safe to re-run.
+
+    Progress ({last_id, migrated, skipped}) is saved in app_state after every
+    batch, so a stopped run continues where it left off. Documents that change
+    between read and write are skipped and picked up by the next run.
+    """
+    state = app_state_collection.find_one({'_id': STATE_ID}) or {}
+    if state.get('finished_at'):
+        app_state_collection.update_one({'_id': STATE_ID}, {'$unset': {'finished_at': ''}, '$set': {'last_id': None}})
+        state = {}
+    last_id = state.get('last_id')
+    if not state:
+        app_state_collection.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'started_at': datetime.now(), 'migrated': 0, 'skipped': 0, 'last_id': None}},
+            upsert=True
+        )
+
+    while not (stop and stop.is_set()):
+        query = {'task_states': {'$type': 'array'}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        users = list(user_scores_collection.find(query, {'task_states': 1}).sort('_id', 1).limit(batch_size))
+        if not users:
+            app_state_collection.update_one({'_id': STATE_ID}, {'$set': {'finished_at': datetime.now()}})
+            break
+        migrated = sum(1 for user in users if _normalize(user_scores_collection, user))
+        last_id = users[-1]['_id']
+        app_state_collection.update_one(
+            {'_id': STATE_ID},
+            {'$inc': {'migrated': migrated, 'skipped': len(users) - migrated},
+             '$set': {'last_id': last_id, 'updated_at': datetime.now()}}
+        )
+        logger.info(f"Migrated task states: {progress(app_state_collection)}")
+        time.sleep(pause)
+    return progress(app_state_collection)
+
+
+class Migration:
+    """Runs migrate() on a background thread; at most one run per process."""
+
+    def __init__(self, user_scores_collection, app_state_collection, batch_size: int = 500, pause: float = 0.2):
+        self.user_scores_collection = user_scores_collection
+        self.app_state_collection = app_state_collection
+        self.batch_size = batch_size
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self) -> bool:
+        """Start a run unless one is already going; returns whether it started."""
+        if self.running:
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='task-states-migration', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        try:
+            migrate(self.user_scores_collection, self.app_state_collection, self.batch_size, self.pause, self._stop)
+        except Exception as e:
+            logger.error(f"Task states migration failed: {str(e)}")
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    ensure_indexes(db['user_scores'])
+    print(f"Task states migration: {migrate(db['user_scores'], db['app_state'])}")
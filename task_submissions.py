@@ -0,0 +1,459 @@
+import atexit
+import base64
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import task_availability
+import task_states
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'validating'
+QUEUE_ORDER = [('submitted_at', ASCENDING), ('_id', ASCENDING)]
+LEASE_SECONDS = 300
+REAP_INTERVAL = 30
+MAX_CLAIM = 50
+CLAIM_ATTEMPTS = 3
+MAX_BULK_ITEMS = 1000
+PAGE_SIZE = 50  # Pending listings
+MAX_PAGE_SIZE = 200
+DECISIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+# One document per evidence submission, so the review queue is an index range
+# read instead of an $unwind over every user's task_states:
+#   {username, task_id, status, evidence_url, submitted_at, is_recurring, reviewed_at}
+# plus {reviewer, lease, lease_expires} while a reviewer holds it (see ReviewQueue).
+# The user's task_states entry stays the source of truth for claiming; these
+# documents mirror its status.
+
+
+def ensure_indexes(task_submissions_collection) -> None:
+    task_submissions_collection.create_index([('status', ASCENDING), ('submitted_at', ASCENDING), ('_id', ASCENDING)])
+    task_submissions_collection.create_index([('username', ASCENDING), ('task_id', ASCENDING)])
+    task_submissions_collection.create_index([('lease_expires', ASCENDING)], sparse=True)
+    task_submissions_collection.create_index([('reviewer', ASCENDING)], sparse=True)
+
+
+def submit(task_submissions_collection, username: str, task_id: ObjectId, evidence_url: str,
+           is_recurring: bool = False, submitted_at: datetime = None) -> ObjectId:
+    """Queue a submission for review; returns its id.
+
+    A one-off task has a single submission per user that a resubmission puts back
+    in the queue; every submission of a recurring task is its own document.
+    """
+    submitted_at = submitted_at or datetime.now()
+    fields = {'status': PENDING, 'evidence_url': evidence_url, 'submitted_at': submitted_at, 'reviewed_at': None}
+    if is_recurring:
+        return task_submissions_collection.insert_one(
+            {'username': username, 'task_id': task_id, 'is_recurring': True, **fields}
+        ).inserted_id
+    result = task_submissions_collection.find_one_and_update(
+        {'username': username, 'task_id': task_id, 'is_recurring': False},
+        {'$set': fields},
+        projection={'_id': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return result['_id']
+
+
+def resolve(task_submissions_collection, username: str, task_id: ObjectId, status: str, reviewer: str = None) -> int:
+    """Move the user's pending submissions for a task to `status`, ending any lease; returns how many moved."""
+    return task_submissions_collection.update_many(
+        {'username': username, 'task_id': task_id, 'status': PENDING},
+        {
+            '$set': {'status': status, 'reviewed_at': datetime.now(), 'reviewed_by': reviewer},
+            '$unset': {'reviewer': '', 'lease': '', 'lease_expires': ''}
+        }
+    ).modified_count
+
+
+def parse_page_args(args) -> tuple:
+    """(limit, after cursor) for a pending listing from request args; ValueError on bad input."""
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    return min(max(limit, 1), MAX_PAGE_SIZE), args.get('after') or None
+
+
+def pending_page(task_submissions_collection, limit: int = PAGE_SIZE, after: str = None, projection: dict = None) -> tuple:
+    """One keyset page of pending submissions, oldest first; returns (submissions, next_cursor).
+
+    next_cursor is None on the last page. Raises ValueError for a bad cursor.
+    """
+    query = {'status': PENDING}
+    if after:
+        query.update(decode_cursor(after))
+    submissions = list(task_submissions_collection.find(query, projection).sort(QUEUE_ORDER).limit(limit + 1))
+    if len(submissions) <= limit:
+        return submissions, None
+    return submissions[:limit], encode_cursor(submissions[limit - 1])
+
+
+def pending(task_submissions_collection, task_catalog, limit: int = PAGE_SIZE, after: str = None) -> tuple:
+    """pending_page() joined with each task's description and score."""
+    submissions, next_cursor = pending_page(task_submissions_collection, limit, after)
+    return _with_tasks(task_catalog, submissions), next_cursor
+
+
+def _with_tasks(task_catalog, submissions: list) -> list:
+    tasks = task_catalog.by_ids({submission['task_id'] for submission in submissions})
+    return [dict(submission, task=tasks[submission['task_id']]) for submission in submissions if submission['task_id'] in tasks]
+
+
+def serialize(submission: dict) -> dict:
+    """JSON-ready view of a submission returned by pending() or ReviewQueue."""
+    return {
+        'submissionId': str(submission['_id']),
+        'taskId': str(submission['task_id']),
+        'username': submission['username'],
+        'evidenceUrl': submission.get('evidence_url'),
+        'submittedAt': submission['submitted_at'].isoformat() if submission.get('submitted_at') else None,
+        'isRecurring': submission.get('is_recurring', False),
+        'description': submission['task'].get('description'),
+        'score': submission['task'].get('score'),
+        'reviewer': submission.get('reviewer'),
+        'leaseExpires': submission['lease_expires'].isoformat() if submission.get('lease_expires') else None
+    }
+
+
+def encode_cursor(submission: dict) -> str:
+    """Opaque keyset cursor that resumes the queue right after `submission`."""
+    key = [submission['submitted_at'].isoformat(), str(submission['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(token: str) -> dict:
+    """Turn a queue cursor back into the query that selects the submissions after it."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+        submitted_at, last_id = datetime.fromisoformat(key[0]), ObjectId(key[1])
+    except (ValueError, TypeError, IndexError, InvalidId):
+        raise ValueError('Invalid cursor')
+    return {'$or': [
+        {'submitted_at': {'$gt': submitted_at}},
+        {'submitted_at': submitted_at, '_id': {'$gt': last_id}}
+    ]}
+
+
+class ReviewQueue:
+    """Hands pending submissions to concurrent reviewers under time-limited leases.
+
+    claim() leases the oldest unleased submissions (after an optional keyset
+    cursor) to one reviewer: it reads candidate ids off the (status,
+    submitted_at, _id) index and takes them with a single update_many that
+    re-checks availability, so two reviewers never get the same submission.
+    Candidates lost to a concurrent claim are topped up from the next ones.
+    A lease ends when the submission is resolved, released or expires; expired
+    leases are claimable straight away and a background thread clears them.
+    """
+
+    def __init__(self, task_submissions_collection, task_catalog, lease_seconds=LEASE_SECONDS, reap_interval=REAP_INTERVAL):
+        self.task_submissions_collection = task_submissions_collection
+        self.task_catalog = task_catalog
+        self.lease_seconds = lease_seconds
+        self.reap_interval = reap_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='review-leases', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.reap_interval):
+            try:
+                self.release_expired()
+            except Exception as e:
+                logger.error(f"Failed to release expired review leases: {str(e)}")
+
+    @staticmethod
+    def _available(now: datetime) -> dict:
+        return {'status': PENDING, 'lease_expires': {'$not': {'$gt': now}}}
+
+    def claim(self, reviewer: str, count: int = 10, after: str = None) -> tuple:
+        """Lease up to `count` submissions to `reviewer`; returns (submissions, next cursor)."""
+        count = min(max(count, 1), MAX_CLAIM)
+        now = datetime.now()
+        token = ObjectId()
+        query = self._available(now)
+        if after:
+            query = {'$and': [query, decode_cursor(after)]}
+
+        taken, claimed = [], 0
+        for _ in range(CLAIM_ATTEMPTS):
+            ids = [doc['_id'] for doc in self.task_submissions_collection.find(query, {'_id': 1}).sort(QUEUE_ORDER).limit(count - claimed)]
+            if not ids:
+                break
+            claimed += self.task_submissions_collection.update_many(
+                {'_id': {'$in': ids}, **self._available(now)},
+                {'$set': {'reviewer': reviewer, 'lease': token, 'lease_expires': now + timedelta(seconds=self.lease_seconds)}}
+            ).modified_count
+            taken.extend(ids)
+            if claimed >= count:
+                break
+
+        submissions = list(self.task_submissions_collection.find({'_id': {'$in': taken}, 'lease': token}).sort(QUEUE_ORDER))
+        next_cursor = encode_cursor(submissions[-1]) if submissions else after
+        return _with_tasks(self.task_catalog, submissions), next_cursor
+
+    def leased(self, reviewer: str) -> list:
+        """The submissions `reviewer` currently holds, e.g. to resume after a page reload."""
+        submissions = self.task_submissions_collection.find(
+            {'reviewer': reviewer, 'status': PENDING, 'lease_expires': {'$gt': datetime.now()}}
+        ).sort(QUEUE_ORDER).limit(MAX_CLAIM * CLAIM_ATTEMPTS)
+        return _with_tasks(self.task_catalog, list(submissions))
+
+    def acquire(self, pairs: list, reviewer: str = None) -> tuple:
+        """Lease the pending submissions of (username, task_id) pairs to `reviewer` ahead of resolving them.
+
+        Returns (lease token, pairs another reviewer holds). One update_many takes
+        every unleased or expired submission under a fresh token, then a read
+        finds pairs with a live lease under another token that is not the
+        reviewer's own; those are handed back untouched. Of two reviewers racing
+        for the same submission at most one comes away without it in the held
+        set. Without `reviewer`, any live lease counts as held. Pairs with no
+        pending submission are not held. Release the token with release_lease()
+        if the resolve does not go through; resolve() ends the lease otherwise.
+        """
+        token = ObjectId()
+        if not pairs:
+            return token, set()
+        now = datetime.now()
+        of_pairs = {'$or': [{'username': username, 'task_id': task_id} for username, task_id in pairs]}
+        self.task_submissions_collection.update_many(
+            {**of_pairs, **self._available(now)},
+            {'$set': {'reviewer': reviewer, 'lease': token, 'lease_expires': now + timedelta(seconds=self.lease_seconds)}}
+        )
+        others = {'status': PENDING, 'lease': {'$ne': token}, 'lease_expires': {'$gt': now}}
+        if reviewer:
+            others['reviewer'] = {'$ne': reviewer}
+        held = {
+            (submission['username'], submission['task_id'])
+            for submission in self.task_submissions_collection.find({**of_pairs, **others}, {'username': 1, 'task_id': 1, '_id': 0})
+        }
+        if held:
+            self.task_submissions_collection.update_many(
+                {'lease': token, '$or': [{'username': username, 'task_id': task_id} for username, task_id in held]},
+                {'$unset': {'reviewer': '', 'lease': '', 'lease_expires': ''}}
+            )
+        return token, held
+
+    def release_lease(self, token: ObjectId) -> int:
+        """Hand back whatever acquire() took under `token` and is still pending."""
+        return self.task_submissions_collection.update_many(
+            {'lease': token, 'status': PENDING}, {'$unset': {'reviewer': '', 'lease': '', 'lease_expires': ''}}
+        ).modified_count
+
+    def release(self, reviewer: str, submission_ids: list = None) -> int:
+        """Hand the reviewer's leased submissions (all of them by default) back to the queue."""
+        query = {'reviewer': reviewer, 'status': PENDING}
+        if submission_ids is not None:
+            query['_id'] = {'$in': submission_ids}
+        return self.task_submissions_collection.update_many(
+            query, {'$unset': {'reviewer': '', 'lease': '', 'lease_expires': ''}}
+        ).modified_count
+
+    def release_expired(self) -> int:
+        released = self.task_submissions_collection.update_many(
+            {'lease_expires': {'$lte': datetime.now()}},
+            {'$unset': {'reviewer': '', 'lease': '', 'lease_expires': ''}}
+        ).modified_count
+        if released:
+            logger.info(f"Released {released} expired review leases")
+        return released
+
+
+def validate_bulk(user_scores_collection, task_submissions_collection, task_catalog, items: list,
+                  reviewer: str = None, review_queue=None) -> tuple:
+    """Approve or reject many {username, taskId, action} items; returns (per-item results, score awarded).
+
+    Task scores come from the in-memory task_catalog.TaskCatalog, every user update
+    goes out in one unordered bulk_write and the submissions are resolved in a
+    second one. Each update stamps the task state with a batch id, so reading
+    the stamps back tells which items this call applied; the rest were already
+    processed. With a review_queue, every item's submission is leased to
+    `reviewer` first, so items another reviewer holds come back as leased
+    (whether or not `reviewer` is given). Item statuses: approved, rejected,
+    invalid, duplicate, leased and not_found (unknown task, or not validating).
+    """
+    results, valid, seen = [], [], set()
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        username, task_id, action = item.get('username'), item.get('taskId'), item.get('action')
+        result = {'index': index, 'username': username, 'taskId': task_id, 'action': action}
+        results.append(result)
+        if not all([username, task_id, action]) or not isinstance(username, str):
+            result.update(status='invalid', error='Missing required data')
+        elif action not in DECISIONS:
+            result.update(status='invalid', error='Invalid action')
+        elif not ObjectId.is_valid(str(task_id)):
+            result.update(status='invalid', error='Invalid task ID format')
+        elif (username, str(task_id)) in seen:
+            result.update(status='duplicate')
+        else:
+            seen.add((username, str(task_id)))
+            valid.append((result, username, ObjectId(str(task_id)), action))
+
+    lease = None
+    if review_queue and valid:
+        lease, held = review_queue.acquire([(username, task_id) for _, username, task_id, _ in valid], reviewer)
+        for result, username, task_id, _ in valid:
+            if (username, task_id) in held:
+                result.update(status='leased', error='Submission is leased to another reviewer')
+        valid = [entry for entry in valid if entry[0].get('status') != 'leased']
+
+    scores = {
+        task_id: task.get('score', 0)
+        for task_id, task in task_catalog.by_ids({task_id for _, _, task_id, action in valid if action == 'approve'}).items()
+    }
+    batch = ObjectId()
+    ops, applying = [], []
+    for result, username, task_id, action in valid:
+        if action == 'approve' and task_id not in scores:
+            result.update(status='not_found', error='Task not found')
+            continue
+        state = task_states.path(task_id)
+        update = {'$set': {f'{state}.status': DECISIONS[action], f'{state}.review_batch': batch}}
+        if action == 'approve' and scores[task_id]:
+            update['$inc'] = {'score': scores[task_id]}
+        if action == 'reject':
+            update['$unset'] = task_availability.rejected(task_id)
+        ops.append(UpdateOne({'username': username, f'{state}.status': PENDING}, update))
+        applying.append((result, username, task_id, action))
+    if not ops:
+        if lease:
+            review_queue.release_lease(lease)
+        return results, 0
+
+    task_states.normalize(user_scores_collection, {'username': {'$in': list({username for _, username, _, _ in applying})}})
+    try:
+        user_scores_collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        logger.error(f"Bulk validation had {len(e.details.get('writeErrors', []))} write errors")
+
+    # Read back which task states carry this batch's stamp
+    stamped = set()
+    users = user_scores_collection.find(
+        {'username': {'$in': list({username for _, username, _, _ in applying})}},
+        {'username': 1, **{f'task_states.{task_id}.review_batch': 1 for _, _, task_id, _ in applying}}
+    )
+    for user in users:
+        for task_id, state in (user.get('task_states') or {}).items():
+            if isinstance(state, dict) and state.get('review_batch') == batch:
+                stamped.add((user['username'], task_id))
+
+    awarded, resolve_ops, now = 0, [], datetime.now()
+    for result, username, task_id, action in applying:
+        if (username, str(task_id)) not in stamped:
+            result.update(status='not_found', error='Task not found or already processed')
+            continue
+        result['status'] = DECISIONS[action]
+        if action == 'approve':
+            result['awarded'] = scores[task_id]
+            awarded += scores[task_id]
+        resolve_ops.append(UpdateMany(
+            {'username': username, 'task_id': task_id, 'status': PENDING},
+            {
+                '$set': {'status': DECISIONS[action], 'reviewed_at': now, 'reviewed_by': reviewer},
+                '$unset': {'reviewer': '', 'lease': '', 'lease_expires': ''}
+            }
+        ))
+    if resolve_ops:
+        task_submissions_collection.bulk_write(resolve_ops, ordered=False)
+    if lease:
+        review_queue.release_lease(lease)
+    return results, awarded
+
+
+def _as_object_id(task_id):
+    return task_id if isinstance(task_id, ObjectId) or not ObjectId.is_valid(str(task_id)) else ObjectId(str(task_id))
+
+
+def _user_ops(user: dict) -> list:
+    default_time = user['_id'].generation_time.replace(tzinfo=None) if isinstance(user['_id'], ObjectId) else datetime.now()
+
+    ops = []
+    for state in task_states.as_list(user.get('task_states')):
+        if not state.get('status'):
+            continue
+        ops.append(UpdateOne(
+            {'username': user['username'], 'task_id': _as_object_id(state['task_id']), 'is_recurring': False},
+            {'$setOnInsert': {
+                'status': state['status'],
+                'evidence_url': state.get('evidence'),
+                'submitted_at': state.get('timestamp') or default_time,
+                'reviewed_at': None
+            }},
+            upsert=True
+        ))
+    for submission in user.get('recurring_task_submissions') or []:
+        if not submission.get('task_id') or not submission.get('status'):
+            continue
+        ops.append(UpdateOne(
+            {'_id': submission.get('_id') or ObjectId()},
+            {'$setOnInsert': {
+                'username': user['username'],
+                'task_id': _as_object_id(submission['task_id']),
+                'is_recurring': True,
+                'status': submission['status'],
+                'evidence_url': submission.get('evidence'),
+                'submitted_at': submission.get('timestamp') or submission.get('submitted_at') or default_time,
+                'reviewed_at': None
+            }},
+            upsert=True
+        ))
+    return ops
+
+
+def backfill(user_scores_collection, task_submissions_collection, batch_size: int = 500, pause: float = 0.1) -> int:
+    """Copy task_states and recurring_task_submissions entries into task_submissions; safe to re-run.
+
+    Existing submission documents are left untouched.
+    """
+    # Evidence submitted before this module existed was queued as 'pending'
+    task_submissions_collection.update_many({'status': 'pending'}, {'$set': {'status': PENDING, 'reviewed_at': None}})
+    copied = 0
+    last_id = None
+    while True:
+        query = {'username': {'$exists': True}, '$or': [
+            {'task_states': {'$exists': True}}, {'recurring_task_submissions': {'$exists': True}}
+        ]}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        users = list(user_scores_collection.find(
+            query, {'username': 1, 'task_states': 1, 'recurring_task_submissions': 1}
+        ).sort('_id', 1).limit(batch_size))
+        if not users:
+            break
+        ops = [op for user in users for op in _user_ops(user)]
+        if ops:
+            copied += task_submissions_collection.bulk_write(ops, ordered=False).upserted_count
+        last_id = users[-1]['_id']
+        logger.info(f"Backfilled {copied} task submissions")
+        time.sleep(pause)
+    return copied
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = MongoClient('mongodb://localhost:27017/')['pool_degen']
+    ensure_indexes(db['task_submissions'])
+    print(f"Backfilled {backfill(db['user_scores'], db['task_submissions'])} task submissions")
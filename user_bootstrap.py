@@ -0,0 +1,49 @@
+import logging
+
+from pymongo import ReturnDocument
+
+import user_search
+
+logger = logging.getLogger(__name__)
+
+
+def bootstrap(user_scores_collection, identifier: str, chat_id: int, username: str,
+              referral_code: str, referrer: str = None) -> dict:
+    """Create or refresh a /start user in one round trip.
+
+    A single pipeline upsert stores the chat_id, fills every default the user is
+    missing (including `referral_code`) and records `referrer` only if the user
+    has none yet. Returns {'created', 'score', 'referral_code', 'referred'}, where
+    `referred` means this call set the user's referrer, so the referral still has
+    to be recorded with referrals.ReferralCredits.record().
+    """
+    defaults = {
+        'username': username,
+        'score': 0,
+        'referral_code': referral_code,
+        'referral_count': 0,
+        'weekly_score': 0,
+        'weekly_referrals': 0,
+        **user_search.search_fields(username)
+    }
+    if referrer == identifier:
+        referrer = None
+    fields = {field: {'$ifNull': [f'${field}', {'$literal': value}]} for field, value in defaults.items()}
+    fields['referrer'] = {'$ifNull': ['$referrer', {'$literal': referrer}]}
+    fields['chat_id'] = {'$literal': chat_id}
+
+    previous = user_scores_collection.find_one_and_update(
+        {'identifier': identifier},
+        [{'$set': fields}],
+        projection={'score': 1, 'referral_code': 1, 'referrer': 1, '_id': 0},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    created = previous is None
+    previous = previous or {}
+    return {
+        'created': created,
+        'score': previous.get('score', 0),
+        'referral_code': previous.get('referral_code') or referral_code,
+        'referred': referrer is not None and previous.get('referrer') is None
+    }
@@ -0,0 +1,90 @@
+# Typed, projection-limited reads of single user_scores documents. A user
+# document carries bulky or sensitive fields (task_states, score_days, wallet
+# private keys), so each record type asks Mongo for only the fields it
+# declares. Records are plain __slots__ objects with a dict-style get(), so
+# helpers written against user dicts (weekly.current_value,
+# score_ring.window_total) accept them unchanged.
+
+
+class Record:
+    """The projected fields of one user document; missing fields read as None."""
+
+    __slots__ = ('id',)
+    FIELDS = ()
+
+    def __init__(self, doc: dict):
+        self.id = doc.get('_id')
+        for field in self.FIELDS:
+            setattr(self, field, doc.get(field))
+
+    @classmethod
+    def projection(cls) -> dict:
+        return {field: 1 for field in cls.FIELDS}
+
+    def get(self, field: str, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.FIELDS)
+        return f'{type(self).__name__}(id={self.id!r}, {fields})'
+
+
+class UserScore(Record):
+    __slots__ = FIELDS = ('username', 'identifier', 'score', 'weekly_score', 'week_epoch')
+
+
+class UserScoreDays(Record):
+    __slots__ = FIELDS = ('score_days',)
+
+
+class UserReferral(Record):
+    __slots__ = FIELDS = ('referral_code', 'referral_count', 'referrer')
+
+
+class UserWallets(Record):
+    # Addresses only; bep20_wallet_private_key never leaves the database here
+    __slots__ = FIELDS = ('bep20_wallet_address', 'ton_wallet')
+
+
+class UserTaskStates(Record):
+    __slots__ = FIELDS = ('username', 'task_states')
+
+
+class UserRepository:
+    """Single-user reads by identifier (bot) or username (API server)."""
+
+    def __init__(self, user_scores_collection):
+        self.user_scores_collection = user_scores_collection
+
+    @staticmethod
+    def _query(identifier: str = None, username: str = None) -> dict:
+        if identifier is not None:
+            return {'identifier': identifier}
+        if username is not None:
+            return {'username': username}
+        raise ValueError('identifier or username is required')
+
+    def _find(self, record, identifier: str = None, username: str = None):
+        doc = self.user_scores_collection.find_one(self._query(identifier, username), record.projection())
+        return record(doc) if doc else None
+
+    def id_of(self, identifier: str = None, username: str = None):
+        """The user's _id, or None if there is no such user."""
+        doc = self.user_scores_collection.find_one(self._query(identifier, username), {'_id': 1})
+        return doc['_id'] if doc else None
+
+    def score(self, identifier: str = None, username: str = None) -> UserScore:
+        return self._find(UserScore, identifier, username)
+
+    def score_days(self, identifier: str = None, username: str = None) -> UserScoreDays:
+        return self._find(UserScoreDays, identifier, username)
+
+    def referral(self, identifier: str = None, username: str = None) -> UserReferral:
+        return self._find(UserReferral, identifier, username)
+
+    def wallets(self, identifier: str = None, username: str = None) -> UserWallets:
+        return self._find(UserWallets, identifier, username)
+
+    def task_states(self, identifier: str = None, username: str = None) -> UserTaskStates:
+        return self._find(UserTaskStates, identifier, username)
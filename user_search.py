@@ -0,0 +1,146 @@
+import logging
+import re
+import sys
+import time
+
+from pymongo import ASCENDING, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 100
+DEFAULT_LIMIT = 50
+MAX_CANDIDATES = 1000  # Upper bound on documents a substring search may inspect
+NGRAM = 3
+
+
+def normalize(username) -> str:
+    """Lowercase, trimmed form of a username used for every search field."""
+    return str(username or '').strip().casefold()
+
+
+def trigrams(text: str) -> list:
+    return sorted({text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)})
+
+
+def search_fields(username) -> dict:
+    """Derived fields to store alongside `username` so it can be searched through indexes."""
+    normalized = normalize(username)
+    return {'username_lower': normalized, 'username_trigrams': trigrams(normalized)}
+
+
+def ensure_indexes(user_scores_collection) -> None:
+    user_scores_collection.create_index([('username_lower', ASCENDING)])
+    user_scores_collection.create_index([('username_trigrams', ASCENDING)])
+
+
+def parse_limit(value, default: int = DEFAULT_LIMIT) -> int:
+    """The `limit` request argument as a result count; ValueError on bad input."""
+    if value is None:
+        return default
+    try:
+        return min(max(int(value), 1), MAX_RESULTS)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+
+
+def _prefix_end(prefix: str):
+    """The smallest string greater than every string starting with `prefix`, or None.
+
+    Mongo orders strings by their UTF-8 bytes, which is code point order, so
+    bumping the last code point that can still grow gives the exclusive upper
+    bound of the prefix range. Surrogates cannot be stored and are skipped.
+    """
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code <= sys.maxunicode:
+            return prefix[:-1] + chr(0xE000 if 0xD800 <= code <= 0xDFFF else code)
+        prefix = prefix[:-1]
+    return None
+
+
+def _rank(user: dict, query: str) -> tuple:
+    name = user.get('username_lower', '')
+    match = 0 if name == query else 1 if name.startswith(query) else 2
+    return match, -(user.get('score') or 0), name
+
+
+def _matches(user_scores_collection, query: str, projection: dict = None) -> dict:
+    """{_id: user} for up to about 2 * MAX_CANDIDATES users whose username_lower contains `query`."""
+    found = {}
+    prefix_range = {'$gte': query}
+    end = _prefix_end(query)
+    if end is not None:
+        prefix_range['$lt'] = end
+    for user in user_scores_collection.find({'username_lower': prefix_range}, projection).limit(MAX_CANDIDATES):
+        found[user['_id']] = user
+
+    if len(query) < NGRAM:
+        substring_query = {'username_lower': {'$regex': re.escape(query)}}
+    else:
+        substring_query = {'username_trigrams': {'$all': trigrams(query)}}
+    if len(found) < MAX_CANDIDATES:
+        for user in user_scores_collection.find(substring_query, projection).limit(MAX_CANDIDATES):
+            if query in user.get('username_lower', ''):
+                found.setdefault(user['_id'], user)
+    return found
+
+
+def search(user_scores_collection, query: str, limit: int = 20, projection: dict = None) -> list:
+    """Find users whose username contains `query`, best matches first.
+
+    Prefix matches are an index range on username_lower. Queries of NGRAM or more
+    characters also look up candidates through the trigram index and keep those
+    that really contain the query; shorter ones have no trigrams, so their
+    substring matches come from an escaped regex over username_lower, capped at
+    MAX_CANDIDATES documents. Results are ranked exact > prefix > substring,
+    then by score. The query is never interpreted as a regular expression.
+    `projection` may only exclude fields, since ranking needs username_lower and score.
+    """
+    return search_with_stats(user_scores_collection, query, limit, projection)[0]
+
+
+def search_with_stats(user_scores_collection, query: str, limit: int = 20, projection: dict = None) -> tuple:
+    """search() plus {'totalScore', 'averageScore', 'topPerformers'} over every match, not just the page.
+
+    Both come from one candidate read, so the stats cover the same bounded set
+    of matches the page is ranked from.
+    """
+    query = normalize(query)
+    limit = min(max(limit, 1), MAX_RESULTS)
+    matches = list(_matches(user_scores_collection, query, projection).values()) if query else []
+    total_score = sum(user.get('score') or 0 for user in matches)
+    stats = {
+        'totalScore': total_score,
+        'averageScore': total_score / len(matches) if matches else 0,
+        'topPerformers': sorted(matches, key=lambda user: user.get('score') or 0, reverse=True)[:3]
+    }
+    return sorted(matches, key=lambda user: _rank(user, query))[:limit], stats
+
+
+def backfill(user_scores_collection, batch_size: int = 1000, pause: float = 0.1) -> int:
+    """Add search fields to users that do not have them yet; safe to re-run."""
+    updated = 0
+    while True:
+        batch = list(user_scores_collection.find(
+            {'username_lower': {'$exists': False}, 'username': {'$type': 'string'}},
+            {'username': 1}
+        ).limit(batch_size))
+        if not batch:
+            break
+        user_scores_collection.bulk_write(
+            [UpdateOne({'_id': user['_id']}, {'$set': search_fields(user['username'])}) for user in batch],
+            ordered=False
+        )
+        updated += len(batch)
+        logger.info(f"Backfilled search fields for {updated} users")
+        time.sleep(pause)
+    return updated
+
+
+if __name__ == '__main__':
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    collection = MongoClient('mongodb://localhost:27017/')['pool_degen']['user_scores']
+    ensure_indexes(collection)
+    print(f"Backfilled {backfill(collection)} users")
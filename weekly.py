@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = 'week_epoch'
+CACHE_SECONDS = 5
+WEEKLY_FIELDS = ('weekly_score', 'weekly_referrals')
+
+# weekly_score / weekly_referrals only count while the user's week_epoch matches
+# the current one in app_state. Resetting the week bumps that one document; stale
+# values read as zero and are overwritten by the user's next weekly write.
+
+
+def ensure_indexes(user_scores_collection) -> None:
+    for field in WEEKLY_FIELDS:
+        user_scores_collection.create_index([('week_epoch', ASCENDING), (field, DESCENDING)])
+
+
+def week_fields(epoch: int, score: int = 0, referrals: int = 0) -> dict:
+    """Pipeline $set expressions adding to this week's counters, restarting them if stale."""
+    current = {'$eq': ['$week_epoch', epoch]}
+    return {
+        'weekly_score': {'$add': [{'$cond': [current, {'$ifNull': ['$weekly_score', 0]}, 0]}, score]},
+        'weekly_referrals': {'$add': [{'$cond': [current, {'$ifNull': ['$weekly_referrals', 0]}, 0]}, referrals]},
+        'week_epoch': epoch
+    }
+
+
+def current_value(user: dict, field: str, epoch: int) -> int:
+    """Read a weekly counter from a user document, treating last week's values as zero."""
+    if not user or user.get('week_epoch') != epoch:
+        return 0
+    return user.get(field, 0) or 0
+
+
+class WeekEpoch:
+    """The current week number, stored in app_state and cached for CACHE_SECONDS.
+
+    Other processes see an advance() within CACHE_SECONDS, so writes in that
+    window may still land in the week that just ended.
+    """
+
+    def __init__(self, app_state_collection, cache_seconds=CACHE_SECONDS):
+        self.app_state_collection = app_state_collection
+        self.cache_seconds = cache_seconds
+        self._epoch = None
+        self._read_at = 0.0
+        self._lock = threading.Lock()
+
+    def ensure_state(self, user_scores_collection) -> None:
+        """Create the epoch document on first run and tag this week's existing counters with it."""
+        result = self.app_state_collection.update_one(
+            {'_id': STATE_ID},
+            {'$setOnInsert': {'epoch': 1, 'started_at': datetime.now()}},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            tagged = user_scores_collection.update_many(
+                {'week_epoch': {'$exists': False}, '$or': [{field: {'$gt': 0}} for field in WEEKLY_FIELDS]},
+                {'$set': {'week_epoch': 1}}
+            )
+            logger.info(f"Started week epoch 1, tagged {tagged.modified_count} users with weekly counters")
+
+    def current(self) -> int:
+        with self._lock:
+            if self._epoch is None or time.monotonic() - self._read_at > self.cache_seconds:
+                state = self.app_state_collection.find_one({'_id': STATE_ID}, {'epoch': 1})
+                self._epoch = state['epoch'] if state else 1
+                self._read_at = time.monotonic()
+            return self._epoch
+
+    def advance(self) -> int:
+        """Start a new week; returns the new epoch."""
+        state = self.app_state_collection.find_one_and_update(
+            {'_id': STATE_ID},
+            {'$inc': {'epoch': 1}, '$set': {'started_at': datetime.now()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        with self._lock:
+            self._epoch = state['epoch']
+            self._read_at = time.monotonic()
+        logger.info(f"Started week epoch {self._epoch}")
+        return state['epoch']
+
+
+def compact(user_scores_collection, epoch: int, batch_size: int = 1000, pause: float = 0.1) -> int:
+    """Zero out counters left over from earlier weeks, a batch at a time; safe to re-run.
+
+    Purely housekeeping: stale counters already read as zero.
+    """
+    compacted = 0
+    while True:
+        batch = [user['_id'] for user in user_scores_collection.find(
+            {'week_epoch': {'$lt': epoch}}, {'_id': 1}
+        ).limit(batch_size)]
+        if not batch:
+            break
+        result = user_scores_collection.update_many(
+            {'_id': {'$in': batch}, 'week_epoch': {'$lt': epoch}},
+            {'$set': {field: 0 for field in WEEKLY_FIELDS}, '$unset': {'week_epoch': ''}}
+        )
+        compacted += result.modified_count
+        time.sleep(pause)
+    if compacted:
+        logger.info(f"Compacted weekly counters for {compacted} users")
+    return compacted
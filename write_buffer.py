@@ -0,0 +1,164 @@
+import atexit
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+import score_events
+import user_search
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.2
+MAX_PENDING_EVENTS = 10000
+SUBMIT_TIMEOUT = 1.0
+
+
+def buffer_enabled() -> bool:
+    """Buffered score writes are opt-in through SCORE_WRITE_BUFFER=1."""
+    return os.getenv('SCORE_WRITE_BUFFER', '0').lower() in ('1', 'true', 'yes')
+
+
+class ScoreWriteBuffer:
+    """Coalesces score results per user and writes them with unordered bulk writes.
+
+    submit() only appends to an in-memory queue. A background thread flushes
+    every `flush_interval` seconds: one bulk_write for all touched users (one op per
+    user per day), one lookup of their _ids and one bulk_write of score_events
+    buckets, however many results were queued. When `max_pending_events` results are
+    waiting, submit() blocks for up to `submit_timeout` seconds and then refuses
+    the result so callers can push back on clients. Pending results are flushed
+    on shutdown. User writes that fail are re-queued for the next flush.
+    """
+
+    def __init__(self, user_scores_collection, score_events_collection, stats=None, week=None,
+                 flush_interval=FLUSH_INTERVAL, max_pending_events=MAX_PENDING_EVENTS, submit_timeout=SUBMIT_TIMEOUT):
+        self.user_scores_collection = user_scores_collection
+        self.score_events_collection = score_events_collection
+        self.stats = stats
+        self.week = week
+        self.flush_interval = flush_interval
+        self.max_pending_events = max_pending_events
+        self.submit_timeout = submit_timeout
+        self._pending = {}
+        self._pending_events = 0
+        self._oldest_pending = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = {
+            'submitted': 0,
+            'rejected': 0,
+            'flushed_events': 0,
+            'user_writes': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'requeued_events': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0
+        }
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='score-write-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        # Turn SIGTERM into a normal exit so the atexit flush still runs
+        if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def stop(self) -> None:
+        """Stop the flusher and write out everything still queued."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        while self._pending_events:
+            if not self.flush():
+                logger.error(f"Dropping {self._pending_events} buffered score events after a failed shutdown flush")
+                break
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def submit(self, username: str, score: int, timestamp: datetime = None) -> bool:
+        """Queue a score result; returns False when the buffer stayed full for submit_timeout."""
+        timestamp = timestamp or datetime.now()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending_events < self.max_pending_events or self._stop.is_set(),
+                                       timeout=self.submit_timeout):
+                self._metrics['rejected'] += 1
+                return False
+            self._pending.setdefault(username, []).append((score, timestamp))
+            self._pending_events += 1
+            self._oldest_pending = self._oldest_pending or time.monotonic()
+            self._metrics['submitted'] += 1
+        return True
+
+    def _requeue(self, batch: dict) -> None:
+        with self._cond:
+            for username, events in batch.items():
+                self._pending.setdefault(username, [])[:0] = events
+                self._pending_events += len(events)
+                self._metrics['requeued_events'] += len(events)
+            self._oldest_pending = self._oldest_pending or time.monotonic()
+
+    def flush(self) -> bool:
+        """Write out everything queued so far; returns False if the write failed."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                event_count, self._pending_events = self._pending_events, 0
+                self._oldest_pending = None
+                self._cond.notify_all()
+            if not batch:
+                return True
+
+            started = time.perf_counter()
+            try:
+                created = self._write(batch)
+            except Exception as e:
+                logger.error(f"Score write buffer flush failed, re-queueing {event_count} events: {str(e)}")
+                self._metrics['failed_flushes'] += 1
+                self._requeue(batch)
+                return False
+
+            elapsed = (time.perf_counter() - started) * 1000
+            self._metrics['flushes'] += 1
+            self._metrics['flushed_events'] += sum(len(events) for events in batch.values())
+            self._metrics['last_flush_ms'] = elapsed
+            self._metrics['max_flush_ms'] = max(self._metrics['max_flush_ms'], elapsed)
+            if self.stats:
+                total = sum(score for events in batch.values() for score, _ in events)
+                self.stats.record(count=created, score=total)
+            return True
+
+    def _write(self, batch: dict) -> int:
+        """Apply a batch of {username: [(score, timestamp)]}; returns the number of users created."""
+        created, writes, failed = score_events.apply_batch(
+            self.user_scores_collection, self.score_events_collection, batch,
+            on_insert=user_search.search_fields, week_epoch=self.week.current() if self.week else None
+        )
+        self._metrics['user_writes'] += writes
+        not_applied = {}
+        for username, positions in failed.items():
+            not_applied[username] = [event for position, event in enumerate(batch[username]) if position in positions]
+            batch[username] = [event for position, event in enumerate(batch[username]) if position not in positions]
+        self._requeue(not_applied)
+        return created
+
+    def metrics(self) -> dict:
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics['pending_events'] = self._pending_events
+            metrics['pending_users'] = len(self._pending)
+            metrics['oldest_pending_ms'] = (time.monotonic() - self._oldest_pending) * 1000 if self._oldest_pending else 0.0
+        metrics['coalescing_ratio'] = metrics['flushed_events'] / metrics['user_writes'] if metrics['user_writes'] else 0.0
+        return metrics